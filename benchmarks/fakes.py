@@ -0,0 +1,321 @@
+"""In-process stand-ins for Checkfront, Keap and Google Sheets.
+
+install() routes every HTTP request made through requests (and so gspread)
+to the fakes below. Each upstream sleeps for its configured latency and
+answers a share of requests with a 5xx error or a 429 with Retry-After.
+Requests to any other host fail, so nothing leaves the machine.
+"""
+import abc
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from unittest import mock
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import requests
+from gspread.utils import a1_to_rowcol
+
+SHEET_TITLE = "Import Data"
+
+
+class Upstream(abc.ABC):
+    host = None
+
+    def __init__(
+        self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=1
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.random = random.Random(0)
+        # (method, endpoint) and status code of every request answered
+        self.calls = Counter()
+        self.statuses = Counter()
+
+    def send(self, request):
+        url = urlsplit(request.url)
+        query = parse_qs(url.query)
+        body = request.body
+        if body and "json" in request.headers.get("Content-Type", ""):
+            body = json.loads(body)
+        with self.lock:
+            roll = self.random.random()
+            delay = self.latency + self.random.uniform(0, self.jitter)
+        time.sleep(delay)
+
+        headers = {}
+        if roll < self.throttle_rate:
+            status, data = 429, {"message": "Too many requests"}
+            headers["Retry-After"] = str(self.retry_after)
+        elif roll < self.throttle_rate + self.error_rate:
+            status, data = 503, {"message": "Service unavailable"}
+        else:
+            with self.lock:
+                status, data = self.handle(request.method, url.path, query, body)
+        with self.lock:
+            self.calls[(request.method, self.endpoint(url.path))] += 1
+            self.statuses[status] += 1
+        return status, data, headers
+
+    def endpoint(self, path):
+        # Ids are left out so calls to the same endpoint are counted together
+        return re.sub(r"/\d+(?=/|$)", "/<id>", path)
+
+    @abc.abstractmethod
+    def handle(self, method, path, query, body):
+        # (status, data) of a request that was neither throttled nor failed
+        pass
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+
+class FakeCheckfront(Upstream):
+    host = "activeaway.checkfront.co.uk"
+
+    def __init__(self, items=200, **kwargs):
+        super().__init__(**kwargs)
+        self.items = {
+            str(item_id): f"Tennis Holiday Algarve {item_id}"
+            for item_id in range(1, items + 1)
+        }
+
+    def handle(self, method, path, query, body):
+        match = re.search(r"/item/(\d+)$", path)
+        if match:
+            name = self.items.get(match.group(1))
+            if name is None:
+                return 200, {"item": {}}
+            return 200, {"item": {"item_id": match.group(1), "name": name}}
+        if path.endswith("/item"):
+            return 200, {
+                "request": {"page": 1, "pages": 1},
+                "items": {
+                    item_id: {"item_id": item_id, "name": name}
+                    for item_id, name in self.items.items()
+                },
+            }
+        return 404, {"error": path}
+
+
+class FakeKeap(Upstream):
+    host = "api.infusionsoft.com"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # email -> contact
+        self.contacts = {}
+        self.tags = Counter()
+        self.notes = 0
+
+    def handle(self, method, path, query, body):
+        if path == "/token":
+            return 200, {
+                "access_token": "access",
+                "refresh_token": "refresh",
+                "expires_in": 86400,
+            }
+        if method == "GET" and path.endswith("/contacts"):
+            contact = self.contacts.get(query.get("email", [""])[0].lower())
+            if contact is None:
+                return 200, {"count": 0, "contacts": []}
+            return 200, {"count": 1, "contacts": [contact]}
+        if method == "PUT" and path.endswith("/contacts"):
+            email = body["email_addresses"][0]["email"].lower()
+            contact = self.contacts.setdefault(
+                email, {"id": len(self.contacts) + 1, "custom_fields": []}
+            )
+            fields = {d["id"]: d for d in contact["custom_fields"]}
+            fields.update((d["id"], d) for d in body.get("custom_fields", []))
+            contact["custom_fields"] = list(fields.values())
+            return 200, {"id": contact["id"]}
+        if method == "POST" and path.endswith("/tags"):
+            self.tags.update(body["tagIds"])
+            return 200, {}
+        if method == "POST" and path.endswith("/notes"):
+            self.notes += 1
+            return 201, {"id": self.notes}
+        return 404, {"message": path}
+
+
+class FakeSheets(Upstream):
+    host = "sheets.googleapis.com"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # 1-based row -> cell values
+        self.rows = {1: ["Booking Code"]}
+
+    def handle(self, method, path, query, body):
+        match = re.match(r"/v4/spreadsheets/[^/:]+(.*)$", path)
+        rest = unquote(match.group(1)) if match else ""
+        if method == "GET" and rest == "":
+            return 200, {
+                "spreadsheetId": "spreadsheet",
+                "properties": {"title": "Master Data"},
+                "sheets": [
+                    {
+                        "properties": {
+                            "sheetId": 0,
+                            "title": SHEET_TITLE,
+                            "index": 0,
+                            "gridProperties": {"rowCount": 100000, "columnCount": 100},
+                        }
+                    }
+                ],
+            }
+        if method == "GET" and rest == "/values:batchGet":
+            return 200, {
+                "valueRanges": [
+                    {"range": name, "majorDimension": "ROWS", "values": self.read(name)}
+                    for name in query.get("ranges", [])
+                ]
+            }
+        if method == "POST" and rest == "/values:batchUpdate":
+            for data in body["data"]:
+                self.write(data["range"], data["values"])
+            return 200, {"totalUpdatedRows": len(body["data"])}
+        if method == "POST" and rest.endswith(":append"):
+            first = max(self.rows) + 1
+            for offset, values in enumerate(body["values"]):
+                self.rows[first + offset] = list(values)
+            last = first + len(body["values"]) - 1
+            return 200, {
+                "updates": {"updatedRange": f"'{SHEET_TITLE}'!A{first}:CT{last}"}
+            }
+        if method == "PUT" and rest.startswith("/values/"):
+            name = rest[len("/values/") :]
+            self.write(name, body["values"])
+            return 200, {"updatedRange": name}
+        if method == "GET" and rest.startswith("/values/"):
+            name = rest[len("/values/") :]
+            if query.get("majorDimension") == ["COLUMNS"]:
+                start, _ = self.bounds(name)
+                column = [
+                    self.cell(row, start[1]) for row in range(1, max(self.rows) + 1)
+                ]
+                return 200, {
+                    "range": name,
+                    "majorDimension": "COLUMNS",
+                    "values": [column],
+                }
+            return 200, {
+                "range": name,
+                "majorDimension": "ROWS",
+                "values": self.read(name),
+            }
+        return 404, {"error": {"message": path}}
+
+    def endpoint(self, path):
+        return re.sub(r"/values/.*?(:append)?$", r"/values/<range>\1", unquote(path))
+
+    def bounds(self, name):
+        # "'Import Data'!A2:CT2" -> ((2, 1), (2, 98)), open ends reach the last row
+        cells = name.split("!")[-1]
+        if cells == name and not re.match(r"[A-Z]+\d*(:[A-Z]+\d*)?$", cells):
+            return (1, 1), (max(self.rows), 100)
+        start, _, end = cells.partition(":")
+        end = end or start
+        start = start if re.search(r"\d", start) else f"{start}1"
+        end = end if re.search(r"\d", end) else f"{end}{max(self.rows)}"
+        return a1_to_rowcol(start), a1_to_rowcol(end)
+
+    def cell(self, row, column):
+        values = self.rows.get(row, [])
+        return values[column - 1] if column <= len(values) else ""
+
+    def read(self, name):
+        # Like the Sheets API, trailing empty cells are left out
+        (first_row, first_column), (last_row, last_column) = self.bounds(name)
+        values = []
+        for row in range(first_row, last_row + 1):
+            if row in self.rows:
+                last = min(last_column, len(self.rows[row]))
+                values.append(self.rows[row][first_column - 1 : last])
+        return values
+
+    def write(self, name, values):
+        (first_row, first_column), _ = self.bounds(name)
+        for row, row_values in enumerate(values, start=first_row):
+            cells = self.rows.setdefault(row, [])
+            end = first_column - 1 + len(row_values)
+            cells.extend([""] * (end - len(cells)))
+            cells[first_column - 1 : end] = [str(value) for value in row_values]
+
+
+class FakeServices:
+    def __init__(self, checkfront=None, keap=None, sheets=None):
+        self.checkfront = checkfront or FakeCheckfront()
+        self.keap = keap or FakeKeap()
+        self.sheets = sheets or FakeSheets()
+        self.upstreams = {
+            "checkfront": self.checkfront,
+            "keap": self.keap,
+            "sheets": self.sheets,
+        }
+        self.patches = []
+
+    def send(self, adapter, request, **kwargs):
+        host = urlsplit(request.url).hostname
+        upstream = next((u for u in self.upstreams.values() if u.host == host), None)
+        if upstream is None:
+            raise requests.ConnectionError(f"{host} is not reachable in benchmarks")
+        status, data, headers = upstream.send(request)
+        response = requests.models.Response()
+        response.status_code = status
+        response._content = json.dumps(data).encode()
+        response.headers["Content-Type"] = "application/json"
+        response.headers.update(headers)
+        response.url = request.url
+        response.request = request
+        response.encoding = "utf-8"
+        return response
+
+    def sheets_client(self, *args, **kwargs):
+        from google.auth.credentials import AnonymousCredentials
+
+        import gspread
+
+        return gspread.Client(AnonymousCredentials())
+
+    def install(self):
+        services = self
+        self.patches = [
+            mock.patch(
+                "requests.adapters.HTTPAdapter.send",
+                lambda adapter, request, **kwargs: services.send(
+                    adapter, request, **kwargs
+                ),
+            ),
+            mock.patch("gspread.service_account_from_dict", self.sheets_client),
+        ]
+        for patch in self.patches:
+            patch.start()
+        return self
+
+    def uninstall(self):
+        for patch in self.patches:
+            patch.stop()
+        self.patches = []
+
+    def summary(self):
+        return {
+            name: {
+                "calls": upstream.total_calls(),
+                "endpoints": {
+                    f"{method} {endpoint}": count
+                    for (method, endpoint), count in sorted(upstream.calls.items())
+                },
+                "statuses": {
+                    str(status): count
+                    for status, count in sorted(upstream.statuses.items())
+                },
+            }
+            for name, upstream in self.upstreams.items()
+        }
@@ -0,0 +1,50 @@
+# Offline settings for the benchmarks, no real credentials or services needed
+import os
+import tempfile
+
+import dj_database_url
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SECRET_KEY = "benchmarks"
+DEBUG = False
+USE_TZ = True
+ALLOWED_HOSTS = ["*"]
+
+INSTALLED_APPS = [
+    "django.contrib.contenttypes",
+    "django.contrib.auth",
+    "rest_framework",
+    "main",
+]
+ROOT_URLCONF = "benchmarks.urls"
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ.get(
+            "BENCHMARK_DATABASE", os.path.join(tempfile.gettempdir(), "bench.sqlite3")
+        ),
+        "OPTIONS": {"timeout": 30},
+    }
+}
+if os.environ.get("BENCHMARK_DATABASE_URL"):
+    DATABASES["default"] = dj_database_url.parse(os.environ["BENCHMARK_DATABASE_URL"])
+else:
+    # SQLite has a single writer, so the stages of a sync run one at a time
+    PIPELINE_MAX_WORKERS = 1
+    CHECKFRONT_ITEM_FETCH_WORKERS = 1
+    KEAP_PASSENGER_WORKERS = 1
+DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+CHECKFRONT_API_KEY = "key"
+CHECKFRONT_API_SECRET = "secret"
+CHECKFRONT_API_BASE_URL = "https://activeaway.checkfront.co.uk/api/3.0"
+KEAP_CLIENT_ID = "client"
+KEAP_CLIENT_SECRET = "secret"
+KEAP_REDIRECT_URI = "https://localhost/keap/callback"
+GOOGLE_API_CREDENTIALS = {}
+GOOGLE_API_SPREADSHEET = "spreadsheet"
+
+# Failed syncs are retried within the run instead of minutes later
+SYNC_JOB_RETRY_DELAY = 1
+SYNC_JOB_MAX_RETRY_DELAY = 5
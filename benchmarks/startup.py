@@ -0,0 +1,47 @@
+"""Measure how long a worker takes to boot.
+
+Run from the repository root:
+
+    python -m benchmarks.startup [--runs 10]
+
+Every run starts a fresh interpreter that sets Django up and imports the
+modules a gunicorn worker and the sync worker load. No remote service is
+reachable with the benchmark settings, so any import-time network call
+makes the run fail.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BOOT = """
+import django
+django.setup()
+import main.views
+import main.utils.jobs
+"""
+
+
+def boot_time():
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE="benchmarks.settings")
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", BOOT], env=env, check=True)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    times = sorted(boot_time() for _ in range(args.runs))
+    print(f"worker boot over {args.runs} runs")
+    print(f"  median {statistics.median(times) * 1000:.1f} ms")
+    print(f"  min    {times[0] * 1000:.1f} ms")
+    print(f"  max    {times[-1] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
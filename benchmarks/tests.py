@@ -0,0 +1,59 @@
+import json
+import os
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+
+import requests
+from django.test import SimpleTestCase
+
+from benchmarks import webhooks
+from benchmarks.fakes import FakeCheckfront, FakeServices, Upstream
+
+
+class FakeServicesTests(SimpleTestCase):
+    def setUp(self):
+        self.services = FakeServices(
+            checkfront=FakeCheckfront(items=2, throttle_rate=0.5, retry_after=7)
+        ).install()
+        self.addCleanup(self.services.uninstall)
+
+    def test_requests_are_answered_and_counted_per_endpoint(self):
+        url = "https://activeaway.checkfront.co.uk/api/3.0/item/1"
+        statuses = [requests.get(url).status_code for _ in range(10)]
+
+        # The seeded share of requests is throttled
+        self.assertEqual(set(statuses), {200, 429})
+        self.assertEqual(
+            self.services.summary()["checkfront"]["endpoints"],
+            {"GET /api/3.0/item/<id>": 10},
+        )
+
+    def test_other_hosts_are_not_reachable(self):
+        with self.assertRaises(requests.ConnectionError):
+            requests.get("https://example.com/")
+
+    def test_upstream_must_answer_requests(self):
+        with self.assertRaises(TypeError):
+            Upstream()
+
+
+class WebhooksBenchmarkTests(SimpleTestCase):
+    def test_upstream_values(self):
+        self.assertEqual(
+            webhooks.upstream_values(["keap=0.5"], {"sheets": 0.1}),
+            {"checkfront": 0.0, "keap": 0.5, "sheets": 0.1},
+        )
+
+    def test_results_of_another_database_are_flagged(self):
+        results = {key: 1.0 for key in webhooks.KEY_RESULTS}
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        baseline = os.path.join(directory.name, "baseline.json")
+        with open(baseline, "w") as f:
+            json.dump({**results, "commit": "abc", "database": "sqlite"}, f)
+
+        output = StringIO()
+        with redirect_stdout(output):
+            webhooks.compare({**results, "database": "postgresql"}, baseline)
+        self.assertIn("measured on sqlite, not postgresql", output.getvalue())
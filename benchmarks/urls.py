@@ -0,0 +1,8 @@
+from django.urls import path
+
+from main.views import MetricsView, WebhooksView
+
+urlpatterns = [
+    path("webhooks/", WebhooksView.as_view()),
+    path("metrics/", MetricsView.as_view()),
+]
@@ -0,0 +1,339 @@
+"""Benchmark webhook intake and syncing against fake upstream services.
+
+Run from the repository root:
+
+    python -m benchmarks.webhooks [--bookings 200] [--concurrency 8]
+        [--latency keap=0.2] [--error-rate sheets=0.01] [--throttle-rate keap=0.02]
+        [--compare <commit or results file>]
+
+Synthetic bookings are posted to WebhooksView concurrently, then the sync
+workers drain the queue against the fakes in benchmarks.fakes. Intake and
+sync latency, throughput and outbound calls per booking are printed and
+saved to benchmarks/results/<commit>.json, so runs of two commits can be
+compared with --compare. With SQLite the syncs run one at a time on a
+single worker, set BENCHMARK_DATABASE_URL to a Postgres database to measure
+concurrent syncs. Every result records the database it was measured on.
+"""
+import argparse
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from benchmarks.fakes import (  # noqa: E402
+    FakeCheckfront,
+    FakeKeap,
+    FakeServices,
+    FakeSheets,
+)
+from main.models import KeapAuth, SyncJob  # noqa: E402
+from main.utils import sheet_api  # noqa: E402
+from main.utils.payloads import synthetic_booking  # noqa: E402
+from main.utils.jobs import work  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DEFAULT_LATENCY = {"checkfront": 0.1, "keap": 0.2, "sheets": 0.25}
+# Compared with --compare, lower is better for all but throughput
+KEY_RESULTS = [
+    "intake_p50_ms",
+    "intake_p99_ms",
+    "sync_p50_ms",
+    "sync_p99_ms",
+    "end_to_end_p99_ms",
+    "throughput_per_second",
+    "calls_per_booking",
+]
+
+
+def upstream_values(values, default):
+    # ["keap=0.2", "sheets=0.1"] -> {"keap": 0.2, "sheets": 0.1}
+    parsed = {name: default.get(name, 0.0) for name in ("checkfront", "keap", "sheets")}
+    for value in values or []:
+        name, _, number = value.partition("=")
+        if name not in parsed:
+            raise argparse.ArgumentTypeError(f"Unknown upstream {name}")
+        parsed[name] = float(number)
+    return parsed
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def commit():
+    try:
+        sha = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{sha}-dirty" if dirty else sha
+
+
+def reset_database():
+    call_command("migrate", verbosity=0)
+    call_command("flush", interactive=False, verbosity=0)
+    # An expired token, the first sync goes through a refresh
+    KeapAuth.objects.create(
+        access_token="expired",
+        refresh_token="refresh",
+        expires_at=timezone.now() - timedelta(hours=1),
+    )
+
+
+def post_webhooks(bookings, concurrency):
+    local = threading.local()
+
+    def post(booking):
+        if not hasattr(local, "client"):
+            local.client = Client()
+        started = time.perf_counter()
+        response = local.client.post(
+            "/webhooks/", {"booking": booking}, content_type="application/json"
+        )
+        elapsed = time.perf_counter() - started
+        connection.close()
+        return elapsed, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(post, bookings))
+    return results, time.perf_counter() - started
+
+
+def drain_queue(workers, timeout):
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(target=work, args=(stop_event, 0.05), daemon=True)
+        for _ in range(workers)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    active = [SyncJob.PENDING, SyncJob.RUNNING]
+    while SyncJob.objects.filter(status__in=active).exists():
+        if time.perf_counter() - started > timeout:
+            print(f"Queue not drained after {timeout}s, stopping")
+            break
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - started
+    stop_event.set()
+    for thread in threads:
+        thread.join()
+    return elapsed
+
+
+def run(options):
+    reset_database()
+    services = FakeServices(
+        checkfront=FakeCheckfront(**options["checkfront"]),
+        keap=FakeKeap(**options["keap"]),
+        sheets=FakeSheets(**options["sheets"]),
+    ).install()
+    if options["flush_window"] is not None:
+        sheet_api.writer.window = options["flush_window"]
+    bookings = [synthetic_booking(i) for i in range(options["bookings"])]
+    intake, intake_seconds = post_webhooks(bookings, options["concurrency"])
+    sync_seconds = drain_queue(options["workers"], options["timeout"])
+    services.uninstall()
+
+    done = SyncJob.objects.filter(status=SyncJob.DONE)
+    sync_times = [
+        (job.finished_at - job.last_attempt_at).total_seconds()
+        for job in done
+        if job.last_attempt_at
+    ]
+    end_to_end = [(job.finished_at - job.created_at).total_seconds() for job in done]
+    upstreams = services.summary()
+    calls = sum(upstream["calls"] for upstream in upstreams.values())
+    intake_times = [elapsed for elapsed, _ in intake]
+    return {
+        "commit": commit(),
+        "database": connection.vendor,
+        "options": {
+            key: value for key, value in options.items() if key not in ("compare",)
+        },
+        "bookings": len(bookings),
+        "accepted": sum(1 for _, status in intake if status in (200, 202)),
+        "synced": done.count(),
+        "failed": SyncJob.objects.filter(status=SyncJob.FAILED).count(),
+        "retried": SyncJob.objects.filter(attempts__gt=1).count(),
+        "intake_per_second": len(bookings) / intake_seconds,
+        "intake_p50_ms": percentile(intake_times, 50) * 1000,
+        "intake_p99_ms": percentile(intake_times, 99) * 1000,
+        "sync_seconds": sync_seconds,
+        "throughput_per_second": done.count() / sync_seconds,
+        "sync_p50_ms": percentile(sync_times, 50) * 1000,
+        "sync_p99_ms": percentile(sync_times, 99) * 1000,
+        "end_to_end_p50_ms": percentile(end_to_end, 50) * 1000,
+        "end_to_end_p99_ms": percentile(end_to_end, 99) * 1000,
+        "calls_per_booking": calls / len(bookings),
+        "upstreams": {
+            name: dict(upstream, per_booking=upstream["calls"] / len(bookings))
+            for name, upstream in upstreams.items()
+        },
+    }
+
+
+def report(results):
+    print(
+        f"commit {results['commit']}, {results['bookings']} bookings "
+        f"on {results['database']}"
+    )
+    print(
+        f"  intake      {results['intake_per_second']:.1f}/s, "
+        f"p50 {results['intake_p50_ms']:.1f} ms, p99 {results['intake_p99_ms']:.1f} ms"
+    )
+    print(
+        f"  sync        {results['throughput_per_second']:.2f}/s, "
+        f"p50 {results['sync_p50_ms']:.1f} ms, p99 {results['sync_p99_ms']:.1f} ms"
+    )
+    print(
+        f"  end to end  p50 {results['end_to_end_p50_ms']:.1f} ms, "
+        f"p99 {results['end_to_end_p99_ms']:.1f} ms"
+    )
+    print(
+        f"  jobs        {results['synced']} synced, {results['failed']} failed, "
+        f"{results['retried']} retried"
+    )
+    print(f"  calls       {results['calls_per_booking']:.2f} per booking")
+    for name, upstream in results["upstreams"].items():
+        statuses = ", ".join(f"{k}: {v}" for k, v in upstream["statuses"].items())
+        print(f"    {name:<10} {upstream['per_booking']:.2f} per booking ({statuses})")
+        for endpoint, count in upstream["endpoints"].items():
+            print(f"      {endpoint} {count}")
+
+
+def results_path(name):
+    if os.path.exists(name):
+        return name
+    return os.path.join(RESULTS_DIR, f"{name}.json")
+
+
+def compare(results, name):
+    with open(results_path(name)) as f:
+        baseline = json.load(f)
+    print(f"compared with {baseline['commit']}")
+    if baseline.get("database") != results["database"]:
+        print(
+            f"  measured on {baseline.get('database', 'an unknown database')}, "
+            f"not {results['database']}, the results are not comparable"
+        )
+    for key in KEY_RESULTS:
+        before, after = baseline[key], results[key]
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"  {key:<22} {before:10.2f} -> {after:10.2f} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bookings", type=int, default=200)
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Concurrent webhook deliveries"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Sync worker threads, 4 by default, more than 1 needs Postgres",
+    )
+    parser.add_argument(
+        "--flush-window",
+        type=float,
+        help="Seconds Master Data rows are buffered, defaults to the setting",
+    )
+    parser.add_argument(
+        "--latency",
+        action="append",
+        metavar="UPSTREAM=SECONDS",
+        help="Response time of checkfront, keap or sheets",
+    )
+    parser.add_argument(
+        "--jitter",
+        action="append",
+        metavar="UPSTREAM=SECONDS",
+        help="Random extra response time, up to this many seconds",
+    )
+    parser.add_argument(
+        "--error-rate",
+        action="append",
+        metavar="UPSTREAM=SHARE",
+        help="Share of requests answered with a 503",
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        action="append",
+        metavar="UPSTREAM=SHARE",
+        help="Share of requests answered with a 429",
+    )
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="Results file, by default per commit")
+    parser.add_argument("--compare", help="Commit or results file to compare with")
+    args = parser.parse_args()
+    if connection.vendor == "sqlite":
+        # SQLite has a single writer, concurrent workers would mostly wait on locks
+        if args.workers and args.workers > 1:
+            parser.error("Several sync workers need BENCHMARK_DATABASE_URL (Postgres)")
+        args.workers = 1
+    elif args.workers is None:
+        args.workers = 4
+
+    latency = upstream_values(args.latency, DEFAULT_LATENCY)
+    jitter = upstream_values(
+        args.jitter, {name: value / 2 for name, value in latency.items()}
+    )
+    error_rate = upstream_values(args.error_rate, {})
+    throttle_rate = upstream_values(args.throttle_rate, {})
+    options = {
+        "bookings": args.bookings,
+        "concurrency": args.concurrency,
+        "workers": args.workers,
+        "flush_window": args.flush_window,
+        "timeout": args.timeout,
+        "compare": args.compare,
+    }
+    for name in ("checkfront", "keap", "sheets"):
+        options[name] = {
+            "latency": latency[name],
+            "jitter": jitter[name],
+            "error_rate": error_rate[name],
+            "throttle_rate": throttle_rate[name],
+        }
+
+    results = run(options)
+    report(results)
+    output = args.output or results_path(results["commit"])
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results saved to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
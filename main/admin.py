@@ -1,8 +1,43 @@
 from django.contrib import admin
 
-from main.models import CheckfrontStatus, Product, Venue
+from main.models import CheckfrontStatus, Item, Product, SyncJob, Venue
+from main.utils.jobs import replayable_jobs, requeue_job
 
 # Register your models here.
 admin.site.register(Product)
 admin.site.register(Venue)
 admin.site.register(CheckfrontStatus)
+
+
+@admin.register(Item)
+class ItemAdmin(admin.ModelAdmin):
+    list_display = ("item_id", "name", "found", "updated_at")
+    list_filter = ("found",)
+    search_fields = ("item_id", "name")
+
+
+@admin.register(SyncJob)
+class SyncJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "booking_code",
+        "status",
+        "attempts",
+        "created_at",
+        "last_attempt_at",
+        "waiting_for",
+        "failed_stage",
+    )
+    list_filter = ("status", "waiting_for")
+    search_fields = ("booking_code", "failed_stage")
+    actions = ["replay_failed"]
+
+    @admin.action(description="Replay the selected failed syncs")
+    def replay_failed(self, request, queryset):
+        replayable, superseded = replayable_jobs(queryset)
+        for job in replayable:
+            requeue_job(job)
+        self.message_user(
+            request,
+            f"Queued {len(replayable)} failed syncs for replay from their failed "
+            f"stage, skipped {len(superseded)} with a newer delivery.",
+        )
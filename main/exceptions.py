@@ -8,3 +8,27 @@ class RequestError(Exception):
 
 class KeapAPIError(Exception):
     pass
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, upstream, retry_in):
+        self.upstream = upstream
+        self.retry_in = retry_in
+        super().__init__(f"{upstream} is unavailable, retrying in {retry_in:.0f}s")
+
+
+class QuotaExceededError(CircuitOpenError):
+    # Waited out like an open circuit, the upstream answers again once it resets
+    def __init__(self, upstream, retry_in):
+        self.upstream = upstream
+        self.retry_in = retry_in
+        Exception.__init__(self, f"{upstream} quota used up, resets in {retry_in:.0f}s")
+
+
+class PipelineError(Exception):
+    def __init__(self, errors, timings):
+        self.errors = errors
+        self.timings = timings
+        super().__init__(
+            ", ".join(f"{stage}: {error!r}" for stage, error in errors.items())
+        )
@@ -0,0 +1,150 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from main.models import SyncJob
+from main.utils import checkfront_api, sheet_api
+from main.utils.booking_mapper import map_booking, map_bookings, resolve_order
+from main.utils.checkpoints import clear_checkpoint, load_checkpoint, save_checkpoint
+from main.utils.snapshots import load_snapshot, save_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_booking(summary):
+    try:
+        return checkfront_api.booking_from_api(
+            checkfront_api.fetch_booking(summary["booking_id"])
+        )
+    except Exception:
+        logger.exception(f"Could not fetch booking {summary.get('code')}")
+        return None
+    finally:
+        connection.close()
+
+
+def map_one(booking):
+    try:
+        return map_booking(booking, resolve_order(booking))
+    except Exception:
+        logger.exception(f"Could not map booking {booking.get('code')}")
+        return None
+
+
+def map_page(bookings):
+    # Item names of the whole page are resolved in one go
+    try:
+        return map_bookings(bookings)
+    except Exception:
+        logger.exception("Could not map the page, mapping bookings one by one")
+        return [map_one(booking) for booking in bookings]
+
+
+def queue_booking(booking):
+    SyncJob.objects.create(booking_code=booking["code"], payload=booking)
+
+
+def backfill_page(bookings, records, keap):
+    # Write the Master Data rows of a whole page in one flush, the Keap syncs are
+    # queued so they run in order with the webhooks of the same bookings.
+    # Returns the bookings written, the syncs queued and the bookings that failed.
+    active = set(
+        SyncJob.objects.filter(
+            booking_code__in=[booking["code"] for booking in bookings],
+            status__in=[SyncJob.PENDING, SyncJob.RUNNING],
+        ).values_list("booking_code", flat=True)
+    )
+    rows = {}
+    written = queued = failed = 0
+    for booking, record in zip(bookings, records):
+        if booking["code"] in active or record is None:
+            # A sync worker holds a newer delivery, or the booking could not be mapped
+            queue_booking(booking)
+            queued += 1
+        elif load_snapshot(record.code, "sheet") != list(record.sheet_row):
+            rows[record.code] = list(record.sheet_row)
+
+    futures = sheet_api.writer.write_rows(rows)
+    wait(futures.values(), timeout=sheet_api.WRITE_TIMEOUT)
+    for booking, record in zip(bookings, records):
+        if booking["code"] in active or record is None:
+            continue
+        future = futures.get(record.code)
+        if future is not None and (not future.done() or future.exception()):
+            # The sync worker retries it later
+            logger.error(f"Backfill of booking {record.code} failed, queued it")
+            queue_booking(booking)
+            failed += 1
+            continue
+        if future is not None:
+            save_snapshot(record.code, "sheet", rows[record.code])
+        written += 1
+        # Without Keap the booking is not synced, so no fingerprint is recorded
+        if keap:
+            queue_booking(booking)
+            queued += 1
+    return written, queued, failed
+
+
+class Command(BaseCommand):
+    help = (
+        "Sync every Checkfront booking of a date range into Master Data and Keap. "
+        "The rows of each page are written together, the Keap syncs are queued for "
+        "the sync workers. Progress is checkpointed after each page, an "
+        "interrupted run resumes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start-date", required=True, help="YYYY-MM-DD")
+        parser.add_argument("--end-date", required=True, help="YYYY-MM-DD")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Bookings fetched from Checkfront concurrently",
+        )
+        parser.add_argument(
+            "--no-keap",
+            action="store_true",
+            help="Only rebuild Master Data, leave Keap alone",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint and start from the first page",
+        )
+
+    def handle(self, *args, **options):
+        params = {"start_date": options["start_date"], "end_date": options["end_date"]}
+        name = f"backfill:{options['start_date']}:{options['end_date']}"
+        if options["restart"]:
+            clear_checkpoint(name)
+        start_page = load_checkpoint(name).get("page", 0) + 1
+        if start_page > 1:
+            self.stdout.write(f"Resuming from page {start_page}")
+
+        keap = not options["no_keap"]
+        written = queued = failed = 0
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            for page, pages, summaries in checkfront_api.iter_booking_pages(
+                params, start_page=start_page
+            ):
+                fetched = list(executor.map(fetch_booking, summaries))
+                bookings = [booking for booking in fetched if booking is not None]
+                page_written, page_queued, page_failed = backfill_page(
+                    bookings, map_page(bookings), keap
+                )
+                written += page_written
+                queued += page_queued
+                failed += page_failed + fetched.count(None)
+                save_checkpoint(name, {"page": page})
+                self.stdout.write(
+                    f"Page {page}/{pages}: {written} bookings written, {queued} "
+                    f"syncs queued, {failed} failed"
+                )
+        clear_checkpoint(name)
+        self.stdout.write(
+            f"Backfill done: {written} written, {queued} syncs queued, {failed} failed"
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from main.utils.sheet_api import build_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the booking code to Master Data row index from column A. Run it "
+        "after editing the Import Data sheet by hand, or from the scheduler."
+    )
+
+    def handle(self, *args, **options):
+        rows = build_index()
+        self.stdout.write(f"Indexed {len(rows)} booking codes")
@@ -0,0 +1,122 @@
+import csv
+import sys
+from datetime import datetime
+
+import pytz
+from django.core.management.base import BaseCommand
+
+from main.models import BookingFingerprint, BookingSnapshot, SyncJob
+from main.utils import checkfront_api, sheet_api
+from main.utils.booking_mapper import sheet_column
+
+# 0-based Import Data columns compared with Checkfront
+CODE = sheet_column("booking", "code")
+STATUS = sheet_column("record", "status")
+CREATED_DATE = sheet_column("record", "created_day")
+PAID_TOTAL = sheet_column("order", "paid_total")
+TOTAL = sheet_column("order", "total")
+START_DATE = sheet_column("record", "start_day")
+END_DATE = sheet_column("record", "end_day")
+
+
+def format_date(timestamp, date_format):
+    if not timestamp:
+        return ""
+    return datetime.fromtimestamp(
+        int(timestamp), pytz.timezone("Europe/London")
+    ).strftime(date_format)
+
+
+def same_amount(sheet_value, checkfront_value):
+    try:
+        return abs(float(sheet_value or 0) - float(checkfront_value or 0)) < 0.005
+    except ValueError:
+        return sheet_value == str(checkfront_value)
+
+
+def compare(row, booking):
+    # Yield (field, sheet value, Checkfront value) for every difference
+    def cell(column):
+        return row[column] if column < len(row) else ""
+
+    status = checkfront_api.get_statuses().get(
+        booking.get("status_id"), booking.get("status_id")
+    )
+    if cell(STATUS) != status:
+        yield "status", cell(STATUS), status
+    for field, column in [("total", TOTAL), ("paid_total", PAID_TOTAL)]:
+        if field in booking and not same_amount(cell(column), booking[field]):
+            yield field, cell(column), booking[field]
+    for field, column, date_format in [
+        ("created_date", CREATED_DATE, "%d/%m/%Y"),
+        ("start_date", START_DATE, "%Y%m%d"),
+        ("end_date", END_DATE, "%Y%m%d"),
+    ]:
+        if field in booking:
+            expected = format_date(booking[field], date_format)
+            if cell(column) != expected:
+                yield field, cell(column), expected
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare Master Data with the Checkfront bookings of a date range and "
+        "report every booking that is missing or differs"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start-date", required=True, help="YYYY-MM-DD")
+        parser.add_argument("--end-date", required=True, help="YYYY-MM-DD")
+        parser.add_argument(
+            "--output", help="Write the CSV report to this file instead of stdout"
+        )
+        parser.add_argument(
+            "--repair",
+            action="store_true",
+            help="Queue a sync job for every booking that is missing or differs",
+        )
+
+    def handle(self, *args, **options):
+        # Index the sheet by booking code, the first row wins like worksheet.find
+        rows = {}
+        for row in sheet_api.read_all_rows()[1:]:
+            if row and row[CODE]:
+                rows.setdefault(row[CODE], row)
+        self.stderr.write(f"Read {len(rows)} bookings from Master Data")
+
+        output = open(options["output"], "w", newline="") if options["output"] else None
+        report = csv.writer(output or sys.stdout)
+        report.writerow(["code", "field", "master_data", "checkfront"])
+        checked = 0
+        to_repair = []
+        params = {"start_date": options["start_date"], "end_date": options["end_date"]}
+        for _, _, bookings in checkfront_api.iter_booking_pages(params):
+            for booking in bookings:
+                checked += 1
+                row = rows.get(booking.get("code"))
+                if row is None:
+                    differences = [("missing", "", booking.get("code"))]
+                else:
+                    differences = list(compare(row, booking))
+                for difference in differences:
+                    report.writerow([booking.get("code"), *difference])
+                if differences:
+                    to_repair.append(booking)
+        if output:
+            output.close()
+        self.stderr.write(
+            f"Checked {checked} bookings, {len(to_repair)} missing or different"
+        )
+
+        if options["repair"]:
+            for summary in to_repair:
+                booking = checkfront_api.booking_from_api(
+                    checkfront_api.fetch_booking(summary["booking_id"])
+                )
+                # Forget the last sync, so the repair rewrites the whole row
+                BookingFingerprint.objects.filter(code=booking["code"]).delete()
+                BookingSnapshot.objects.filter(
+                    code=booking["code"], key="sheet"
+                ).delete()
+                SyncJob.objects.create(booking_code=booking["code"], payload=booking)
+            self.stderr.write(f"Queued {len(to_repair)} repair syncs")
@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from main.models import SyncJob
+from main.utils.jobs import replay_job, replayable_jobs, requeue_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay failed booking syncs from the stage that failed. Bookings that "
+        "were delivered again since their sync failed are left alone."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--code", nargs="*", help="Only these booking codes")
+        parser.add_argument(
+            "--stage", help="Only syncs whose failed stage contains this text"
+        )
+        parser.add_argument("--limit", type=int, help="Replay at most this many")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Syncs replayed concurrently",
+        )
+        parser.add_argument(
+            "--queue",
+            action="store_true",
+            help="Hand the syncs to the sync workers instead of replaying them here",
+        )
+
+    def handle(self, *args, **options):
+        jobs = SyncJob.objects.filter(status=SyncJob.FAILED)
+        if options["code"]:
+            jobs = jobs.filter(booking_code__in=options["code"])
+        if options["stage"]:
+            jobs = jobs.filter(failed_stage__contains=options["stage"])
+        replayable, superseded = replayable_jobs(jobs)
+        if superseded:
+            self.stdout.write(f"Skipping {len(superseded)} with a newer delivery")
+        replayable = replayable[: options["limit"]]
+
+        if options["queue"]:
+            for job in replayable:
+                requeue_job(job)
+            self.stdout.write(f"Queued {len(replayable)} failed syncs for replay")
+            return
+
+        # One job per booking is left, so bookings are replayed side by side
+        self.stdout.write(f"Replaying {len(replayable)} failed syncs")
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            results = list(executor.map(replay_job, replayable))
+        self.stdout.write(
+            f"Replayed {len(results)} syncs, {results.count(True)} succeeded, "
+            f"{results.count(False)} failed again"
+        )
@@ -0,0 +1,194 @@
+import copy
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from main.utils.payloads import synthetic_booking
+
+# Upper bounds of the latency distribution, in milliseconds
+LATENCY_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+
+def load_payloads(paths):
+    # .json files hold one delivery or a list, .jsonl files one delivery per line
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.endswith((".json", ".jsonl"))
+            )
+        else:
+            files.append(path)
+
+    bookings = []
+    for path in files:
+        with open(path) as f:
+            if path.endswith(".jsonl"):
+                deliveries = [json.loads(line) for line in f if line.strip()]
+            else:
+                deliveries = json.load(f)
+                if isinstance(deliveries, dict):
+                    deliveries = [deliveries]
+        # Both whole webhook bodies and bare bookings are accepted
+        bookings += [delivery.get("booking", delivery) for delivery in deliveries]
+    return bookings
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Post recorded or synthetic Checkfront webhooks to a webhook URL at a fixed "
+        "rate or concurrency and report the latency and error distributions. "
+        "Point it at staging or a benchmark server, never production: the "
+        "bookings are synced to whatever Keap and Master Data the server uses."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--payloads",
+            nargs="*",
+            default=[],
+            help="Recorded deliveries, .json or .jsonl files or directories of them",
+        )
+        parser.add_argument(
+            "--synthetic",
+            type=int,
+            default=0,
+            help="Number of synthetic bookings to add to the recorded ones",
+        )
+        parser.add_argument(
+            "--count",
+            type=int,
+            help="Deliveries to send, cycling through the payloads (default: each once)",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            help="Deliveries per second, by default they are sent as fast as possible",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Deliveries in flight at the same time",
+        )
+        parser.add_argument(
+            "--url",
+            required=True,
+            help="Webhook URL of a staging or benchmark server",
+        )
+        parser.add_argument(
+            "--fresh-codes",
+            action="store_true",
+            help="Give every delivery its own booking code instead of re-delivering",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        bookings = load_payloads(options["payloads"])
+        bookings += [
+            synthetic_booking(i, random.Random(options["seed"] + i))
+            for i in range(options["synthetic"])
+        ]
+        if not bookings:
+            raise CommandError("Pass --payloads or --synthetic")
+        count = options["count"] or len(bookings)
+        deliveries = []
+        for i in range(count):
+            booking = bookings[i % len(bookings)]
+            if options["fresh_codes"]:
+                booking = copy.deepcopy(booking)
+                booking["code"] = f"{booking.get('code', 'REPLAY')}-R{i}"
+            deliveries.append(booking)
+
+        send = self.sender(options["url"])
+        rate = options["rate"]
+        self.stderr.write(
+            f"Sending {count} deliveries "
+            + (f"at {rate}/s" if rate else f"{options['concurrency']} at a time")
+            + f" to {options['url']}"
+        )
+
+        def timed(booking, scheduled):
+            try:
+                outcome = send(booking)
+            except Exception as e:
+                outcome = type(e).__name__
+            # At a fixed rate the time spent waiting for a free sender counts too
+            return time.perf_counter() - scheduled, outcome
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            futures = []
+            for i, booking in enumerate(deliveries):
+                scheduled = time.perf_counter()
+                if rate:
+                    scheduled = started + i / rate
+                    time.sleep(max(0, scheduled - time.perf_counter()))
+                futures.append(executor.submit(timed, booking, scheduled))
+            results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - started
+
+        self.report(results, elapsed)
+
+    def sender(self, url):
+        local = threading.local()
+
+        def send(booking):
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            response = local.session.post(url, json={"booking": booking}, timeout=30)
+            return str(response.status_code)
+
+        return send
+
+    def report(self, results, elapsed):
+        latencies = sorted(latency * 1000 for latency, _ in results)
+        outcomes = Counter(outcome for _, outcome in results)
+        self.stdout.write(
+            f"Sent {len(results)} deliveries in {elapsed:.1f}s "
+            f"({len(results) / elapsed:.1f}/s)"
+        )
+        self.stdout.write(
+            "Latency ms: "
+            + ", ".join(
+                f"{name} {value:.1f}"
+                for name, value in [
+                    ("min", latencies[0]),
+                    ("p50", percentile(latencies, 50)),
+                    ("p90", percentile(latencies, 90)),
+                    ("p99", percentile(latencies, 99)),
+                    ("max", latencies[-1]),
+                ]
+            )
+        )
+
+        self.stdout.write("Latency distribution:")
+        lower = 0
+        for upper in LATENCY_BUCKETS + [None]:
+            share = sum(
+                1 for ms in latencies if ms >= lower and (upper is None or ms < upper)
+            )
+            label = f"{lower}-{upper} ms" if upper else f">= {lower} ms"
+            self.stdout.write(
+                f"  {label:<14} {share:6d} {share / len(latencies) * 100:5.1f}%"
+            )
+            lower = upper
+
+        self.stdout.write("Outcomes:")
+        for outcome, share in sorted(outcomes.items()):
+            self.stdout.write(
+                f"  {outcome:<14} {share:6d} {share / len(results) * 100:5.1f}%"
+            )
@@ -0,0 +1,192 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from main.management.commands.backfill_bookings import fetch_booking, map_page
+from main.models import KeapContact
+from main.utils import checkfront_api, sheet_api
+from main.utils.booking_mapper import record_from_row
+from main.utils.checkpoints import clear_checkpoint, load_checkpoint, save_checkpoint
+from main.utils.circuit_breakers import open_circuit
+from main.utils.snapshots import save_snapshot
+from main.utils.sync import build_lead_contact, build_passenger_contacts
+
+logger = logging.getLogger(__name__)
+
+
+def push_contact(record, keap_contact, keep_prefix):
+    # Every field and the tags are sent, the mapping of any of them may have changed
+    fields = keap_contact.payload()
+    if keep_prefix:
+        # Master Data has no passenger titles, keep the one Keap has
+        del fields["prefix"]
+    while True:
+        try:
+            # Notes were created when the booking was synced, they are not repeated
+            keap_contact.add_or_update_contact_in_keap(fields, notes=False)
+            save_snapshot(
+                record.code, f"contact:{keap_contact.email()}", keap_contact.payload()
+            )
+            return True
+        except Exception as e:
+            circuit = open_circuit(e)
+            if circuit is None:
+                logger.exception(
+                    f"Re-sync of Keap contact {keap_contact.email()} failed"
+                )
+                return False
+            # Keap is down, wait until the circuit lets requests through again
+            logger.warning(f"Re-sync of {keap_contact.email()} waiting, {circuit}")
+            time.sleep(max(circuit.retry_in, 1))
+        finally:
+            connection.close()
+
+
+def contacts_to_push(records):
+    # Each email is pushed once, from the first booking it is seen in. A contact
+    # last synced from another booking is left alone, that booking is newer. A
+    # pushed contact is linked to its booking, so later batches skip it too.
+    # Returns (record, contact, is passenger) and the number of contacts skipped.
+    contacts = [
+        (record, keap_contact, passenger)
+        for record in records
+        for keap_contact, passenger in [
+            (build_lead_contact(record), False),
+            *((contact, True) for contact in build_passenger_contacts(record)),
+        ]
+        if keap_contact.email()
+    ]
+    links = dict(
+        KeapContact.objects.filter(
+            email__in={keap_contact.email() for _, keap_contact, _ in contacts}
+        ).values_list("email", "booking_id")
+    )
+    to_push = []
+    seen = set()
+    for record, keap_contact, passenger in contacts:
+        email = keap_contact.email()
+        if email in seen or links.get(email) not in (None, "", record.code):
+            continue
+        seen.add(email)
+        to_push.append((record, keap_contact, passenger))
+    return to_push, len(contacts) - len(to_push)
+
+
+class Command(BaseCommand):
+    help = (
+        "Push the contacts of every booking to Keap again, after the Keap custom "
+        "field or tag mapping changed. Contacts are de-duplicated by email and "
+        "progress is checkpointed, an interrupted run resumes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--source",
+            choices=["sheet", "checkfront"],
+            default="sheet",
+            help="Read the bookings from Master Data or from Checkfront",
+        )
+        parser.add_argument("--start-date", help="YYYY-MM-DD, Checkfront only")
+        parser.add_argument("--end-date", help="YYYY-MM-DD, Checkfront only")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Contacts upserted concurrently, the Keap rate limits still apply",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=200,
+            help="Master Data rows per checkpoint",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint and start from the beginning",
+        )
+
+    def handle(self, *args, **options):
+        if options["source"] == "checkfront":
+            if not (options["start_date"] and options["end_date"]):
+                raise CommandError(
+                    "--source checkfront needs --start-date and --end-date"
+                )
+            name = f"resync_keap:{options['start_date']}:{options['end_date']}"
+        else:
+            name = "resync_keap:sheet"
+        if options["restart"]:
+            clear_checkpoint(name)
+        start = load_checkpoint(name).get("position", 0)
+        if start:
+            self.stdout.write(f"Resuming after {start}")
+
+        from_sheet = options["source"] == "sheet"
+        pushed = failed = skipped = unmapped = 0
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            if options["source"] == "checkfront":
+                batches = self.checkfront_batches(executor, options, start)
+            else:
+                batches = self.sheet_batches(options["batch_size"], start)
+            for position, total, records, not_mapped in batches:
+                to_push, duplicates = contacts_to_push(records)
+                results = list(
+                    executor.map(
+                        lambda contact: push_contact(
+                            contact[0], contact[1], contact[2] and from_sheet
+                        ),
+                        to_push,
+                    )
+                )
+                pushed += results.count(True)
+                failed += results.count(False)
+                skipped += duplicates
+                unmapped += not_mapped
+                save_checkpoint(name, {"position": position})
+
+                elapsed = time.monotonic() - started
+                rate = (position - start) / elapsed
+                eta = (
+                    timedelta(seconds=round((total - position) / rate)) if rate else "-"
+                )
+                self.stdout.write(
+                    f"{position}/{total}: {pushed} contacts pushed "
+                    f"({pushed / elapsed:.1f}/s), {failed} failed, {skipped} skipped, "
+                    f"ETA {eta}"
+                )
+        clear_checkpoint(name)
+        self.stdout.write(
+            f"Re-sync done: {pushed} contacts pushed, {failed} failed, {skipped} "
+            f"duplicates or newer elsewhere, {unmapped} bookings could not be read"
+        )
+
+    def sheet_batches(self, batch_size, start):
+        # Yield (rows done, rows, records, unreadable rows), newest bookings first
+        rows = [row for row in sheet_api.read_all_rows()[1:] if row and row[0]]
+        rows.reverse()
+        self.stdout.write(f"Read {len(rows)} bookings from Master Data")
+        for first in range(start, len(rows), batch_size):
+            records = []
+            batch = rows[first : first + batch_size]
+            for row in batch:
+                try:
+                    records.append(record_from_row(row))
+                except (ValueError, TypeError):
+                    logger.exception(f"Could not read booking {row[0]} from the sheet")
+            yield first + len(batch), len(rows), records, len(batch) - len(records)
+
+    def checkfront_batches(self, executor, options, start):
+        # Yield (pages done, pages, records, bookings not fetched or mapped)
+        params = {"start_date": options["start_date"], "end_date": options["end_date"]}
+        for page, pages, summaries in checkfront_api.iter_booking_pages(
+            params, start_page=start + 1
+        ):
+            fetched = list(executor.map(fetch_booking, summaries))
+            bookings = [booking for booking in fetched if booking is not None]
+            records = [record for record in map_page(bookings) if record is not None]
+            yield page, pages, records, len(summaries) - len(records)
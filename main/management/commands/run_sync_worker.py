@@ -0,0 +1,85 @@
+import multiprocessing
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from main.utils.jobs import work
+
+
+def run_threads(threads, poll_interval, once):
+    stop_event = threading.Event()
+    workers = [
+        threading.Thread(
+            target=work,
+            args=(stop_event, poll_interval, once),
+            name=f"sync-worker-{i}",
+            daemon=True,
+        )
+        for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(1)
+    except KeyboardInterrupt:
+        # Let the running syncs finish, then exit
+        stop_event.set()
+        for worker in workers:
+            worker.join()
+
+
+class Command(BaseCommand):
+    help = (
+        "Process queued Checkfront booking syncs. Any number of workers may run "
+        "on any number of hosts, jobs of the same booking always run in order."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Drain the queue and exit instead of polling for new jobs",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=1.0,
+            help="Seconds to wait between polls when the queue is empty",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=1,
+            help="Number of worker threads per process",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Number of worker processes",
+        )
+
+    def handle(self, *args, **options):
+        args = (options["threads"], options["sleep"], options["once"])
+        if options["processes"] <= 1:
+            run_threads(*args)
+            return
+
+        # Forked children must not share the parent's database connection
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(target=run_threads, args=args, name=f"sync-process-{i}")
+            for i in range(options["processes"])
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.join()
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.utils.checkfront_api import sync_item_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Mirror the Checkfront item catalog into the database. Run it from the "
+        "scheduler, or keep it running with --interval."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Repeat the sync every INTERVAL seconds instead of running once",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            count = sync_item_catalog()
+            self.stdout.write(f"Synced {count} Checkfront items")
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
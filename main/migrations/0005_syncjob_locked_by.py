@@ -0,0 +1,24 @@
+# Generated by Django 4.0.5 on 2026-10-18 06:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0004_syncjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncjob",
+            name="locked_by",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name="syncjob",
+            index=models.Index(
+                fields=["booking_code", "status"], name="main_syncjo_booking_3595d5_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.0.5 on 2026-10-18 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0005_syncjob_locked_by"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Item",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("item_id", models.CharField(max_length=20, unique=True)),
+                ("name", models.CharField(blank=True, max_length=255)),
+                ("found", models.BooleanField(default=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Checkfront item",
+                "verbose_name_plural": "Checkfront items",
+            },
+        ),
+    ]
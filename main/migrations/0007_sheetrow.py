@@ -0,0 +1,33 @@
+# Generated by Django 4.0.5 on 2026-10-18 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0006_item"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SheetRow",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("code", models.CharField(max_length=50, unique=True)),
+                ("row", models.PositiveIntegerField()),
+            ],
+            options={
+                "verbose_name": "Master Data row",
+                "verbose_name_plural": "Master Data rows",
+            },
+        ),
+    ]
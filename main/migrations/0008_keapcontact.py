@@ -0,0 +1,35 @@
+# Generated by Django 4.0.5 on 2026-10-18 06:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0007_sheetrow"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="KeapContact",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("email", models.EmailField(max_length=255, unique=True)),
+                ("contact_id", models.PositiveBigIntegerField()),
+                ("booking_id", models.CharField(blank=True, max_length=50)),
+                ("synced_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Keap contact",
+                "verbose_name_plural": "Keap contacts",
+            },
+        ),
+    ]
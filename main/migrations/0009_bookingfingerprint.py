@@ -0,0 +1,31 @@
+# Generated by Django 4.0.5 on 2026-10-18 06:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0008_keapcontact"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BookingFingerprint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("code", models.CharField(max_length=50, unique=True)),
+                ("fingerprint", models.CharField(max_length=64)),
+                ("synced_at", models.DateTimeField()),
+                ("skipped_deliveries", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
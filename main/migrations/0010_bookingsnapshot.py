@@ -0,0 +1,37 @@
+# Generated by Django 4.0.5 on 2026-10-18 06:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0009_bookingfingerprint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BookingSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("code", models.CharField(max_length=50)),
+                ("key", models.CharField(max_length=255)),
+                ("data", models.JSONField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="bookingsnapshot",
+            constraint=models.UniqueConstraint(
+                fields=("code", "key"), name="unique_snapshot"
+            ),
+        ),
+    ]
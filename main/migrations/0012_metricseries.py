@@ -0,0 +1,38 @@
+# Generated by Django 4.0.5 on 2026-10-18 06:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0011_checkpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MetricSeries",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("worker", models.CharField(max_length=255)),
+                ("name", models.CharField(max_length=100)),
+                ("labels", models.CharField(blank=True, max_length=255)),
+                ("data", models.JSONField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="metricseries",
+            constraint=models.UniqueConstraint(
+                fields=("worker", "name", "labels"), name="unique_metric_series"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.5 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0013_ratelimitbucket"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncjob",
+            name="waiting_for",
+            field=models.CharField(blank=True, max_length=50),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.5 on 2026-10-18 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0014_syncjob_waiting_for"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncjob",
+            name="completed_stages",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name="syncjob",
+            name="failed_stage",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
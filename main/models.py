@@ -1,12 +1,12 @@
-import base64
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 import requests
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
 from main.exceptions import KeapAuthError
+from main.utils.metrics import timed
 
 
 # Create your models here.
@@ -58,10 +58,11 @@ class KeapAuth(models.Model):
         # Save the tokens
         self.access_token = json["access_token"]
         self.refresh_token = json["refresh_token"]
-        self.expires_at = datetime.now() + timedelta(seconds=json["expires_in"])
+        self.expires_at = timezone.now() + timedelta(seconds=json["expires_in"])
         self.save()
         return self
 
+    @timed("keap.refresh_access_token")
     def refresh_access_token(self):
         if not self.refresh_token:
             raise KeapAuthError("Refresh token is not defined.")
@@ -89,7 +90,7 @@ class KeapAuth(models.Model):
         # Update the tokens
         self.access_token = json["access_token"]
         self.refresh_token = json["refresh_token"]
-        self.expires_at = datetime.now() + timedelta(seconds=json["expires_in"])
+        self.expires_at = timezone.now() + timedelta(seconds=json["expires_in"])
         self.save()
         return self
 
@@ -98,9 +99,25 @@ class KeapAuth(models.Model):
         if timezone.now() < self.expires_at:
             return self.access_token
         # If the acces token is expired, refresh it.
-        self.refresh_access_token()
+        auth = KeapAuth.refresh_with_lock()
+        self.access_token = auth.access_token
+        self.refresh_token = auth.refresh_token
+        self.expires_at = auth.expires_at
         return self.access_token
 
+    @classmethod
+    def refresh_with_lock(cls, margin=0):
+        # The refresh token can only be used once, so the row stays locked while
+        # refreshing and every other worker waits for the new token instead.
+        with transaction.atomic():
+            auth = cls.objects.select_for_update().order_by("id").first()
+            if auth is None:
+                raise KeapAuthError("Keap has not been authorised yet.")
+            # Another worker may have refreshed it while we waited for the lock
+            if auth.expires_at - timedelta(seconds=margin) <= timezone.now():
+                auth.refresh_access_token()
+            return auth
+
 
 class CheckfrontStatus(models.Model):
     status_id = models.CharField(max_length=5)
@@ -112,3 +129,150 @@ class CheckfrontStatus(models.Model):
 
     def __str__(self):
         return self.label
+
+
+class SyncJob(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    booking_code = models.CharField(max_length=50, db_index=True)
+    payload = models.JSONField()
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING, db_index=True
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    locked_by = models.CharField(max_length=255, blank=True)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    # Upstream whose open circuit deferred the job, it runs again once it is back
+    waiting_for = models.CharField(max_length=50, blank=True)
+    # Stages of the last failed attempt, a retry resumes after the completed ones
+    failed_stage = models.CharField(max_length=255, blank=True)
+    completed_stages = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_attempt_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [models.Index(fields=["booking_code", "status"])]
+        verbose_name = "sync job"
+        verbose_name_plural = "sync jobs"
+
+    def __str__(self):
+        return f"{self.booking_code} ({self.status})"
+
+
+class Item(models.Model):
+    item_id = models.CharField(max_length=20, unique=True)
+    name = models.CharField(max_length=255, blank=True)
+    # False when Checkfront does not know the id, so the miss is cached too
+    found = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Checkfront item"
+        verbose_name_plural = "Checkfront items"
+
+    def __str__(self):
+        return self.name or self.item_id
+
+
+class SheetRow(models.Model):
+    code = models.CharField(max_length=50, unique=True)
+    row = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = "Master Data row"
+        verbose_name_plural = "Master Data rows"
+
+    def __str__(self):
+        return f"{self.code}: row {self.row}"
+
+
+class KeapContact(models.Model):
+    email = models.EmailField(max_length=255, unique=True)
+    contact_id = models.PositiveBigIntegerField()
+    # Booking id last written to the contact's custom field 514
+    booking_id = models.CharField(max_length=50, blank=True)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Keap contact"
+        verbose_name_plural = "Keap contacts"
+
+    def __str__(self):
+        return f"{self.email} ({self.contact_id})"
+
+
+class BookingFingerprint(models.Model):
+    code = models.CharField(max_length=50, unique=True)
+    # Fingerprint of the payload last synced successfully
+    fingerprint = models.CharField(max_length=64)
+    synced_at = models.DateTimeField()
+    skipped_deliveries = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.code} ({self.fingerprint[:12]})"
+
+
+class BookingSnapshot(models.Model):
+    code = models.CharField(max_length=50)
+    # "sheet" for the Master Data row, "contact:<email>" for a Keap contact
+    key = models.CharField(max_length=255)
+    data = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["code", "key"], name="unique_snapshot")
+        ]
+
+    def __str__(self):
+        return f"{self.code} {self.key}"
+
+
+class Checkpoint(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    data = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+class RateLimitBucket(models.Model):
+    # Token bucket shared by every process that calls the same upstream
+    name = models.CharField(max_length=100, unique=True)
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return self.name
+
+
+class MetricSeries(models.Model):
+    # Totals of one metric series in one process, summed across processes on read
+    worker = models.CharField(max_length=255)
+    name = models.CharField(max_length=100)
+    labels = models.CharField(max_length=255, blank=True)
+    data = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["worker", "name", "labels"], name="unique_metric_series"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.name}{{{self.labels}}} {self.worker}"
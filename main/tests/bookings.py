@@ -0,0 +1,77 @@
+from unittest import mock
+
+from main.utils import booking_mapper, checkfront_api
+
+
+def webhook_booking(code="AAA-1", status="PAID", email="lead@example.com", **fields):
+    # A webhook payload with two items and passengers sharing emails
+    return {
+        "code": code,
+        "status": status,
+        "created_date": "1660000000",
+        "start_date": "1661000000",
+        "end_date": "1661500000",
+        "order": {
+            "items": {
+                "item": [
+                    {"@attributes": {"item_id": "10"}, "qty": "1"},
+                    {"@attributes": {"item_id": "11"}, "qty": "1"},
+                ]
+            },
+            "total": "1000.00",
+            "paid_total": "200.00",
+            "sub_total": "900",
+            "tax_total": "100",
+            "discount": "0",
+        },
+        "customer": {
+            "email": email,
+            "name": "Ann",
+            "lplastname": "Smith",
+            "lptitle": "Mrs.",
+            "phone": "123",
+            "country": "GB",
+            "iptennislevel": "3",
+            "tennisclub": "TC",
+        },
+        "fields": {
+            "p2firstname": "Bob",
+            "p2lastname": "Smith",
+            "p2-email": "bob@example.com",
+            "p3firstname": "Cy",
+            "p3lastname": "Z",
+            "p3_email": email.upper(),
+            "p3tennislevel": "4",
+            "p4firstname": "Di",
+            "p4_email": "bob@example.com",
+            "p5_email": "e@x",
+            "p6title": "Mr.",
+            "p6_email": "f@x",
+            "tennis_standard__more_informat": "x",
+            # Checkfront sends unset fields as {}
+            "tennisclub": {},
+            **fields,
+        },
+    }
+
+
+def map_webhook_booking(*args, **kwargs):
+    booking = webhook_booking(*args, **kwargs)
+    order = booking_mapper.Order(
+        booking["order"]["items"]["item"],
+        "Tennis Holiday Algarve 10, Tennis Holiday Algarve 11",
+        "Tennis Holiday",
+        "Algarve",
+    )
+    return booking_mapper.map_booking(booking, order)
+
+
+class StatusesMixin:
+    # The status labels without a CheckfrontStatus table to load them from
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(
+            checkfront_api, "get_statuses", return_value={"PAID": "Paid"}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
@@ -0,0 +1,161 @@
+from concurrent.futures import Future
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from main.management.commands import backfill_bookings
+from main.models import BookingFingerprint, Checkpoint, SyncJob
+from main.tests.bookings import StatusesMixin, map_webhook_booking, webhook_booking
+from main.utils import sheet_api
+from main.utils.snapshots import load_snapshot
+
+
+def written(rows, error=None):
+    futures = {}
+    for code in rows:
+        future = futures[code] = Future()
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(None)
+    return futures
+
+
+class BackfillTestCase(StatusesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(sheet_api, "writer")
+        self.writer = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.writer.write_rows.side_effect = written
+
+    def page(self, *codes):
+        bookings = [webhook_booking(code) for code in codes]
+        return bookings, [map_webhook_booking(code) for code in codes]
+
+
+class BackfillPageTests(BackfillTestCase):
+    def test_rows_are_written_together_and_keap_syncs_queued(self):
+        bookings, records = self.page("AAA-1", "BBB-1")
+
+        self.assertEqual(
+            backfill_bookings.backfill_page(bookings, records, keap=True), (2, 2, 0)
+        )
+        self.writer.write_rows.assert_called_once()
+        self.assertEqual(
+            list(self.writer.write_rows.call_args.args[0]), ["AAA-1", "BBB-1"]
+        )
+        self.assertEqual(load_snapshot("AAA-1", "sheet"), list(records[0].sheet_row))
+        self.assertEqual(
+            list(SyncJob.objects.values_list("booking_code", flat=True)),
+            ["AAA-1", "BBB-1"],
+        )
+
+    def test_without_keap_the_bookings_are_not_marked_synced(self):
+        bookings, records = self.page("AAA-1")
+
+        self.assertEqual(
+            backfill_bookings.backfill_page(bookings, records, keap=False), (1, 0, 0)
+        )
+        self.assertFalse(SyncJob.objects.exists())
+        # A webhook of the booking must still reach Keap
+        self.assertFalse(BookingFingerprint.objects.exists())
+
+    def test_bookings_held_by_a_worker_are_queued_behind_it(self):
+        bookings, records = self.page("AAA-1", "BBB-1")
+        SyncJob.objects.create(booking_code="AAA-1", payload={})
+
+        backfill_bookings.backfill_page(bookings, records, keap=False)
+        self.assertEqual(list(self.writer.write_rows.call_args.args[0]), ["BBB-1"])
+        self.assertEqual(SyncJob.objects.filter(booking_code="AAA-1").count(), 2)
+
+    def test_failed_write_is_queued_for_the_worker(self):
+        bookings, records = self.page("AAA-1")
+        self.writer.write_rows.side_effect = lambda rows: written(
+            rows, ConnectionError()
+        )
+
+        with self.assertLogs(backfill_bookings.logger, "ERROR"):
+            result = backfill_bookings.backfill_page(bookings, records, keap=True)
+        self.assertEqual(result, (0, 0, 1))
+        self.assertIsNone(load_snapshot("AAA-1", "sheet"))
+        self.assertEqual(SyncJob.objects.get().booking_code, "AAA-1")
+
+    def test_page_that_cannot_be_mapped_is_mapped_one_by_one(self):
+        bookings, records = self.page("AAA-1", "BBB-1")
+
+        def map_booking(booking, order):
+            if booking["code"] == "BBB-1":
+                raise ValueError("bad booking")
+            return records[0]
+
+        with mock.patch.object(
+            backfill_bookings, "map_bookings", side_effect=ValueError("bad page")
+        ), mock.patch.object(backfill_bookings, "resolve_order"), mock.patch.object(
+            backfill_bookings, "map_booking", side_effect=map_booking
+        ):
+            with self.assertLogs(backfill_bookings.logger, "ERROR"):
+                self.assertEqual(
+                    backfill_bookings.map_page(bookings), [records[0], None]
+                )
+
+
+class BackfillCommandTests(BackfillTestCase):
+    def backfill(self, pages, *args):
+        def iter_booking_pages(params, start_page=1):
+            for page in range(start_page, len(pages) + 1):
+                yield page, len(pages), [
+                    {"code": code, "booking_id": code} for code in pages[page - 1]
+                ]
+
+        def map_page(bookings):
+            return [map_webhook_booking(booking["code"]) for booking in bookings]
+
+        with mock.patch.object(
+            backfill_bookings.checkfront_api,
+            "iter_booking_pages",
+            side_effect=iter_booking_pages,
+        ), mock.patch.object(
+            backfill_bookings,
+            "fetch_booking",
+            side_effect=lambda summary: webhook_booking(summary["code"]),
+        ), mock.patch.object(
+            backfill_bookings, "map_page", side_effect=map_page
+        ):
+            call_command(
+                "backfill_bookings",
+                "--start-date=2022-01-01",
+                "--end-date=2022-12-31",
+                "--no-keap",
+                *args,
+                stdout=StringIO(),
+            )
+
+    def test_interrupted_backfill_resumes_after_the_last_page(self):
+        self.writer.write_rows.side_effect = [
+            written({"AAA-1": None}),
+            KeyboardInterrupt,
+            written({"CCC-1": None}),
+        ]
+        with self.assertRaises(KeyboardInterrupt):
+            self.backfill([["AAA-1"], ["BBB-1"], ["CCC-1"]])
+        self.assertEqual(Checkpoint.objects.get().data, {"page": 1})
+
+        self.writer.write_rows.side_effect = written
+        self.backfill([["AAA-1"], ["BBB-1"], ["CCC-1"]])
+        self.assertEqual(
+            [call.args[0].keys() for call in self.writer.write_rows.call_args_list[2:]],
+            [{"BBB-1"}, {"CCC-1"}],
+        )
+        # A finished backfill starts over next time
+        self.assertFalse(Checkpoint.objects.exists())
+
+    def test_restart_ignores_the_checkpoint(self):
+        Checkpoint.objects.create(
+            name="backfill:2022-01-01:2022-12-31", data={"page": 1}
+        )
+
+        self.backfill([["AAA-1"], ["BBB-1"]], "--restart")
+        self.assertEqual(self.writer.write_rows.call_count, 2)
@@ -0,0 +1,63 @@
+from django.test import SimpleTestCase
+
+from main.tests.bookings import StatusesMixin, map_webhook_booking
+from main.utils import booking_mapper
+from main.utils.sync import build_lead_contact
+
+# Non-blank columns (0-based) of the row the sync built inline before
+# booking_mapper, for the booking below
+OLD_SHEET_ROW = {
+    0: "AAA-1",
+    1: "Paid",
+    2: "09/08/2022",
+    5: "Tennis Holiday",
+    6: "Algarve",
+    7: "2",
+    8: "900",
+    9: "100",
+    10: "1000.00",
+    11: "0",
+    14: "200.00",
+    15: "800.00",
+    16: "1000.00",
+    17: "Tennis Holiday Algarve 10, Tennis Holiday Algarve 11",
+    18: "Mrs.",
+    19: "Ann",
+    20: "Smith",
+    22: "lead@example.com",
+    23: "123",
+    24: "3",
+    25: "x",
+    30: "GB",
+    53: "Bob",
+    54: "Smith",
+    56: "bob@example.com",
+    59: "Cy",
+    60: "Z",
+    62: "LEAD@EXAMPLE.COM",
+    64: "4",
+    65: "Di",
+    68: "bob@example.com",
+    74: "e@x",
+    80: "f@x",
+    94: "https://activeaway.checkfront.co.uk/booking/AAA-1",
+    96: "20220820",
+    97: "20220826",
+}
+
+
+class BookingMapperTests(StatusesMixin, SimpleTestCase):
+    def test_sheet_row_matches_the_old_inline_row(self):
+        expected = [""] * len(booking_mapper.SHEET_COLUMNS)
+        for column, value in OLD_SHEET_ROW.items():
+            expected[column] = value
+        self.assertEqual(list(map_webhook_booking().sheet_row), expected)
+
+    def test_row_maps_back_to_the_same_booking(self):
+        record = map_webhook_booking(tennisclub="TC")
+        again = booking_mapper.record_from_row(record.sheet_row)
+
+        self.assertEqual(again.sheet_row, record.sheet_row)
+        self.assertEqual(
+            build_lead_contact(again).payload(), build_lead_contact(record).payload()
+        )
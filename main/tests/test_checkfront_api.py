@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from main.models import CheckfrontStatus, Item
+from main.utils import checkfront_api
+
+
+def response(status_code, data):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(data).encode()
+    return response
+
+
+class CheckfrontTestCase(TestCase):
+    def setUp(self):
+        # Each test starts without item names cached in memory
+        patcher = mock.patch.dict(checkfront_api._item_names, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(checkfront_api.session, "get")
+        self.get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class ItemCatalogTests(CheckfrontTestCase):
+    def test_catalog_is_mirrored_page_by_page(self):
+        Item.objects.create(item_id="10", name="Old name")
+        self.get.side_effect = [
+            response(
+                200,
+                {
+                    "request": {"pages": 2},
+                    "items": {"10": {"item_id": 10, "name": "A"}},
+                },
+            ),
+            response(
+                200,
+                {
+                    "request": {"pages": 2},
+                    "items": {"11": {"item_id": 11, "name": "B"}},
+                },
+            ),
+        ]
+
+        self.assertEqual(checkfront_api.sync_item_catalog(), 2)
+        self.assertEqual(
+            dict(Item.objects.values_list("item_id", "name")), {"10": "A", "11": "B"}
+        )
+
+    def test_mirrored_item_is_read_without_checkfront(self):
+        Item.objects.create(item_id="10", name="Tennis Holiday Algarve")
+
+        self.assertEqual(checkfront_api.check_item_name(10), "Tennis Holiday Algarve")
+        self.get.assert_not_called()
+
+    def test_unknown_item_is_fetched_once(self):
+        self.get.return_value = response(200, {"item": {"name": "Padel Week"}})
+
+        self.assertEqual(checkfront_api.check_item_name("12"), "Padel Week")
+        checkfront_api._item_names.clear()
+        self.assertEqual(checkfront_api.check_item_name("12"), "Padel Week")
+        self.get.assert_called_once()
+        # A hanging request would hold a circuit probe forever
+        self.assertEqual(self.get.call_args.kwargs["timeout"], checkfront_api.TIMEOUT)
+
+    def test_item_checkfront_does_not_know_is_remembered(self):
+        self.get.return_value = response(404, {})
+
+        self.assertIsNone(checkfront_api.check_item_name("13"))
+        self.assertFalse(Item.objects.get(item_id="13").found)
+        checkfront_api._item_names.clear()
+        self.assertIsNone(checkfront_api.check_item_name("13"))
+        self.get.assert_called_once()
+
+    def test_missing_item_is_looked_up_again_later(self):
+        Item.objects.create(item_id="13", found=False)
+        Item.objects.filter(item_id="13").update(
+            updated_at=timezone.now()
+            - timedelta(seconds=checkfront_api.MISSING_ITEM_TTL + 1)
+        )
+        self.get.return_value = response(200, {"item": {"name": "New Camp"}})
+
+        self.assertEqual(checkfront_api.check_item_name("13"), "New Camp")
+        self.assertTrue(Item.objects.get(item_id="13").found)
+
+    def test_failed_lookup_is_not_remembered(self):
+        self.get.return_value = response(500, {"error": "down"})
+
+        with self.assertRaises(requests.HTTPError):
+            checkfront_api.check_item_name("14")
+        self.assertFalse(Item.objects.filter(item_id="14").exists())
+
+
+class ResolveItemNamesTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(checkfront_api._item_names, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_names_keep_the_order_of_the_items(self):
+        with mock.patch.object(
+            checkfront_api,
+            "load_item_name",
+            side_effect=lambda item_id: f"Item {item_id}",
+        ) as load_item_name:
+            names = checkfront_api.resolve_item_names([11, 10, 11, 12])
+
+        self.assertEqual(names, ["Item 11", "Item 10", "Item 11", "Item 12"])
+        self.assertEqual(
+            sorted(call.args[0] for call in load_item_name.call_args_list),
+            ["10", "11", "12"],
+        )
+
+    def test_concurrent_lookups_of_an_item_share_one_request(self):
+        loading = threading.Event()
+        release = threading.Event()
+
+        def load_item_name(item_id):
+            loading.set()
+            release.wait(5)
+            return "Tennis Holiday"
+
+        with mock.patch.object(
+            checkfront_api, "load_item_name", side_effect=load_item_name
+        ) as load:
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                first = executor.submit(checkfront_api.check_item_name, "10")
+                loading.wait(5)
+                others = [
+                    executor.submit(checkfront_api.check_item_name, "10")
+                    for _ in range(2)
+                ]
+                # The other lookups wait for the one already running
+                time.sleep(0.05)
+                release.set()
+                names = [future.result(5) for future in [first, *others]]
+
+        self.assertEqual(names, ["Tennis Holiday"] * 3)
+        load.assert_called_once_with("10")
+
+    def test_failed_lookup_is_raised_to_the_caller(self):
+        with mock.patch.object(
+            checkfront_api, "load_item_name", side_effect=ConnectionError("down")
+        ):
+            with self.assertRaises(ConnectionError):
+                checkfront_api.resolve_item_names([10, 11])
+
+
+class StatusesTests(TestCase):
+    def setUp(self):
+        # Each test starts before the statuses were first loaded
+        patcher = mock.patch.object(checkfront_api, "_statuses", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_statuses_are_loaded_once_on_first_use(self):
+        CheckfrontStatus.objects.create(status_id="PAID", label="Paid")
+
+        with self.assertNumQueries(1):
+            self.assertEqual(checkfront_api.get_statuses(), {"PAID": "Paid"})
+            checkfront_api.get_statuses()
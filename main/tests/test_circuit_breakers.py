@@ -0,0 +1,105 @@
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase
+
+from main.exceptions import CircuitOpenError
+from main.utils.circuit_breakers import BreakerAdapter, CircuitBreaker
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker("keap", failure_threshold=2, reset_timeout=30)
+
+    def open(self):
+        with self.assertLogs("main.utils.circuit_breakers", "WARNING"):
+            for _ in range(2):
+                self.breaker.before_request()
+                self.breaker.record_failure()
+
+    def wait_out(self, attribute):
+        # As if reset_timeout seconds went by
+        setattr(self.breaker, attribute, getattr(self.breaker, attribute) - 30)
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        # A success in between starts the count again
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.breaker.record_success()
+
+        self.open()
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.breaker.before_request()
+        self.assertEqual(raised.exception.upstream, "keap")
+        self.assertAlmostEqual(raised.exception.retry_in, 30, places=0)
+
+    def test_one_probe_is_let_through_after_the_timeout(self):
+        listener = mock.Mock()
+        self.breaker.listeners.append(listener)
+        self.open()
+        self.wait_out("opened_at")
+
+        with self.assertLogs("main.utils.circuit_breakers", "INFO"):
+            self.breaker.before_request()
+        # The others wait for the outcome of the probe
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_request()
+        with self.assertLogs("main.utils.circuit_breakers", "INFO"):
+            self.breaker.record_success()
+        self.breaker.before_request()
+        listener.assert_called_once_with("keap")
+
+    def test_failed_probe_opens_the_circuit_again(self):
+        self.open()
+        self.wait_out("opened_at")
+        with self.assertLogs("main.utils.circuit_breakers", "INFO"):
+            self.breaker.before_request()
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_request()
+
+    def test_probe_that_never_answers_opens_the_circuit_again(self):
+        self.open()
+        self.wait_out("opened_at")
+        with self.assertLogs("main.utils.circuit_breakers", "INFO"):
+            self.breaker.before_request()
+        self.wait_out("probe_started_at")
+
+        with self.assertLogs("main.utils.circuit_breakers", "WARNING"):
+            with self.assertRaises(CircuitOpenError):
+                self.breaker.before_request()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        # The next probe goes out once the timeout passed again
+        self.wait_out("opened_at")
+        with self.assertLogs("main.utils.circuit_breakers", "INFO"):
+            self.breaker.before_request()
+
+
+class BreakerAdapterTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker("keap", failure_threshold=1)
+        self.adapter = BreakerAdapter(self.breaker)
+        self.request = requests.Request("GET", "https://keap/contacts").prepare()
+
+    def test_server_errors_count_as_failures(self):
+        response = requests.Response()
+        response.status_code = 503
+        with mock.patch("requests.adapters.HTTPAdapter.send", return_value=response):
+            with self.assertLogs("main.utils.circuit_breakers", "WARNING"):
+                self.adapter.send(self.request)
+
+        with self.assertRaises(CircuitOpenError):
+            self.adapter.send(self.request)
+
+    def test_connection_errors_count_as_failures(self):
+        with mock.patch(
+            "requests.adapters.HTTPAdapter.send", side_effect=requests.ConnectionError
+        ):
+            with self.assertLogs("main.utils.circuit_breakers", "WARNING"):
+                with self.assertRaises(requests.ConnectionError):
+                    self.adapter.send(self.request)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
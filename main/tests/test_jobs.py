@@ -0,0 +1,139 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from main.exceptions import CircuitOpenError, PipelineError, QuotaExceededError
+from main.models import BookingFingerprint, SyncJob
+from main.utils import fingerprint, jobs
+
+
+def queue(code, **kwargs):
+    return SyncJob.objects.create(booking_code=code, payload={}, **kwargs)
+
+
+class ClaimNextJobTests(TestCase):
+    def test_jobs_of_a_booking_run_in_order(self):
+        first = queue("AAA-1")
+        other = queue("BBB-1")
+        second = queue("AAA-1")
+
+        self.assertEqual(jobs.claim_next_job("worker").pk, first.pk)
+        self.assertEqual(jobs.claim_next_job("worker").pk, other.pk)
+        # The second job of AAA-1 waits until the first one is done
+        self.assertIsNone(jobs.claim_next_job("worker"))
+
+        jobs.finish_job(SyncJob.objects.get(pk=first.pk))
+        job = jobs.claim_next_job("worker")
+        self.assertEqual(job.pk, second.pk)
+        self.assertEqual(
+            (job.status, job.attempts, job.locked_by), (SyncJob.RUNNING, 1, "worker")
+        )
+
+    def test_jobs_queued_behind_a_booking_do_not_starve_others(self):
+        for _ in range(21):
+            queue("AAA-1")
+        other = queue("BBB-1")
+
+        jobs.claim_next_job("worker")
+        self.assertEqual(jobs.claim_next_job("worker").pk, other.pk)
+
+    def test_job_waiting_for_a_retry_blocks_newer_jobs(self):
+        queue("AAA-1", run_after=timezone.now() + timedelta(minutes=5))
+        queue("AAA-1")
+        self.assertIsNone(jobs.claim_next_job("worker"))
+
+    def test_stale_job_is_claimed_again(self):
+        job = queue("AAA-1")
+        jobs.claim_next_job("dead")
+        SyncJob.objects.filter(pk=job.pk).update(
+            last_attempt_at=timezone.now() - timedelta(seconds=jobs.LOCK_TIMEOUT + 1)
+        )
+
+        with self.assertLogs("main.utils.jobs", "WARNING"):
+            self.assertEqual(jobs.release_stale_jobs(), 1)
+        job = jobs.claim_next_job("worker")
+        self.assertEqual((job.attempts, job.locked_by), (2, "worker"))
+
+
+class FailJobTests(TestCase):
+    def test_failed_job_remembers_its_stages(self):
+        job = queue("AAA-1")
+        jobs.claim_next_job("worker")
+        error = PipelineError(
+            {
+                "keap": PipelineError(
+                    {"passengers": ValueError("rejected")},
+                    {"lead": 0.1, "passengers": 0.1},
+                )
+            },
+            {"sheet": 0.1, "keap": 0.2},
+        )
+
+        jobs.fail_job(SyncJob.objects.get(pk=job.pk), error)
+        job.refresh_from_db()
+        self.assertEqual(job.status, SyncJob.PENDING)
+        self.assertEqual(job.completed_stages, ["keap/lead", "sheet"])
+        self.assertEqual(job.failed_stage, "keap/passengers")
+
+
+class RunJobTests(TestCase):
+    def test_duplicate_of_a_synced_booking_is_skipped(self):
+        # Queued before the first delivery was synced
+        queue("AAA-1")
+        fingerprint.record_synced("AAA-1", fingerprint.booking_fingerprint({}))
+        job = jobs.claim_next_job("worker")
+        with mock.patch.object(jobs, "sync_booking") as sync_booking:
+            with self.assertLogs("main.utils.jobs", "INFO"):
+                self.assertTrue(jobs.run_job(job))
+
+        sync_booking.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual(job.status, SyncJob.DONE)
+        self.assertEqual(BookingFingerprint.objects.get().skipped_deliveries, 1)
+
+    def test_synced_booking_is_fingerprinted(self):
+        queue("AAA-1")
+        job = jobs.claim_next_job("worker")
+        with mock.patch.object(jobs, "sync_booking"):
+            with self.assertLogs("main.utils.jobs", "INFO"):
+                self.assertTrue(jobs.run_job(job))
+
+        self.assertTrue(
+            fingerprint.already_synced("AAA-1", fingerprint.booking_fingerprint({}))
+        )
+
+    def test_job_is_deferred_while_the_keap_quota_is_used_up(self):
+        queue("AAA-1")
+        job = jobs.claim_next_job("worker")
+        with mock.patch.object(
+            jobs, "sync_booking", side_effect=QuotaExceededError("keap", 3600)
+        ):
+            with self.assertLogs("main.utils.jobs", "WARNING"):
+                self.assertFalse(jobs.run_job(job))
+
+        job.refresh_from_db()
+        # No attempt is used up, however long the quota takes to reset
+        self.assertEqual((job.status, job.attempts), (SyncJob.PENDING, 0))
+        self.assertEqual(job.waiting_for, "keap")
+        self.assertGreater(job.run_after, timezone.now() + timedelta(minutes=59))
+
+    def test_job_is_deferred_while_a_circuit_is_open(self):
+        queue("AAA-1")
+        job = jobs.claim_next_job("worker")
+        error = PipelineError({"keap_contact": CircuitOpenError("keap", 30)}, {})
+        with mock.patch.object(jobs, "sync_booking", side_effect=error):
+            with self.assertLogs("main.utils.jobs", "WARNING"):
+                self.assertFalse(jobs.run_job(job))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (SyncJob.PENDING, 0))
+        self.assertEqual(job.waiting_for, "keap")
+        # Nothing is claimed until the upstream is probed again
+        self.assertIsNone(jobs.claim_next_job("worker"))
+
+        # The probe succeeded
+        with self.assertLogs("main.utils.jobs", "INFO"):
+            self.assertEqual(jobs.release_deferred_jobs("keap"), 1)
+        self.assertEqual(jobs.claim_next_job("worker").pk, job.pk)
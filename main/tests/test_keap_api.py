@@ -0,0 +1,197 @@
+import json
+from datetime import timedelta
+from unittest import mock
+
+import requests
+from django.test import TestCase
+from django.utils import timezone
+
+from main.exceptions import KeapAPIError, QuotaExceededError, RequestError
+from main.models import KeapAuth, KeapContact
+from main.tests.bookings import StatusesMixin, map_webhook_booking
+from main.utils import keap_api
+from main.utils.sync import build_lead_contact
+
+
+def response(status_code, data=None, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(data or {}).encode()
+    response.headers.update(headers or {})
+    return response
+
+
+class KeapClientTests(TestCase):
+    def setUp(self):
+        self.client = keap_api.KeapClient(max_retries=2)
+        for patcher in [
+            mock.patch.object(self.client, "auth_headers", return_value={}),
+            mock.patch.object(keap_api.time, "sleep"),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(self.client.session, "request")
+        self.request = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rate_limited_request_is_retried_after_retry_after(self):
+        self.request.side_effect = [
+            response(429, headers={"Retry-After": "3"}),
+            response(200, {"id": 1}),
+        ]
+
+        with self.assertLogs("main.utils.keap_api", "WARNING"):
+            self.assertEqual(self.client.get("/contacts").json(), {"id": 1})
+        self.assertEqual(keap_api.time.sleep.call_args_list[0], mock.call(3))
+        # Every other request waits out the rate limit too
+        self.assertGreater(self.client.paused_until, 0)
+
+    def test_server_errors_are_retried_up_to_max_retries(self):
+        self.request.return_value = response(503)
+
+        with self.assertLogs("main.utils.keap_api", "WARNING"):
+            self.assertEqual(self.client.get("/contacts").status_code, 503)
+        self.assertEqual(self.request.call_count, 3)
+
+    def test_request_that_may_have_reached_keap_is_not_resent(self):
+        self.request.side_effect = requests.ReadTimeout("slow")
+
+        with self.assertRaises(RequestError):
+            self.client.post("/notes", idempotent=False)
+        self.request.assert_called_once()
+
+    def test_requests_are_held_back_until_the_quota_resets(self):
+        reset = timezone.now() + timedelta(hours=1)
+        self.request.return_value = response(
+            201,
+            headers={
+                keap_api.QUOTA_HEADER: "0",
+                keap_api.QUOTA_EXPIRY_HEADER: reset.isoformat(),
+            },
+        )
+
+        # The request that used up the quota still succeeds
+        with self.assertLogs("main.utils.keap_api", "WARNING"):
+            self.assertEqual(self.client.put("/contacts").status_code, 201)
+        with self.assertRaises(QuotaExceededError) as raised:
+            self.client.put("/contacts")
+        self.request.assert_called_once()
+        self.assertAlmostEqual(raised.exception.retry_in, 3600, delta=5)
+
+    def test_request_fails_once_the_shared_budget_is_used_up(self):
+        with mock.patch.object(
+            self.client.budgets["upsert"], "acquire", return_value=False
+        ):
+            with self.assertRaises(KeapAPIError):
+                self.client.get("/contacts")
+        self.request.assert_not_called()
+
+
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        self.auth = KeapAuth.objects.create(
+            access_token="old",
+            refresh_token="refresh",
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        self.tokens = keap_api.TokenCache(margin=300)
+        patcher = mock.patch("main.models.requests.post")
+        self.post = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.post.return_value = response(
+            200, {"access_token": "new", "refresh_token": "next", "expires_in": 86400}
+        )
+
+    def test_token_is_read_from_the_database_once(self):
+        with mock.patch.object(
+            KeapAuth, "refresh_with_lock", wraps=KeapAuth.refresh_with_lock
+        ) as refresh_with_lock:
+            self.assertEqual(self.tokens.get(), "old")
+            self.assertEqual(self.tokens.get(), "old")
+        refresh_with_lock.assert_called_once()
+        self.post.assert_not_called()
+
+    def test_expired_token_is_refreshed_before_use(self):
+        KeapAuth.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(self.tokens.get(), "new")
+        self.auth.refresh_from_db()
+        self.assertEqual(
+            (self.auth.access_token, self.auth.refresh_token), ("new", "next")
+        )
+
+    def test_token_about_to_expire_is_refreshed_in_the_background(self):
+        self.tokens.access_token = "old"
+        self.tokens.expires_at = timezone.now() + timedelta(minutes=1)
+
+        with mock.patch.object(keap_api.threading, "Thread") as thread:
+            # Callers keep the current token, one refresh runs for all of them
+            self.assertEqual(self.tokens.get(), "old")
+            self.assertEqual(self.tokens.get(), "old")
+        thread.assert_called_once()
+        self.post.assert_not_called()
+
+    def test_invalidated_token_is_reloaded(self):
+        self.tokens.get()
+        KeapAuth.objects.update(access_token="rotated")
+
+        self.tokens.invalidate()
+        self.assertEqual(self.tokens.get(), "rotated")
+
+
+class ContactMapTests(StatusesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.contact = build_lead_contact(map_webhook_booking())
+        patcher = mock.patch.object(keap_api, "client")
+        self.client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.get.return_value = response(200, {"count": 0})
+        self.client.put.return_value = response(200, {"id": 42})
+        # Tags are added with a 200, notes created with a 201
+        self.client.post.side_effect = lambda path, **kwargs: response(
+            201 if path == "/notes" else 200
+        )
+
+    def test_first_upsert_searches_keap_and_maps_the_contact(self):
+        self.contact.add_or_update_contact_in_keap()
+
+        self.client.get.assert_called_once()
+        link = KeapContact.objects.get(email="lead@example.com")
+        self.assertEqual((link.contact_id, link.booking_id), (42, "AAA-1"))
+        self.assertEqual(self.contact.tag_ids, [13988])
+
+    def test_mapped_contact_is_upserted_without_a_search(self):
+        KeapContact.objects.create(
+            email="lead@example.com", contact_id=42, booking_id="AAA-1"
+        )
+
+        self.contact.add_or_update_contact_in_keap()
+        self.client.get.assert_not_called()
+        # The booking is already on the contact
+        self.assertEqual(self.contact.tag_ids, [14052])
+
+    def test_contact_holding_another_booking_is_tagged_as_new(self):
+        KeapContact.objects.create(
+            email="lead@example.com", contact_id=42, booking_id="ZZZ-1"
+        )
+
+        self.contact.add_or_update_contact_in_keap()
+        self.client.get.assert_not_called()
+        self.assertEqual(self.contact.tag_ids, [13988])
+        self.assertEqual(
+            KeapContact.objects.get(email="lead@example.com").booking_id, "AAA-1"
+        )
+
+    def test_contact_map_only_follows_sent_booking_ids(self):
+        KeapContact.objects.create(
+            email="lead@example.com", contact_id=1, booking_id="ZZZ-1"
+        )
+
+        self.contact.add_or_update_contact_in_keap({"given_name": "Ann"})
+        link = KeapContact.objects.get(email="lead@example.com")
+        self.assertEqual((link.contact_id, link.booking_id), (42, "ZZZ-1"))
+
+        self.contact.add_or_update_contact_in_keap()
+        link.refresh_from_db()
+        self.assertEqual(link.booking_id, "AAA-1")
@@ -0,0 +1,55 @@
+from django.test import TestCase
+
+from main.models import Product, Venue
+from main.utils.locals import (
+    find_replace_product_name,
+    find_replace_venue_name,
+    product_matcher,
+    venue_matcher,
+)
+
+
+class KeywordMatcherTests(TestCase):
+    def setUp(self):
+        product_matcher.invalidate()
+        venue_matcher.invalidate()
+
+    def test_longest_keyword_wins(self):
+        for keyword in ["Tennis", "Tennis Holiday", "Holiday"]:
+            Product.objects.create(keyword=keyword)
+
+        self.assertEqual(
+            find_replace_product_name("Adult Tennis Holiday Algarve 10"),
+            "Tennis Holiday",
+        )
+
+    def test_first_keyword_wins_a_tie(self):
+        Venue.objects.create(keyword="Algarve")
+        Venue.objects.create(keyword="Mallorca")
+
+        self.assertEqual(find_replace_venue_name("Mallorca or Algarve"), "Mallorca")
+
+    def test_text_without_a_keyword_matches_nothing(self):
+        Product.objects.create(keyword="Padel")
+
+        self.assertIsNone(find_replace_product_name("Tennis Holiday"))
+        Product.objects.all().delete()
+        self.assertIsNone(find_replace_product_name("Padel Week"))
+
+    def test_keywords_are_matched_literally(self):
+        Product.objects.create(keyword="Tennis (Adults)")
+        Product.objects.create(keyword="A.B")
+
+        self.assertEqual(
+            find_replace_product_name("Tennis (Adults) Algarve"),
+            "Tennis (Adults)",
+        )
+        self.assertIsNone(find_replace_product_name("AxB"))
+
+    def test_edited_keywords_are_used_straight_away(self):
+        product = Product.objects.create(keyword="Tennis")
+        self.assertEqual(find_replace_product_name("Tennis Camp"), "Tennis")
+
+        product.keyword = "Tennis Camp"
+        product.save()
+        self.assertEqual(find_replace_product_name("Tennis Camp"), "Tennis Camp")
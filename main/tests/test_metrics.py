@@ -0,0 +1,96 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from main.models import MetricSeries
+from main.utils import metrics
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        # Each test starts like a freshly forked process, flushing by hand
+        metrics._pid = None
+        patcher = mock.patch.object(metrics, "schedule_flush")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def series(self, worker, value, updated_at=None):
+        series = MetricSeries.objects.create(
+            worker=worker,
+            name="activeaway_outbound_requests_total",
+            labels='status="200",upstream="keap"',
+            data={"value": value},
+        )
+        if updated_at:
+            MetricSeries.objects.filter(pk=series.pk).update(updated_at=updated_at)
+        return series
+
+
+class FlushTests(MetricsTestCase):
+    def test_totals_of_every_worker_are_summed(self):
+        self.series("other:1", 5)
+        metrics.inc("activeaway_outbound_requests_total", upstream="keap", status=200)
+        metrics.observe("activeaway_webhook_seconds", 0.2, result="ok")
+        metrics.flush()
+
+        rendered = metrics.render()
+        self.assertIn(
+            'activeaway_outbound_requests_total{status="200",upstream="keap"} 6',
+            rendered,
+        )
+        self.assertIn(
+            'activeaway_webhook_seconds_bucket{result="ok",le="0.25"} 1', rendered
+        )
+        self.assertIn('activeaway_webhook_seconds_count{result="ok"} 1', rendered)
+
+    def test_failed_flush_is_retried(self):
+        metrics.inc("activeaway_outbound_requests_total", upstream="keap", status=200)
+        with mock.patch.object(
+            MetricSeries.objects, "update_or_create", side_effect=ValueError
+        ):
+            with self.assertLogs(metrics.logger, "ERROR"):
+                metrics.flush()
+
+        metrics.flush()
+        self.assertEqual(MetricSeries.objects.get().data, {"value": 1})
+
+
+class RetireTests(MetricsTestCase):
+    def test_dead_workers_are_folded_into_the_retired_rows(self):
+        old = timezone.now() - timedelta(seconds=metrics.RETIRE_AFTER + 1)
+        self.series("dead:1", 2, updated_at=old)
+        self.series("dead:2", 3, updated_at=old)
+        self.series("live:3", 4)
+        before = metrics.render()
+
+        self.assertEqual(metrics.retire_stale_workers(), 2)
+        self.assertEqual(
+            sorted(MetricSeries.objects.values_list("worker", "data")),
+            [("live:3", {"value": 4}), ("retired", {"value": 5})],
+        )
+        # The totals do not drop, so Prometheus sees no counter reset
+        self.assertEqual(metrics.render(), before)
+
+    def test_histograms_are_folded_bucket_by_bucket(self):
+        self.assertEqual(
+            metrics.add_data(
+                {"buckets": [1, 0], "sum": 0.1, "count": 1},
+                {"buckets": [0, 2], "sum": 1.0, "count": 2},
+            ),
+            {"buckets": [1, 2], "sum": 1.1, "count": 3},
+        )
+
+    def test_flush_keeps_the_rows_of_this_process_fresh(self):
+        metrics.inc("activeaway_outbound_requests_total", upstream="keap", status=200)
+        metrics.flush()
+        old = timezone.now() - timedelta(seconds=metrics.RETIRE_AFTER + 1)
+        MetricSeries.objects.update(updated_at=old)
+
+        # Nothing changed, but the heartbeat is due
+        metrics._next_heartbeat = 0
+        metrics.flush()
+        series = MetricSeries.objects.get()
+        self.assertEqual(series.worker, metrics.worker_name())
+        self.assertGreater(series.updated_at, old)
@@ -0,0 +1,134 @@
+import threading
+
+from django.test import SimpleTestCase
+
+from main.exceptions import PipelineError
+from main.utils.pipeline import POOL_SIZE, Stage, resume, run_stages, stage_outcome
+
+
+class RunStagesTests(SimpleTestCase):
+    def test_stages_get_the_results_of_their_dependencies(self):
+        stages = [
+            Stage("order", lambda: 2),
+            Stage("record", lambda order: order * 10, depends_on=["order"]),
+            Stage(
+                "row",
+                lambda order, record: order + record,
+                depends_on=["order", "record"],
+            ),
+        ]
+        self.assertEqual(run_stages(stages), {"order": 2, "record": 20, "row": 22})
+
+    def test_independent_stages_run_concurrently(self):
+        # Each stage only finishes once the other one has started
+        barrier = threading.Barrier(2, timeout=5)
+        stages = [Stage("sheet", barrier.wait), Stage("keap", barrier.wait)]
+        run_stages(stages, max_workers=2)
+
+    def test_at_most_max_workers_stages_run_at_a_time(self):
+        lock = threading.Lock()
+        running = []
+        most = []
+
+        def stage():
+            with lock:
+                running.append(1)
+                most.append(len(running))
+            threading.Event().wait(0.01)
+            with lock:
+                running.pop()
+
+        run_stages([Stage(f"stage {i}", stage) for i in range(4)], max_workers=2)
+        self.assertEqual(max(most), 2)
+
+    def test_failed_stage_skips_its_dependents_only(self):
+        calls = []
+
+        def fail():
+            raise ValueError("rejected")
+
+        stages = [
+            Stage("record", fail),
+            Stage("sheet", lambda record: calls.append("sheet"), depends_on=["record"]),
+            Stage("metrics", lambda: calls.append("metrics")),
+        ]
+        with self.assertLogs("main.utils.pipeline", "WARNING"):
+            with self.assertRaises(PipelineError) as raised:
+                run_stages(stages)
+        self.assertEqual(list(raised.exception.errors), ["record"])
+        self.assertEqual(calls, ["metrics"])
+
+    def test_pipelines_share_their_threads(self):
+        threads = set()
+        for _ in range(POOL_SIZE * 2):
+            run_stages(
+                [Stage("stage", lambda: threads.add(threading.current_thread()))]
+            )
+        self.assertLessEqual(len(threads), POOL_SIZE)
+        self.assertTrue(all(thread.name.startswith("stage-0") for thread in threads))
+
+    def test_nested_pipelines_run_on_their_own_threads(self):
+        def nested():
+            return run_stages(
+                [Stage(f"passenger {i}", lambda i=i: i) for i in range(3)]
+            )
+
+        results = run_stages([Stage(f"booking {i}", nested) for i in range(3)])
+        self.assertEqual(
+            results["booking 2"], {"passenger 0": 0, "passenger 1": 1, "passenger 2": 2}
+        )
+
+
+class ResumeTests(SimpleTestCase):
+    def test_completed_stages_are_skipped(self):
+        calls = []
+        stages = [
+            Stage("sheet", lambda: calls.append("sheet")),
+            Stage("keap", lambda: calls.append("keap")),
+        ]
+        with resume(["sheet"]):
+            run_stages(stages)
+        self.assertEqual(calls, ["keap"])
+
+    def test_completed_stage_runs_again_for_its_dependents(self):
+        stages = [
+            Stage("order", lambda: 1),
+            Stage("record", lambda order: order + 1, depends_on=["order"]),
+        ]
+        with resume(["order"]):
+            self.assertEqual(run_stages(stages), {"order": 1, "record": 2})
+
+    def test_resume_after_a_nested_failure(self):
+        calls = []
+        errors = [ValueError("rejected")]
+
+        def passengers():
+            calls.append("passengers")
+            if errors:
+                raise errors.pop()
+
+        def stages():
+            return [
+                Stage("sheet", lambda: calls.append("sheet")),
+                Stage(
+                    "keap",
+                    lambda: run_stages(
+                        [
+                            Stage("lead", lambda: calls.append("lead")),
+                            Stage("passengers", passengers),
+                        ]
+                    ),
+                ),
+            ]
+
+        with self.assertLogs("main.utils.pipeline", "WARNING"):
+            with self.assertRaises(PipelineError) as raised:
+                run_stages(stages())
+        completed, failed = stage_outcome(raised.exception)
+        self.assertEqual(sorted(completed), ["keap/lead", "sheet"])
+        self.assertEqual(failed, ["keap/passengers"])
+
+        calls.clear()
+        with resume(completed):
+            run_stages(stages())
+        self.assertEqual(calls, ["passengers"])
@@ -0,0 +1,46 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+
+from main.models import RateLimitBucket
+from main.utils import rate_limits
+from main.utils.rate_limits import TokenBucket
+
+
+class TokenBucketTests(TestCase):
+    def test_burst_up_to_capacity_then_wait_for_the_rate(self):
+        bucket = TokenBucket("keap:upsert", rate=2, capacity=3, max_wait=0)
+
+        self.assertEqual([bucket.take() for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.take(), 0.5, places=1)
+
+    def test_tokens_are_added_over_time(self):
+        bucket = TokenBucket("keap:upsert", rate=2, capacity=3, max_wait=0)
+        bucket.take()
+        RateLimitBucket.objects.update(tokens=0)
+        updated_at = RateLimitBucket.objects.get().updated_at
+        RateLimitBucket.objects.update(updated_at=updated_at - timedelta(seconds=1))
+
+        self.assertEqual([bucket.take() for _ in range(2)], [0, 0])
+        self.assertGreater(bucket.take(), 0)
+
+    def test_workers_share_one_budget(self):
+        first = TokenBucket("keap:low", rate=1, capacity=2, max_wait=0)
+        second = TokenBucket("keap:low", rate=1, capacity=2, max_wait=0)
+
+        self.assertEqual(first.take(), 0)
+        self.assertEqual(second.take(), 0)
+        self.assertGreater(first.take(), 0)
+        self.assertEqual(RateLimitBucket.objects.count(), 1)
+
+    def test_acquire_waits_for_a_token_up_to_max_wait(self):
+        bucket = TokenBucket("keap:upsert", rate=1, capacity=1, max_wait=5)
+        with mock.patch.object(bucket, "take", side_effect=[0.5, 0.5, 0]):
+            with mock.patch.object(rate_limits.time, "sleep") as sleep:
+                self.assertTrue(bucket.acquire())
+        self.assertEqual(sleep.call_count, 2)
+
+        bucket.max_wait = 0
+        with mock.patch.object(bucket, "take", return_value=1.0):
+            self.assertFalse(bucket.acquire())
@@ -0,0 +1,100 @@
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from main.management.commands import reconcile_master_data
+from main.models import BookingFingerprint, BookingSnapshot, SyncJob
+from main.tests.bookings import StatusesMixin, map_webhook_booking, webhook_booking
+from main.utils import checkfront_api, sheet_api
+
+
+def summary(code="AAA-1", **fields):
+    # A booking of the Checkfront booking index
+    return {
+        "booking_id": code,
+        "code": code,
+        "status_id": "PAID",
+        "total": "1000.00",
+        "paid_total": "200.00",
+        "created_date": 1660000000,
+        "start_date": 1661000000,
+        "end_date": 1661500000,
+        **fields,
+    }
+
+
+class CompareTests(StatusesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.row = list(map_webhook_booking().sheet_row)
+
+    def test_synced_booking_has_no_differences(self):
+        self.assertEqual(list(reconcile_master_data.compare(self.row, summary())), [])
+
+    def test_differences_are_reported_per_field(self):
+        booking = summary(status_id="CANCELLED", paid_total="1000")
+        self.assertEqual(
+            list(reconcile_master_data.compare(self.row, booking)),
+            [("status", "Paid", "CANCELLED"), ("paid_total", "200.00", "1000")],
+        )
+
+    def test_amounts_are_compared_as_numbers(self):
+        self.assertEqual(
+            list(reconcile_master_data.compare(self.row, summary(total="1000"))), []
+        )
+
+
+class ReconcileCommandTests(StatusesMixin, TestCase):
+    def reconcile(self, bookings, *args):
+        rows = [["Booking Code"], list(map_webhook_booking().sheet_row)]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = os.path.join(directory.name, "report.csv")
+        with mock.patch.object(
+            sheet_api, "read_all_rows", return_value=rows
+        ), mock.patch.object(
+            checkfront_api,
+            "iter_booking_pages",
+            return_value=[(1, 1, bookings)],
+        ), mock.patch.object(
+            checkfront_api, "fetch_booking", side_effect=webhook_booking
+        ), mock.patch.object(
+            checkfront_api, "booking_from_api", side_effect=lambda booking: booking
+        ):
+            call_command(
+                "reconcile_master_data",
+                "--start-date=2022-01-01",
+                "--end-date=2022-12-31",
+                f"--output={output}",
+                *args,
+                stderr=StringIO(),
+            )
+        with open(output) as report:
+            return report.read().splitlines()
+
+    def test_missing_and_different_bookings_are_reported(self):
+        report = self.reconcile([summary(), summary("BBB-1"), summary(total="10")])
+        self.assertEqual(
+            report,
+            [
+                "code,field,master_data,checkfront",
+                "BBB-1,missing,,BBB-1",
+                "AAA-1,total,1000.00,10",
+            ],
+        )
+        self.assertFalse(SyncJob.objects.exists())
+
+    def test_repair_queues_a_full_sync(self):
+        BookingFingerprint.objects.create(
+            code="BBB-1", fingerprint="x", synced_at="2022-01-01T00:00Z"
+        )
+        BookingSnapshot.objects.create(code="BBB-1", key="sheet", data=[])
+
+        self.reconcile([summary(), summary("BBB-1")], "--repair")
+        self.assertEqual(SyncJob.objects.get().booking_code, "BBB-1")
+        self.assertFalse(BookingFingerprint.objects.exists())
+        self.assertFalse(BookingSnapshot.objects.exists())
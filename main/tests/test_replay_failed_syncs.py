@@ -0,0 +1,66 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+from main.models import SyncJob
+from main.utils import jobs, pipeline
+
+
+def failed(code, **kwargs):
+    return SyncJob.objects.create(
+        booking_code=code,
+        payload={"code": code},
+        status=SyncJob.FAILED,
+        attempts=jobs.MAX_ATTEMPTS,
+        **kwargs,
+    )
+
+
+class ReplayFailedSyncsTests(TransactionTestCase):
+    def replay(self, *args):
+        stdout = StringIO()
+        call_command("replay_failed_syncs", "--workers=1", *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_syncs_are_replayed_from_the_failed_stage(self):
+        job = failed("AAA-1", completed_stages=["master_data"], failed_stage="keap")
+        resumed = []
+
+        def sync_booking(booking):
+            resumed.append(pipeline._completed.get())
+
+        with mock.patch.object(jobs, "sync_booking", side_effect=sync_booking):
+            with self.assertLogs("main.utils.jobs", "INFO"):
+                output = self.replay()
+
+        self.assertIn("1 succeeded", output)
+        self.assertEqual(resumed, [{"master_data"}])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (SyncJob.DONE, 1))
+
+    def test_only_syncs_that_failed_at_the_stage_are_queued(self):
+        failed("AAA-1")
+        SyncJob.objects.create(booking_code="AAA-1", payload={}, status=SyncJob.DONE)
+        failed("BBB-1", failed_stage="passengers")
+        failed("CCC-1", failed_stage="master_data")
+
+        output = self.replay("--stage=passengers", "--queue")
+        self.assertIn("Queued 1 failed syncs", output)
+        self.assertEqual(
+            list(
+                SyncJob.objects.filter(status=SyncJob.PENDING).values_list(
+                    "booking_code", "attempts"
+                )
+            ),
+            [("BBB-1", 0)],
+        )
+
+    def test_bookings_delivered_again_are_left_alone(self):
+        failed("AAA-1")
+        SyncJob.objects.create(booking_code="AAA-1", payload={}, status=SyncJob.DONE)
+
+        output = self.replay("--queue")
+        self.assertIn("Skipping 1 with a newer delivery", output)
+        self.assertEqual(SyncJob.objects.filter(status=SyncJob.FAILED).count(), 1)
@@ -0,0 +1,93 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase
+
+from main.management.commands import replay_webhooks
+from main.tests.bookings import StatusesMixin
+from main.utils import booking_mapper
+from main.utils.payloads import synthetic_booking
+
+
+class SyntheticBookingTests(StatusesMixin, TestCase):
+    def test_bookings_are_reproducible(self):
+        self.assertEqual(synthetic_booking(7), synthetic_booking(7))
+        self.assertNotEqual(synthetic_booking(7), synthetic_booking(8))
+
+    def test_bookings_can_be_mapped(self):
+        for i in range(50):
+            booking = synthetic_booking(i)
+            items, item_ids = booking_mapper.order_item_ids(booking)
+            order = booking_mapper.build_order(
+                items, [f"Tennis Holiday Algarve {item_id}" for item_id in item_ids]
+            )
+            record = booking_mapper.map_booking(booking, order)
+            self.assertEqual(record.code, f"SYN-{i:06d}")
+
+
+class ReplayWebhooksTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        with open(os.path.join(self.directory, "one.json"), "w") as f:
+            json.dump({"booking": {"code": "AAA-1"}}, f)
+        with open(os.path.join(self.directory, "more.jsonl"), "w") as f:
+            f.write('{"code": "BBB-1"}\n\n{"booking": {"code": "CCC-1"}}\n')
+        patcher = mock.patch.object(replay_webhooks.requests, "Session")
+        self.session = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.session.post.return_value.status_code = 202
+
+    def replay(self, *args):
+        stdout = StringIO()
+        call_command(
+            "replay_webhooks",
+            "--url=http://staging/webhooks/",
+            *args,
+            stdout=stdout,
+            stderr=StringIO(),
+        )
+        return stdout.getvalue()
+
+    def test_recorded_deliveries_are_loaded(self):
+        self.assertEqual(
+            [
+                booking["code"]
+                for booking in replay_webhooks.load_payloads([self.directory])
+            ],
+            ["BBB-1", "CCC-1", "AAA-1"],
+        )
+
+    def test_url_is_required(self):
+        with self.assertRaises(CommandError):
+            call_command("replay_webhooks", "--synthetic=1")
+
+    def test_deliveries_are_posted_to_the_url(self):
+        output = self.replay(
+            f"--payloads={self.directory}", "--count=4", "--fresh-codes"
+        )
+
+        posted = sorted(
+            (call.args[0], call.kwargs["json"]["booking"]["code"])
+            for call in self.session.post.call_args_list
+        )
+        self.assertEqual(
+            posted,
+            [
+                ("http://staging/webhooks/", "AAA-1-R2"),
+                ("http://staging/webhooks/", "BBB-1-R0"),
+                ("http://staging/webhooks/", "BBB-1-R3"),
+                ("http://staging/webhooks/", "CCC-1-R1"),
+            ],
+        )
+        self.assertIn("202", output)
+
+    def test_errors_are_reported_as_outcomes(self):
+        self.session.post.side_effect = replay_webhooks.requests.ConnectionError
+        output = self.replay("--synthetic=2")
+        self.assertIn("ConnectionError", output)
@@ -0,0 +1,81 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+from main.models import Checkpoint, KeapContact
+from main.tests.bookings import StatusesMixin, map_webhook_booking
+from main.utils import keap_api, sheet_api
+
+
+def upsert(keap_contact, fields=None, notes=True):
+    # Links the contact to its booking like a real upsert of every field does
+    KeapContact.objects.update_or_create(
+        email=keap_contact.email(),
+        defaults={"contact_id": 1, "booking_id": keap_contact.booking_id()},
+    )
+
+
+class ResyncKeapContactsTests(StatusesMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        # The passengers of both bookings share their emails
+        rows = [["Booking Code"]] + [
+            list(map_webhook_booking(code, email=email).sheet_row)
+            for code, email in [("AAA-1", "ann@example.com"), ("BBB-1", "bo@x")]
+        ]
+        for patcher in [
+            mock.patch.object(sheet_api, "read_all_rows", return_value=rows),
+            mock.patch.object(
+                keap_api.Contact,
+                "add_or_update_contact_in_keap",
+                autospec=True,
+                side_effect=upsert,
+            ),
+        ]:
+            self.upsert = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def resync(self):
+        call_command(
+            "resync_keap_contacts", "--workers=1", "--batch-size=1", stdout=StringIO()
+        )
+
+    def pushed(self):
+        return sorted(
+            (call.args[0].email(), call.args[0].booking_id())
+            for call in self.upsert.call_args_list
+        )
+
+    def test_each_email_is_pushed_once_from_its_newest_booking(self):
+        self.resync()
+
+        self.assertEqual(
+            self.pushed(),
+            [
+                ("ann@example.com", "AAA-1"),
+                ("bo@x", "BBB-1"),
+                ("bob@example.com", "BBB-1"),
+                ("e@x", "BBB-1"),
+                ("f@x", "BBB-1"),
+            ],
+        )
+        self.assertFalse(Checkpoint.objects.exists())
+
+    def test_interrupted_resync_resumes_after_the_last_batch(self):
+        def interrupt(keap_contact, fields=None, notes=True):
+            if keap_contact.booking_id() == "AAA-1":
+                raise KeyboardInterrupt
+            upsert(keap_contact)
+
+        self.upsert.side_effect = interrupt
+        with self.assertRaises(KeyboardInterrupt):
+            self.resync()
+        # Only the position is kept, pushed contacts are known from their links
+        self.assertEqual(Checkpoint.objects.get().data, {"position": 1})
+
+        self.upsert.reset_mock()
+        self.upsert.side_effect = upsert
+        self.resync()
+        self.assertEqual(self.pushed(), [("ann@example.com", "AAA-1")])
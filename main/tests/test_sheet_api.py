@@ -0,0 +1,216 @@
+import os
+import subprocess
+import sys
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+import main
+from main.models import SheetRow
+from main.utils import sheet_api
+
+
+class SheetTestMixin:
+    def setUp(self):
+        self.worksheet = mock.Mock(title="Import Data")
+        self.spreadsheet = mock.Mock()
+        for patcher in [
+            mock.patch.object(sheet_api, "get_worksheet", return_value=self.worksheet),
+            mock.patch.object(
+                sheet_api, "get_spreadsheet", return_value=self.spreadsheet
+            ),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class ClientTests(SimpleTestCase):
+    def setUp(self):
+        for name in ["_spreadsheet", "_worksheet"]:
+            patcher = mock.patch.object(sheet_api, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(sheet_api.gspread, "service_account_from_dict")
+        self.service_account = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_client_is_created_once_on_first_use(self):
+        spreadsheet = self.service_account.return_value.open_by_key.return_value
+
+        self.assertIs(sheet_api.get_worksheet(), spreadsheet.worksheet.return_value)
+        self.assertIs(sheet_api.get_spreadsheet(), spreadsheet)
+        self.service_account.assert_called_once()
+        self.service_account.return_value.set_timeout.assert_called_once_with(
+            sheet_api.TIMEOUT
+        )
+        spreadsheet.worksheet.assert_called_once_with("Import Data")
+
+    def test_worker_boots_without_google(self):
+        # A fresh interpreter, where any import-time Google call would fail
+        boot = (
+            "import django, gspread\n"
+            "gspread.service_account_from_dict = None\n"
+            "django.setup()\n"
+            "import main.views, main.utils.jobs\n"
+        )
+        subprocess.run(
+            [sys.executable, "-c", boot],
+            cwd=os.path.dirname(os.path.dirname(main.__file__)),
+            env={"DJANGO_SETTINGS_MODULE": "benchmarks.settings"},
+            check=True,
+        )
+
+
+class BuildIndexTests(SheetTestMixin, TestCase):
+    def test_index_follows_the_sheet(self):
+        SheetRow.objects.create(code="AAA-1", row=2)
+        SheetRow.objects.create(code="GONE-1", row=3)
+        self.worksheet.col_values.return_value = ["Booking Code", "", "AAA-1", "BBB-1"]
+
+        sheet_api.build_index()
+        self.assertEqual(
+            dict(SheetRow.objects.values_list("code", "row")),
+            {"Booking Code": 1, "AAA-1": 3, "BBB-1": 4},
+        )
+
+    def test_rows_appended_during_the_read_are_kept(self):
+        def col_values(column):
+            # Another worker appends a booking while the column is read
+            SheetRow.objects.create(code="NEW-1", row=3)
+            return ["Booking Code", "AAA-1"]
+
+        self.worksheet.col_values.side_effect = col_values
+
+        sheet_api.build_index()
+        self.assertEqual(
+            dict(SheetRow.objects.values_list("code", "row")),
+            {"Booking Code": 1, "AAA-1": 2, "NEW-1": 3},
+        )
+
+
+class FindRowsTests(SheetTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        SheetRow.objects.create(code="AAA-1", row=2)
+        self.writer = sheet_api.SheetWriter()
+
+    def test_recently_checked_index_needs_no_sheets_request(self):
+        self.writer.index_checked_at = time.monotonic()
+
+        self.assertEqual(self.writer.find_rows(["AAA-1", "BBB-1"]), {"AAA-1": 2})
+        self.worksheet.batch_get.assert_not_called()
+
+    def test_old_index_is_checked_once(self):
+        self.worksheet.batch_get.return_value = [[["AAA-1"]]]
+
+        self.assertEqual(self.writer.find_rows(["AAA-1"]), {"AAA-1": 2})
+        self.assertEqual(self.writer.find_rows(["AAA-1"]), {"AAA-1": 2})
+        self.worksheet.batch_get.assert_called_once_with(["A2"])
+
+    def test_moved_rows_rebuild_the_index(self):
+        self.worksheet.batch_get.return_value = [[["BBB-1"]]]
+        self.worksheet.col_values.return_value = ["Booking Code", "BBB-1", "AAA-1"]
+
+        with self.assertLogs("main.utils.sheet_api", "WARNING"):
+            self.assertEqual(self.writer.find_rows(["AAA-1"]), {"AAA-1": 3})
+
+
+class IndexAfterFailedWriteTests(SheetTestMixin, TransactionTestCase):
+    def test_failed_write_checks_the_index_again(self):
+        SheetRow.objects.create(code="AAA-1", row=2)
+        writer = sheet_api.SheetWriter()
+        writer.index_checked_at = time.monotonic()
+        self.worksheet.batch_get.return_value = [[["AAA-1"]]]
+        self.worksheet.batch_update.side_effect = [ConnectionError("down"), None]
+
+        with mock.patch.object(writer, "schedule"):
+            writer.write_cells("AAA-1", {2: "Paid"})
+            with self.assertLogs("main.utils.sheet_api", "ERROR"):
+                writer.flush()
+            self.worksheet.batch_get.assert_not_called()
+            writer.write_cells("AAA-1", {2: "Paid"})
+            writer.flush()
+        self.worksheet.batch_get.assert_called_once_with(["A2"])
+
+
+class SheetWriterTests(SheetTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.writer = sheet_api.SheetWriter()
+        for patcher in [
+            # The tests flush, not a timer
+            mock.patch.object(self.writer, "schedule"),
+            mock.patch.object(self.writer, "find_rows", return_value={"AAA-1": 5}),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_writes_to_a_booking_are_merged(self):
+        first = self.writer.write("AAA-1", ["AAA-1", "Paid", "x"])
+        second = self.writer.write_cells("AAA-1", {2: "Cancelled", 5: "y"})
+        self.writer.flush()
+
+        self.worksheet.batch_update.assert_called_once_with(
+            [
+                {"range": "A5:C5", "values": [["AAA-1", "Cancelled", "x"]]},
+                {"range": "E5:E5", "values": [["y"]]},
+            ],
+            value_input_option="user_entered",
+        )
+        self.assertEqual((first.result(0), second.result(0)), (5, 5))
+
+    def test_new_bookings_are_appended_in_one_request(self):
+        self.spreadsheet.values_append.return_value = {
+            "updates": {"updatedRange": "'Import Data'!A10:B11"}
+        }
+        futures = self.writer.write_rows({"BBB-1": ["BBB-1"], "CCC-1": ["CCC-1"]})
+        self.writer.flush()
+
+        self.spreadsheet.values_append.assert_called_once()
+        self.assertEqual(
+            self.spreadsheet.values_append.call_args.kwargs["body"],
+            {"values": [["BBB-1"], ["CCC-1"]]},
+        )
+        self.assertEqual(
+            {code: future.result(0) for code, future in futures.items()},
+            {"BBB-1": 10, "CCC-1": 11},
+        )
+        self.assertEqual(
+            dict(SheetRow.objects.values_list("code", "row")),
+            {"BBB-1": 10, "CCC-1": 11},
+        )
+
+    def test_failed_flush_fails_every_write(self):
+        self.worksheet.batch_update.side_effect = ConnectionError("Sheets is down")
+        update = self.writer.write_cells("AAA-1", {2: "Paid"})
+        # Only whole rows can be appended for bookings missing from the sheet
+        missing = self.writer.write_cells("BBB-1", {2: "Paid"})
+        appends = self.writer.write_rows({"CCC-1": ["CCC-1"]})
+        with self.assertLogs("main.utils.sheet_api", "ERROR"):
+            self.writer.flush()
+
+        with self.assertRaises(LookupError):
+            missing.result(0)
+        for future in [update, appends["CCC-1"]]:
+            with self.assertRaises(ConnectionError):
+                future.result(0)
+        self.spreadsheet.values_append.assert_not_called()
+
+    def test_flush_size_is_measured(self):
+        self.writer.write_rows({"AAA-1": ["AAA-1"], "BBB-1": ["BBB-1"]})
+        self.spreadsheet.values_append.return_value = {
+            "updates": {"updatedRange": "'Import Data'!A10:A10"}
+        }
+        with mock.patch.object(sheet_api.metrics, "observe") as observe:
+            self.writer.flush()
+
+        observe.assert_any_call("activeaway_sheet_flush_bookings", 2)
+
+    def test_full_buffer_is_flushed_straight_away(self):
+        self.writer.max_batch_size = 2
+        self.writer.write_cells("AAA-1", {2: "Paid"})
+        self.writer.schedule.assert_called_once_with(self.writer.window)
+
+        self.writer.write_cells("BBB-1", {2: "Paid"})
+        self.writer.schedule.assert_called_with(0)
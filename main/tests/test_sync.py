@@ -0,0 +1,95 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from main.tests.bookings import StatusesMixin, map_webhook_booking
+from main.utils import keap_api, sync
+from main.utils.snapshots import save_snapshot
+
+
+class PassengerTests(StatusesMixin, SimpleTestCase):
+    def test_passengers_are_deduplicated_by_email(self):
+        contacts = sync.build_passenger_contacts(map_webhook_booking())
+        # Cy shares the lead's email and Di shares Bob's
+        self.assertEqual(
+            [contact.email() for contact in contacts],
+            ["bob@example.com", "e@x", "f@x"],
+        )
+
+    def test_each_passenger_is_upserted_once(self):
+        record = map_webhook_booking()
+        with mock.patch.object(sync, "sync_contact") as sync_contact:
+            sync.sync_passengers(record)
+        self.assertCountEqual(
+            [call.args[1].email() for call in sync_contact.call_args_list],
+            ["bob@example.com", "e@x", "f@x"],
+        )
+
+
+class ContactSyncTests(StatusesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.record = map_webhook_booking()
+        self.contact = sync.build_lead_contact(self.record)
+        patcher = mock.patch.object(keap_api.Contact, "add_or_update_contact_in_keap")
+        self.upsert = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unchanged_contact_sends_nothing(self):
+        payload = self.contact.payload()
+        self.assertEqual(self.contact.changes_since(None), payload)
+        self.assertEqual(self.contact.changes_since(payload), {})
+
+    def test_only_changed_fields_are_sent(self):
+        previous = {**self.contact.payload(), "given_name": "Anne"}
+
+        changes = self.contact.changes_since(previous)
+        self.assertEqual(
+            changes,
+            {
+                "given_name": "Ann",
+                "email_addresses": previous["email_addresses"],
+                "duplicate_option": "Email",
+            },
+        )
+
+    def test_booking_fields_are_sent_together(self):
+        previous = self.contact.payload()
+        previous["custom_fields"] = [
+            {**d, "content": "Rob"} if d["id"] == 239 else d
+            for d in previous["custom_fields"]
+        ]
+
+        changes = self.contact.changes_since(previous)
+        self.assertEqual(changes["custom_fields"], self.contact.custom_fields)
+        self.assertEqual(
+            {d["id"] for d in changes["custom_fields"]}, keap_api.BOOKING_FIELDS
+        )
+
+    def test_sync_contact_sends_the_changes_since_the_snapshot(self):
+        sync.sync_contact(self.record, self.contact)
+        with self.assertLogs("main.utils.sync", "INFO"):
+            sync.sync_contact(self.record, self.contact)
+        self.upsert.assert_called_once_with(self.contact.payload())
+
+        save_snapshot(
+            "AAA-1",
+            "contact:lead@example.com",
+            {**self.contact.payload(), "prefix": "Ms."},
+        )
+        sync.sync_contact(self.record, self.contact)
+        self.assertEqual(self.upsert.call_args.args[0]["prefix"], "Mrs.")
+
+    def test_booking_sharing_the_email_is_not_mixed_with_another(self):
+        other = map_webhook_booking(code="BBB-1", p2firstname="Rob")
+        sync.sync_contact(self.record, self.contact)
+        # Keap now holds BBB-1 on the same contact
+        sync.sync_contact(other, sync.build_lead_contact(other))
+
+        record = map_webhook_booking(status="CANCELLED")
+        contact = sync.build_lead_contact(record)
+        sync.sync_contact(record, contact)
+        # AAA-1 is sent whole again, passengers included
+        self.assertEqual(
+            self.upsert.call_args.args[0]["custom_fields"], contact.custom_fields
+        )
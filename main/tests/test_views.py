@@ -0,0 +1,87 @@
+import threading
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from main.models import BookingFingerprint, SyncJob
+from main.utils import fingerprint, jobs
+from main.views import WebhooksView
+
+BOOKING = {"code": "AAA-1", "status": "PAID", "customer": {"email": "a@example.com"}}
+
+
+def deliver(booking):
+    request = APIRequestFactory().post(
+        "/webhooks/", {"booking": booking}, format="json"
+    )
+    return WebhooksView.as_view()(request)
+
+
+class WebhooksViewTests(TestCase):
+    def test_delivery_is_queued_without_syncing(self):
+        with mock.patch.object(jobs, "sync_booking") as sync_booking:
+            response = deliver(BOOKING)
+
+        self.assertEqual(response.status_code, 202)
+        sync_booking.assert_not_called()
+        job = SyncJob.objects.get()
+        self.assertEqual((job.booking_code, job.status), ("AAA-1", SyncJob.PENDING))
+        self.assertEqual(job.payload, BOOKING)
+
+
+class DuplicateDeliveryTests(TestCase):
+    def setUp(self):
+        fingerprint.record_synced("AAA-1", fingerprint.booking_fingerprint(BOOKING))
+
+    def test_synced_booking_delivered_again_is_skipped(self):
+        with self.assertLogs("main.views", "INFO"):
+            response = deliver(BOOKING)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(SyncJob.objects.exists())
+        self.assertEqual(BookingFingerprint.objects.get().skipped_deliveries, 1)
+
+    def test_changed_booking_is_queued(self):
+        response = deliver({**BOOKING, "status": "CANCELLED"})
+        self.assertEqual(response.status_code, 202)
+
+    def test_delivery_is_queued_while_a_job_of_the_booking_is_queued(self):
+        # The queued job may change the booking again
+        SyncJob.objects.create(booking_code="AAA-1", payload={})
+        self.assertEqual(deliver(BOOKING).status_code, 202)
+
+    def test_delivery_is_queued_once_the_fingerprint_expired(self):
+        BookingFingerprint.objects.update(
+            synced_at=timezone.now() - timedelta(seconds=fingerprint.TTL + 1)
+        )
+        self.assertEqual(deliver(BOOKING).status_code, 202)
+
+
+class WorkerTests(TransactionTestCase):
+    def test_worker_syncs_the_queued_bookings(self):
+        deliver(BOOKING)
+        deliver({**BOOKING, "code": "BBB-1"})
+        with mock.patch.object(jobs, "sync_booking") as sync_booking:
+            jobs.work(threading.Event(), once=True)
+
+        self.assertEqual(
+            [call.args[0]["code"] for call in sync_booking.call_args_list],
+            ["AAA-1", "BBB-1"],
+        )
+        self.assertEqual(
+            set(SyncJob.objects.values_list("status", flat=True)), {SyncJob.DONE}
+        )
+
+    def test_failed_sync_is_retried_later(self):
+        deliver(BOOKING)
+        with mock.patch.object(jobs, "sync_booking", side_effect=ValueError("bad")):
+            with self.assertLogs("main.utils.jobs", "ERROR"):
+                jobs.work(threading.Event(), once=True)
+
+        job = SyncJob.objects.get()
+        self.assertEqual((job.status, job.attempts), (SyncJob.PENDING, 1))
+        self.assertIn("ValueError('bad')", job.last_error)
+        self.assertGreater(job.run_after, job.last_attempt_at)
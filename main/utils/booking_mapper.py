@@ -0,0 +1,376 @@
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+
+import pytz
+
+from main.utils import checkfront_api, keap_api
+from main.utils.locals import find_replace_product_name, find_replace_venue_name
+
+logger = logging.getLogger(__name__)
+
+LONDON = pytz.timezone("Europe/London")
+
+# The Import Data columns in order. ("customer" | "fields" | "order", key, default)
+# reads the webhook payload, ("record", name) a value computed once per booking
+# and ("",) leaves the column empty.
+SHEET_COLUMNS = [
+    ("booking", "code"),  # A
+    ("record", "status"),  # B
+    ("record", "created_day"),  # C
+    ("",),  # D
+    ("",),  # E
+    ("record", "product"),  # F
+    ("record", "venue"),  # G
+    ("record", "quantity"),  # H
+    ("order", "sub_total", ""),  # I
+    ("order", "tax_total", None),  # J
+    ("record", "tax_included_total"),  # K
+    ("order", "discount", None),  # L
+    ("",),  # M
+    ("",),  # N
+    ("order", "paid_total", ""),  # O
+    ("record", "balance_due"),  # P
+    ("order", "total", ""),  # Q
+    ("record", "booked_items"),  # R
+    ("customer", "lptitle", ""),  # S
+    ("record", "first_name"),  # T
+    ("record", "last_name"),  # U
+    ("customer", "lpdob", ""),  # V
+    ("customer", "email", None),  # W
+    ("customer", "phone", ""),  # X
+    ("customer", "iptennislevel", ""),  # Y
+    ("fields", "tennis_standard__more_informat", ""),  # Z
+    ("customer", "address", ""),  # AA
+    ("customer", "addressline2", ""),  # AB
+    ("customer", "city", ""),  # AC
+    ("customer", "postal_zip", ""),  # AD
+    ("customer", "country", ""),  # AE
+    ("fields", "promo", ""),  # AF
+    ("fields", "how_did_hear_about_this_holida", ""),  # AG
+    ("fields", "numbertravelling", ""),  # AH
+    ("fields", "how_many_players", ""),  # AI
+    ("fields", "tennisclub", ""),  # AJ
+    ("fields", "coachgroup", ""),  # AK
+    ("customer", "p5grp_ldr", ""),  # AL
+    ("fields", "sales_agent", ""),  # AM
+    ("fields", "linked_booking_id", ""),  # AN
+    ("fields", "p5board_basis", ""),  # AO
+    ("fields", "p5r1_type", ""),  # AP
+    ("fields", "p5room1_basis", ""),  # AQ
+    ("fields", "p5r1_sharing", ""),  # AR
+    ("fields", "room_1_id", ""),  # AS
+    ("fields", "p5room2_type", ""),  # AT
+    ("fields", "p5room2_basis", ""),  # AU
+    ("fields", "p5r2_sharing", ""),  # AV
+    ("fields", "room_2_id", ""),  # AW
+    ("fields", "p5r3_type", ""),  # AX
+    ("fields", "p5room3_basis", ""),  # AY
+    ("fields", "p5r3_sharing", ""),  # AZ
+    ("fields", "room_3_id", ""),  # BA
+    ("fields", "p2firstname", ""),  # BB
+    ("fields", "p2lastname", ""),  # BC
+    ("fields", "p2dob", ""),  # BD
+    ("fields", "p2-email", ""),  # BE
+    ("fields", "p2-phone", ""),  # BF
+    ("fields", "p2tennislevel", ""),  # BG
+    ("fields", "p3firstname", ""),  # BH
+    ("fields", "p3lastname", ""),  # BI
+    ("fields", "p3dob", ""),  # BJ
+    ("fields", "p3_email", ""),  # BK
+    ("fields", "p3_phone", ""),  # BL
+    ("fields", "p3tennislevel", ""),  # BM
+    ("fields", "p4firstname", ""),  # BN
+    ("fields", "p4lastname", ""),  # BO
+    ("fields", "p4dob", ""),  # BP
+    ("fields", "p4_email", ""),  # BQ
+    ("fields", "p4_phone", ""),  # BR
+    ("fields", "p4tennislevel", ""),  # BS
+    ("fields", "p5firstname", ""),  # BT
+    ("fields", "p5lastname", ""),  # BU
+    ("fields", "p5dob", ""),  # BV
+    ("fields", "p5_email", ""),  # BW
+    ("fields", "p5_phone", ""),  # BX
+    ("fields", "p5tennislevel", ""),  # BY
+    ("fields", "p6firstname", ""),  # BZ
+    ("fields", "p6lastname", ""),  # CA
+    ("fields", "p6dob", ""),  # CB
+    ("fields", "p6_email", ""),  # CC
+    ("fields", "p6_phone", ""),  # CD
+    ("fields", "p6tennislevel", ""),  # CE
+    ("fields", "tenfitpackage", ""),  # CF
+    ("fields", "outbound_flight_arrival_date", ""),  # CG
+    ("fields", "outflighttime", ""),  # CH
+    ("fields", "outbound_flight_departure_airp", ""),  # CI
+    ("fields", "outbound_flight_arrival_airpor", ""),  # CJ
+    ("fields", "outflightnum", ""),  # CK
+    ("fields", "inbound_flight_departure_date", ""),  # CL
+    ("fields", "inflighttime", ""),  # CM
+    ("fields", "inbound_flight_departure_airpo", ""),  # CN
+    ("fields", "inbound_flight_arrival_airport", ""),  # CO
+    ("fields", "inflightnum", ""),  # CP
+    ("record", "url"),  # CQ
+    ("",),  # CR
+    ("record", "start_day"),  # CS
+    ("record", "end_day"),  # CT
+]
+
+
+class Order:
+    def __init__(self, items, order_product_name, product, venue):
+        self.items = items
+        self.order_product_name = order_product_name
+        self.product = product
+        self.venue = venue
+
+
+@dataclass(slots=True)
+class Passenger:
+    contact: keap_api.BasicContacInfo
+    level_of_tennis: str
+
+
+@dataclass(slots=True)
+class BookingRecord:
+    code: str
+    product: str
+    venue: str
+    booked_items: str
+    contact: keap_api.BasicContacInfo
+    billing_address: keap_api.BillingAddress
+    booking_data: keap_api.Booking
+    level_of_tennis: str
+    tennis_standard_info: str
+    additional_passengers: tuple
+    passengers: tuple
+    sheet_row: tuple
+
+
+def order_item_ids(booking):
+    # Check what product the customer ordered
+    items = booking.get("order").get("items", "").get("item", {})
+    # Customer has ordered just one item
+    if type(items) is dict:
+        return items, [items["@attributes"].get("item_id")]
+    # Customer has ordered more than one item
+    if type(items) is list:
+        return items, [product["@attributes"].get("item_id") for product in items]
+    return items, []
+
+
+def build_order(items, products):
+    order_product_name = ", ".join(str(x) for x in products if x is not None)
+    logger.debug("order_product_name: %s", order_product_name)
+
+    # Find & Replace Product Name
+    product = find_replace_product_name(order_product_name)
+
+    # Find & Replace Venue
+    venue = find_replace_venue_name(order_product_name)
+
+    return Order(items, order_product_name, product, venue)
+
+
+def resolve_order(booking):
+    items, item_ids = order_item_ids(booking)
+    return build_order(items, checkfront_api.resolve_item_names(item_ids))
+
+
+def compile_columns(columns):
+    # Turn the column specification into one getter per column
+    getters = []
+    for source, *spec in columns:
+        if not source:
+            getters.append(lambda values: "")
+        elif source in ("booking", "record"):
+            getters.append(lambda values, s=source, k=spec[0]: values[s].get(k))
+        else:
+            getters.append(
+                lambda values, s=source, k=spec[0], d=spec[1]: values[s].get(k, d)
+            )
+    return tuple(getters)
+
+
+SHEET_GETTERS = compile_columns(SHEET_COLUMNS)
+
+
+def sheet_column(source, name):
+    # 0-based Import Data column of a value
+    return next(
+        index
+        for index, column in enumerate(SHEET_COLUMNS)
+        if column[:2] == (source, name)
+    )
+
+
+def timestamp(value):
+    return datetime.fromtimestamp(int(value), LONDON)
+
+
+def day_timestamp(value, day_format):
+    return int(LONDON.localize(datetime.strptime(value, day_format)).timestamp())
+
+
+def quantity(items):
+    if type(items) is list:
+        return sum(int(item.get("qty")) for item in items)
+    if type(items) is dict:
+        return int(items.get("qty"))
+    return 0
+
+
+def passenger(fields, i):
+    email = fields.get("p2-email", "") if i == 2 else fields.get(f"p{i}_email", "")
+    return Passenger(
+        contact=keap_api.BasicContacInfo(
+            email=email,
+            first_name=fields.get(f"p{i}firstname", ""),
+            last_name=fields.get(f"p{i}lastname", ""),
+            title=keap_api.filter_title(fields.get(f"p{i}title", "")),
+            phone_number=fields.get("p2-phone", "")
+            if i == 2
+            else fields.get(f"p{i}_phone", ""),
+        ),
+        level_of_tennis=fields.get(f"p{i}tennislevel", ""),
+    )
+
+
+def map_booking(booking, order):
+    # Everything the sync needs from a webhook payload, in a single pass
+    customer = booking["customer"]
+    fields = booking["fields"]
+    order_data = booking["order"]
+    created = timestamp(booking.get("created_date"))
+    start = timestamp(booking.get("start_date"))
+    end = timestamp(booking.get("end_date"))
+    status = checkfront_api.get_statuses().get(
+        booking.get("status"), booking.get("status")
+    )
+    url = f'https://activeaway.checkfront.co.uk/booking/{booking["code"]}'
+
+    contact = keap_api.BasicContacInfo(
+        email=customer.get("email", ""),
+        first_name=customer.get("name", ""),
+        last_name=customer.get("lplastname", ""),
+        title=keap_api.filter_title(customer.get("lptitle", "")),
+        phone_number=customer.get("phone", ""),
+    )
+    balance_due = float(order_data.get("total", "")) - float(
+        order_data.get("paid_total", "")
+    )
+    tax_included_total = float(order_data.get("sub_total", 0)) + float(
+        order_data.get("tax_total", 0)
+    )
+    values = {
+        "booking": booking,
+        "customer": customer,
+        "fields": fields,
+        "order": order_data,
+        "record": {
+            "status": status,
+            "created_day": created.strftime("%d/%m/%Y"),
+            "product": order.product,
+            "venue": order.venue,
+            "quantity": quantity(order.items),
+            "tax_included_total": f"{tax_included_total:.2f}",
+            "balance_due": f"{balance_due:.2f}",
+            "booked_items": order.order_product_name,
+            "first_name": contact.first_name,
+            "last_name": contact.last_name,
+            "url": url,
+            "start_day": start.strftime("%Y%m%d"),
+            "end_day": end.strftime("%Y%m%d"),
+        },
+    }
+
+    return BookingRecord(
+        code=booking.get("code"),
+        product=order.product,
+        venue=order.venue,
+        booked_items=order.order_product_name,
+        contact=contact,
+        billing_address=keap_api.BillingAddress(
+            line_1=customer.get("address", ""),
+            line_2=customer.get("addressline2", ""),
+            city=customer.get("city", ""),
+            zip_code=customer.get("postal_zip", ""),
+            country=customer.get("country", ""),
+        ),
+        booking_data=keap_api.Booking(
+            id=booking.get("code", ""),
+            url=url,
+            status=status,
+            created_date=created.strftime("%Y-%m-%d"),
+            start_date=start.strftime("%Y-%m-%d"),
+            end_date=end.strftime("%Y-%m-%d"),
+            event_type=order.product,
+            tennis_club=customer.get("tennisclub"),
+            event_location=order.venue,
+            group_organiser=customer.get("p5grp_ldr"),
+        ),
+        level_of_tennis=customer.get("iptennislevel"),
+        tennis_standard_info=str(fields.get("tennis_standard__more_informat")),
+        additional_passengers=tuple(
+            keap_api.AdditionalPassengerInfo(
+                first_name=fields.get(f"p{i}firstname"),
+                surname=fields.get(f"p{i}lastname"),
+                tennis_standard=fields.get(f"p{i}tennislevel"),
+            )
+            # The third Keap passenger slot has always been filled from p3 too
+            for i in (2, 3, 3)
+        ),
+        passengers=tuple(passenger(fields, i) for i in range(2, 7)),
+        sheet_row=tuple(
+            (str(i) if i != {} else "")  # Formatting empty data
+            for i in (getter(values) for getter in SHEET_GETTERS)
+        ),
+    )
+
+
+def map_bookings(bookings):
+    # Map a batch of payloads, resolving the items of all of them at once
+    bookings = list(bookings)
+    orders = [order_item_ids(booking) for booking in bookings]
+    names = iter(
+        checkfront_api.resolve_item_names(
+            [item_id for _, item_ids in orders for item_id in item_ids]
+        )
+    )
+    return [
+        map_booking(booking, build_order(items, [next(names) for _ in item_ids]))
+        for booking, (items, item_ids) in zip(bookings, orders)
+    ]
+
+
+def record_from_row(row):
+    # Map an Import Data row back into a booking, as far as the sheet holds it
+    row = list(row) + [""] * (len(SHEET_COLUMNS) - len(row))
+    booking = {"customer": {}, "fields": {}, "order": {}}
+    record = {}
+    for (source, *spec), value in zip(SHEET_COLUMNS, row):
+        if source == "booking":
+            booking[spec[0]] = value
+        elif source == "record":
+            record[spec[0]] = value
+        elif source:
+            booking[source][spec[0]] = value
+    # The customer form fields are both in the customer and the fields, as in
+    # booking_from_api, while each column only fills one of them
+    for key in checkfront_api.CUSTOMER_FIELDS:
+        value = booking["customer"].get(key) or booking["fields"].get(key, "")
+        booking["customer"][key] = booking["fields"][key] = value
+    booking["customer"]["name"] = record["first_name"]
+    booking["customer"]["lplastname"] = record["last_name"]
+    # The sheet holds the status name, which maps to itself
+    booking["status"] = record["status"]
+    booking["created_date"] = day_timestamp(record["created_day"], "%d/%m/%Y")
+    booking["start_date"] = day_timestamp(record["start_day"], "%Y%m%d")
+    booking["end_date"] = day_timestamp(record["end_day"], "%Y%m%d")
+    # Products and venues without a match were written as "None"
+    order = Order(
+        {"qty": record["quantity"] or 0},
+        record["booked_items"],
+        None if record["product"] == "None" else record["product"],
+        None if record["venue"] == "None" else record["venue"],
+    )
+    return map_booking(booking, order)
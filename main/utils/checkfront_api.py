@@ -1,20 +1,305 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+
 import requests
 from django.conf import settings
-from main.models import CheckfrontStatus
+from django.db import connection
+from django.utils import timezone
+from main.models import CheckfrontStatus, Item
+from main.utils import metrics
+from main.utils.circuit_breakers import protect
 from requests.auth import HTTPBasicAuth
 
+logger = logging.getLogger(__name__)
+
+# Seconds a resolved item name is kept in memory before the database is asked again
+ITEM_CACHE_TTL = getattr(settings, "CHECKFRONT_ITEM_CACHE_TTL", 300)
+# Seconds before an id unknown to Checkfront is looked up again
+MISSING_ITEM_TTL = getattr(settings, "CHECKFRONT_MISSING_ITEM_TTL", 3600)
+# Concurrent item lookups when resolving the items of one order
+ITEM_FETCH_WORKERS = getattr(settings, "CHECKFRONT_ITEM_FETCH_WORKERS", 4)
+# Booking pages fetched ahead of the one being processed
+PAGE_WINDOW = getattr(settings, "CHECKFRONT_PAGE_WINDOW", 4)
+# (connect, read) timeouts in seconds
+TIMEOUT = (
+    getattr(settings, "CHECKFRONT_CONNECT_TIMEOUT", 5),
+    getattr(settings, "CHECKFRONT_READ_TIMEOUT", 30),
+)
+
+# Customer form fields the webhook sends with the customer
+CUSTOMER_FIELDS = [
+    "lplastname",
+    "lptitle",
+    "lpdob",
+    "addressline2",
+    "iptennislevel",
+    "tennisclub",
+    "p5grp_ldr",
+]
+
 # Session setup
 session = requests.Session()
 session.auth = HTTPBasicAuth(
     settings.CHECKFRONT_API_KEY, settings.CHECKFRONT_API_SECRET
 )
+# Keep enough connections alive for every item lookup thread
+protect(session, "checkfront", pool_maxsize=max(10, ITEM_FETCH_WORKERS))
+metrics.count_requests(session, "checkfront")
+
+# Statuses configuration, loaded on first use
+_statuses = None
+_statuses_lock = threading.Lock()
+
+# item_id -> (name, cached at)
+_item_names = {}
+_item_names_lock = threading.Lock()
+# item_id -> Future of the lookup currently running for it
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+_executor = ThreadPoolExecutor(
+    max_workers=ITEM_FETCH_WORKERS, thread_name_prefix="checkfront-item"
+)
+
+
+def get_statuses():
+    global _statuses
+    if _statuses is None:
+        with _statuses_lock:
+            if _statuses is None:
+                _statuses = {
+                    status.status_id: status.label
+                    for status in CheckfrontStatus.objects.all()
+                }
+    return _statuses
+
+
+def fetch_item_name(item_id):
+    response = session.get(
+        f"{settings.CHECKFRONT_API_BASE_URL}/item/{item_id}", timeout=TIMEOUT
+    )
+    # Only an item Checkfront does not know is remembered as missing, errors are
+    # raised so the sync is retried
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    item = response.json().get("item")
+    return item.get("name") if item else None
+
+
+def store_item_name(item_id, name):
+    item, _ = Item.objects.update_or_create(
+        item_id=item_id, defaults={"name": name or "", "found": name is not None}
+    )
+    return item
+
+
+def cache_item_name(item_id, name):
+    with _item_names_lock:
+        _item_names[item_id] = (name, time.monotonic())
+
+
+def get_cached_item_name(item_id):
+    cached = _item_names.get(item_id)
+    if cached and time.monotonic() - cached[1] < ITEM_CACHE_TTL:
+        return True, cached[0]
+    return False, None
+
+
+def load_item_name(item_id):
+    # Fall back to the catalog mirror, and to Checkfront when the item is unknown
+    item = Item.objects.filter(item_id=item_id).first()
+    missing_expired = (
+        item is not None
+        and not item.found
+        and item.updated_at < timezone.now() - timedelta(seconds=MISSING_ITEM_TTL)
+    )
+    if item is None or missing_expired:
+        logger.info(f"Checkfront item {item_id} not in catalog, fetching it")
+        item = store_item_name(item_id, fetch_item_name(item_id))
 
-# Statuses configuration
-CHECKFRONT_STATUSES = {
-    status.status_id: status.label for status in CheckfrontStatus.objects.all()
-}
+    name = item.name if item.found else None
+    cache_item_name(item_id, name)
+    return name
 
 
+@metrics.timed("checkfront.check_item_name")
 def check_item_name(item_id):
-    response = session.get(f"{settings.CHECKFRONT_API_BASE_URL}/item/{item_id}").json()
-    return response["item"]["name"]
+    item_id = str(item_id)
+    hit, name = get_cached_item_name(item_id)
+    if hit:
+        return name
+
+    # Only one lookup per id runs at a time, concurrent callers share its result
+    with _in_flight_lock:
+        future = _in_flight.get(item_id)
+        owner = future is None
+        if owner:
+            future = _in_flight[item_id] = Future()
+    if owner:
+        try:
+            future.set_result(load_item_name(item_id))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with _in_flight_lock:
+                del _in_flight[item_id]
+    return future.result()
+
+
+def lookup_item_name(item_id):
+    try:
+        return check_item_name(item_id)
+    finally:
+        # The lookup threads live on, so they must not keep a connection open
+        connection.close()
+
+
+def resolve_item_names(item_ids):
+    # Resolve all items of an order concurrently, keeping the input order
+    item_ids = [str(item_id) for item_id in item_ids]
+    names = {}
+    missing = []
+    for item_id in dict.fromkeys(item_ids):
+        hit, name = get_cached_item_name(item_id)
+        if hit:
+            names[item_id] = name
+        else:
+            missing.append(item_id)
+
+    if len(missing) == 1:
+        names[missing[0]] = check_item_name(missing[0])
+    elif missing:
+        # Lookups run in the caller's context, so their requests count towards it
+        futures = [
+            _executor.submit(contextvars.copy_context().run, lookup_item_name, item_id)
+            for item_id in missing
+        ]
+        names.update(zip(missing, (future.result() for future in futures)))
+    return [names[item_id] for item_id in item_ids]
+
+
+def sync_item_catalog():
+    # Page through the whole Checkfront item catalog
+    names = {}
+    page = 1
+    while True:
+        response = session.get(
+            f"{settings.CHECKFRONT_API_BASE_URL}/item",
+            params={"page": page},
+            timeout=TIMEOUT,
+        ).json()
+        for item in (response.get("items") or {}).values():
+            names[str(item["item_id"])] = item.get("name", "")
+        if page >= int(response.get("request", {}).get("pages", 1)):
+            break
+        page += 1
+
+    # Upsert the catalog in bulk
+    existing = Item.objects.in_bulk(names.keys(), field_name="item_id")
+    now = timezone.now()
+    to_create = []
+    to_update = []
+    for item_id, name in names.items():
+        item = existing.get(item_id)
+        if item is None:
+            to_create.append(Item(item_id=item_id, name=name, found=True))
+        elif item.name != name or not item.found:
+            item.name = name
+            item.found = True
+            item.updated_at = now
+            to_update.append(item)
+    Item.objects.bulk_create(to_create)
+    Item.objects.bulk_update(to_update, ["name", "found", "updated_at"])
+
+    with _item_names_lock:
+        _item_names.clear()
+    logger.info(
+        f"Checkfront catalog synced: {len(names)} items, "
+        f"{len(to_create)} new, {len(to_update)} changed"
+    )
+    return len(names)
+
+
+def fetch_booking_page(params, page):
+    return session.get(
+        f"{settings.CHECKFRONT_API_BASE_URL}/booking",
+        params={**params, "page": page},
+        timeout=TIMEOUT,
+    ).json()
+
+
+def iter_booking_pages(params, start_page=1, window=PAGE_WINDOW):
+    # Yield (page, pages, bookings) in page order while the next pages are fetched
+    # concurrently. Only `window` pages are held in memory at any time.
+    response = fetch_booking_page(params, start_page)
+    pages = int(response.get("request", {}).get("pages", 1))
+    if start_page > pages:
+        return
+    yield start_page, pages, list((response.get("booking/index") or {}).values())
+
+    with ThreadPoolExecutor(
+        max_workers=window, thread_name_prefix="checkfront-page"
+    ) as executor:
+        futures = deque()
+        next_page = start_page + 1
+        while next_page <= pages or futures:
+            while next_page <= pages and len(futures) < window:
+                futures.append(
+                    (next_page, executor.submit(fetch_booking_page, params, next_page))
+                )
+                next_page += 1
+            page, future = futures.popleft()
+            bookings = (future.result().get("booking/index") or {}).values()
+            yield page, pages, list(bookings)
+
+
+def fetch_booking(booking_id):
+    response = session.get(
+        f"{settings.CHECKFRONT_API_BASE_URL}/booking/{booking_id}", timeout=TIMEOUT
+    ).json()
+    return response.get("booking")
+
+
+def booking_from_api(data):
+    # Shape a /booking/{id} response like the webhook payload the sync reads
+    fields = dict(data.get("fields") or {})
+    customer = {
+        "email": data.get("customer_email", ""),
+        "name": data.get("customer_name", ""),
+        "phone": data.get("customer_phone", ""),
+        "address": data.get("customer_address", ""),
+        "city": data.get("customer_city", ""),
+        "postal_zip": data.get("customer_postal_zip", ""),
+        "country": data.get("customer_country", ""),
+    }
+    for key in CUSTOMER_FIELDS:
+        customer[key] = fields.get(key, "")
+    items = [
+        {
+            "@attributes": {"item_id": str(item.get("item_id"))},
+            "qty": item.get("qty", 1),
+        }
+        for item in (data.get("items") or {}).values()
+    ]
+    return {
+        "code": data.get("code"),
+        "status": data.get("status_id"),
+        "created_date": data.get("created_date"),
+        "start_date": data.get("start_date"),
+        "end_date": data.get("end_date"),
+        "order": {
+            "items": {"item": items},
+            "sub_total": data.get("sub_total", 0),
+            "tax_total": data.get("tax_total", 0),
+            "discount": data.get("discount", 0),
+            "paid_total": data.get("paid_total", 0),
+            "total": data.get("total", 0),
+        },
+        "customer": customer,
+        "fields": fields,
+    }
@@ -0,0 +1,14 @@
+from main.models import Checkpoint
+
+
+def load_checkpoint(name):
+    checkpoint = Checkpoint.objects.filter(name=name).first()
+    return checkpoint.data if checkpoint else {}
+
+
+def save_checkpoint(name, data):
+    Checkpoint.objects.update_or_create(name=name, defaults={"data": data})
+
+
+def clear_checkpoint(name):
+    Checkpoint.objects.filter(name=name).delete()
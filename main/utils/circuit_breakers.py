@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from main.exceptions import CircuitOpenError, PipelineError
+
+logger = logging.getLogger(__name__)
+
+# Consecutive failed requests that open the circuit of an upstream
+FAILURE_THRESHOLD = getattr(settings, "CIRCUIT_FAILURE_THRESHOLD", 5)
+# Seconds an open circuit fails fast before one probe request is let through, and
+# seconds the probe may take before it counts as failed
+RESET_TIMEOUT = getattr(settings, "CIRCUIT_RESET_TIMEOUT", 30)
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probe_started_at = 0
+        # Called after a probe succeeded and the circuit closed again
+        self.listeners = []
+
+    def retry_in(self):
+        # Seconds until the next probe is let through
+        return max(0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def before_request(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if (
+                self.state == self.HALF_OPEN
+                and now >= self.probe_started_at + self.reset_timeout
+            ):
+                # The probe never answered, the others must not wait on it forever
+                logger.warning(f"Probe of {self.name} timed out, circuit opened")
+                self.state = self.OPEN
+                self.opened_at = now
+            if self.state == self.OPEN and now >= self.opened_at + self.reset_timeout:
+                logger.info(f"Probing {self.name} after its circuit was open")
+                self.state = self.HALF_OPEN
+                self.probe_started_at = now
+                return
+            # While a probe is running the others wait for its outcome
+            raise CircuitOpenError(
+                self.name,
+                self.retry_in() if self.state == self.OPEN else self.reset_timeout,
+            )
+
+    def record_success(self):
+        with self.lock:
+            closed = self.state != self.CLOSED
+            self.state = self.CLOSED
+            self.failures = 0
+        if closed:
+            logger.info(f"{self.name} is back, circuit closed")
+            for listener in self.listeners:
+                listener(self.name)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(
+                        f"{self.name} failed {self.failures} times, circuit opened"
+                    )
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class BreakerAdapter(HTTPAdapter):
+    # Fails fast while the circuit of its upstream is open
+    def __init__(self, breaker, **kwargs):
+        self.breaker = breaker
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        self.breaker.before_request()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+
+breakers = {name: CircuitBreaker(name) for name in ("checkfront", "keap", "sheets")}
+
+
+def protect(session, name, **kwargs):
+    session.mount("https://", BreakerAdapter(breakers[name], **kwargs))
+    return session
+
+
+def open_circuit(error):
+    # The CircuitOpenError behind a failed sync, if that is why it failed
+    if isinstance(error, CircuitOpenError):
+        return error
+    if isinstance(error, PipelineError):
+        for stage_error in error.errors.values():
+            found = open_circuit(stage_error)
+            if found:
+                return found
+    return None
@@ -0,0 +1,49 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from main.models import BookingFingerprint
+
+# Seconds an identical delivery of an already synced booking is ignored for
+TTL = getattr(settings, "WEBHOOK_DEDUP_TTL", 86400)
+
+# Booking fields the sync reads, anything else may change without a re-sync
+RELEVANT_FIELDS = [
+    "code",
+    "status",
+    "created_date",
+    "start_date",
+    "end_date",
+    "order",
+    "customer",
+    "fields",
+]
+
+
+def booking_fingerprint(booking):
+    relevant = {key: booking.get(key) for key in RELEVANT_FIELDS}
+    canonical = json.dumps(relevant, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def already_synced(code, fingerprint):
+    return BookingFingerprint.objects.filter(
+        code=code,
+        fingerprint=fingerprint,
+        synced_at__gte=timezone.now() - timedelta(seconds=TTL),
+    ).exists()
+
+
+def count_skipped(code):
+    BookingFingerprint.objects.filter(code=code).update(
+        skipped_deliveries=F("skipped_deliveries") + 1
+    )
+
+
+def record_synced(code, fingerprint):
+    BookingFingerprint.objects.update_or_create(
+        code=code, defaults={"fingerprint": fingerprint, "synced_at": timezone.now()}
+    )
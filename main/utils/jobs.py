@@ -0,0 +1,263 @@
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from main.exceptions import PipelineError
+from main.models import SyncJob
+from main.utils import metrics
+from main.utils.circuit_breakers import breakers, open_circuit
+from main.utils.fingerprint import (
+    already_synced,
+    booking_fingerprint,
+    count_skipped,
+    record_synced,
+)
+from main.utils.pipeline import resume, stage_outcome
+from main.utils.sync import sync_booking
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, "SYNC_JOB_MAX_ATTEMPTS", 5)
+RETRY_DELAY = getattr(settings, "SYNC_JOB_RETRY_DELAY", 30)  # seconds
+MAX_RETRY_DELAY = getattr(settings, "SYNC_JOB_MAX_RETRY_DELAY", 3600)  # seconds
+# A running job whose worker has not finished it after this long is released
+LOCK_TIMEOUT = getattr(settings, "SYNC_JOB_LOCK_TIMEOUT", 900)  # seconds
+# How often each worker looks for jobs left running by dead workers
+STALE_CHECK_INTERVAL = getattr(settings, "SYNC_JOB_STALE_CHECK_INTERVAL", 60)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+
+
+def claim_next_job(worker_id=""):
+    # Jobs of the same booking run strictly in the order they arrived, so a job
+    # waits while an older one of its booking is still waiting or running
+    blocked = SyncJob.objects.filter(
+        booking_code=OuterRef("booking_code"),
+        id__lt=OuterRef("id"),
+        status__in=[SyncJob.PENDING, SyncJob.RUNNING],
+    )
+    with transaction.atomic():
+        # Lock the oldest due job that no other worker holds
+        job = (
+            SyncJob.objects.select_for_update(skip_locked=True)
+            .filter(status=SyncJob.PENDING, run_after__lte=timezone.now())
+            .filter(~Exists(blocked))
+            .order_by("id")
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = SyncJob.RUNNING
+        job.attempts += 1
+        job.last_attempt_at = timezone.now()
+        job.locked_by = worker_id
+        job.save(update_fields=["status", "attempts", "last_attempt_at", "locked_by"])
+    return job
+
+
+def release_stale_jobs():
+    # Put back jobs held by workers that died halfway through a sync
+    cutoff = timezone.now() - timedelta(seconds=LOCK_TIMEOUT)
+    released = SyncJob.objects.filter(
+        status=SyncJob.RUNNING, last_attempt_at__lt=cutoff
+    ).update(status=SyncJob.PENDING, locked_by="")
+    if released:
+        logger.warning(f"Released {released} stale sync jobs")
+    return released
+
+
+def record_stages(job, error):
+    # Remember where the sync stopped, the next attempt starts from there
+    if not isinstance(error, PipelineError):
+        return
+    completed, failed = stage_outcome(error)
+    job.completed_stages = sorted(set(job.completed_stages) | set(completed))
+    job.failed_stage = ", ".join(failed)[:255]
+    job.save(update_fields=["completed_stages", "failed_stage"])
+
+
+def fail_job(job, error):
+    record_stages(job, error)
+    job.last_error = f"{error!r}\n{traceback.format_exc()}"
+    if job.attempts >= MAX_ATTEMPTS:
+        job.status = SyncJob.FAILED
+        job.finished_at = timezone.now()
+    else:
+        # Exponential backoff before the next attempt
+        delay = min(RETRY_DELAY * 2 ** (job.attempts - 1), MAX_RETRY_DELAY)
+        job.status = SyncJob.PENDING
+        job.run_after = timezone.now() + timedelta(seconds=delay)
+    job.locked_by = ""
+    job.waiting_for = ""
+    job.save(
+        update_fields=[
+            "status",
+            "last_error",
+            "run_after",
+            "finished_at",
+            "locked_by",
+            "waiting_for",
+        ]
+    )
+
+
+def finish_job(job):
+    job.status = SyncJob.DONE
+    job.finished_at = timezone.now()
+    job.locked_by = ""
+    job.waiting_for = ""
+    job.failed_stage = ""
+    job.save(
+        update_fields=[
+            "status",
+            "finished_at",
+            "locked_by",
+            "waiting_for",
+            "failed_stage",
+        ]
+    )
+
+
+def defer_job(job, error, sync_error):
+    # The upstream is down, run the job again once it is back without using up
+    # an attempt. The steps that already succeeded are skipped by the diff sync.
+    logger.warning(f"Sync job {job.pk} deferred, {error}")
+    record_stages(job, sync_error)
+    job.status = SyncJob.PENDING
+    job.attempts -= 1
+    job.last_error = repr(error)
+    job.waiting_for = error.upstream
+    job.run_after = timezone.now() + timedelta(seconds=error.retry_in)
+    job.locked_by = ""
+    job.save(
+        update_fields=[
+            "status",
+            "attempts",
+            "last_error",
+            "waiting_for",
+            "run_after",
+            "locked_by",
+        ]
+    )
+
+
+def release_deferred_jobs(upstream):
+    # A probe succeeded, the jobs waiting for the upstream may run straight away
+    released = SyncJob.objects.filter(
+        status=SyncJob.PENDING, waiting_for=upstream
+    ).update(run_after=timezone.now(), waiting_for="")
+    if released:
+        logger.info(f"{upstream} is back, released {released} deferred sync jobs")
+    return released
+
+
+for breaker in breakers.values():
+    breaker.listeners.append(release_deferred_jobs)
+
+
+def replayable_jobs(jobs):
+    # Failed jobs of bookings that were not delivered again since, a replay of an
+    # older payload would overwrite the newer one
+    replayable = []
+    superseded = []
+    for job in jobs.filter(status=SyncJob.FAILED).order_by("id"):
+        newer = SyncJob.objects.filter(
+            booking_code=job.booking_code, id__gt=job.id
+        ).exists()
+        (superseded if newer else replayable).append(job)
+    return replayable, superseded
+
+
+def requeue_job(job):
+    # The sync workers replay it with a fresh set of attempts
+    job.status = SyncJob.PENDING
+    job.attempts = 0
+    job.run_after = timezone.now()
+    job.finished_at = None
+    job.locked_by = ""
+    job.save(
+        update_fields=["status", "attempts", "run_after", "finished_at", "locked_by"]
+    )
+
+
+def replay_job(job):
+    # Replay straight away, from the stage that failed
+    try:
+        job.status = SyncJob.RUNNING
+        job.attempts = 1
+        job.last_attempt_at = timezone.now()
+        job.finished_at = None
+        job.locked_by = worker_name()
+        job.save(
+            update_fields=[
+                "status",
+                "attempts",
+                "last_attempt_at",
+                "finished_at",
+                "locked_by",
+            ]
+        )
+        return run_job(job)
+    finally:
+        connection.close()
+
+
+def run_job(job):
+    logger.info(
+        f"Syncing booking {job.booking_code} (job {job.pk}, attempt {job.attempts})"
+    )
+    fingerprint = booking_fingerprint(job.payload)
+    if already_synced(job.booking_code, fingerprint):
+        # A duplicate delivery queued before the first one was synced
+        logger.info(f"Booking {job.booking_code} already synced, skipping job {job.pk}")
+        count_skipped(job.booking_code)
+        finish_job(job)
+        return True
+
+    try:
+        with metrics.track_webhook(), resume(job.completed_stages):
+            sync_booking(job.payload)
+    except Exception as e:
+        circuit = open_circuit(e)
+        if circuit:
+            defer_job(job, circuit, e)
+            return False
+        logger.exception(f"Sync job {job.pk} failed")
+        fail_job(job, e)
+        return False
+
+    record_synced(job.booking_code, fingerprint)
+    finish_job(job)
+    return True
+
+
+def work(stop_event, poll_interval=1.0, once=False):
+    worker_id = worker_name()
+    next_stale_check = 0
+    try:
+        while not stop_event.is_set():
+            # A dead worker on another host would block its bookings until then
+            if time.monotonic() >= next_stale_check:
+                release_stale_jobs()
+                next_stale_check = time.monotonic() + STALE_CHECK_INTERVAL
+            job = claim_next_job(worker_id)
+            if job is None:
+                if once:
+                    return
+                stop_event.wait(poll_interval)
+                continue
+            run_job(job)
+    finally:
+        # Every thread has its own database connection
+        connection.close()
@@ -1,12 +1,59 @@
 import json
 import logging
+import random
+import threading
+import time
+from datetime import timedelta
 
 import requests
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from main import exceptions
-from main.models import KeapAuth
+from main.models import KeapAuth, KeapContact
+from main.utils import metrics
+from main.utils.circuit_breakers import protect
+from main.utils.pipeline import Stage, run_stages
+from main.utils.rate_limits import TokenBucket
 
 BASE_URL = "https://api.infusionsoft.com/crm/rest/v1"
 
+# (connect, read) timeouts in seconds
+TIMEOUT = (
+    getattr(settings, "KEAP_CONNECT_TIMEOUT", 5),
+    getattr(settings, "KEAP_READ_TIMEOUT", 30),
+)
+MAX_RETRIES = getattr(settings, "KEAP_MAX_RETRIES", 4)
+BACKOFF = getattr(settings, "KEAP_BACKOFF", 0.5)  # seconds
+MAX_BACKOFF = getattr(settings, "KEAP_MAX_BACKOFF", 30)  # seconds
+# Seconds to hold off every request once Keap reports the throttle as used up
+THROTTLE_PAUSE = getattr(settings, "KEAP_THROTTLE_PAUSE", 1)
+# Seconds to hold back requests once the quota is used up, when Keap does not say
+# when it resets
+QUOTA_PAUSE = getattr(settings, "KEAP_QUOTA_PAUSE", 60)
+POOL_SIZE = getattr(settings, "KEAP_POOL_SIZE", 10)
+# Seconds before expiry at which the access token is refreshed in the background
+TOKEN_REFRESH_MARGIN = getattr(settings, "KEAP_TOKEN_REFRESH_MARGIN", 300)
+# Requests per second and burst size shared by every worker, contact upserts have
+# their own budget so tags and notes never hold them up. Together they should
+# stay under the Keap account quota.
+RATE_LIMITS = getattr(
+    settings,
+    "KEAP_RATE_LIMITS",
+    {"upsert": (8, 16), "low": (4, 8)},
+)
+# Seconds a request waits for its budget before giving up
+RATE_LIMIT_WAIT = getattr(settings, "KEAP_RATE_LIMIT_WAIT", 10)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+THROTTLE_HEADERS = [
+    "x-keap-product-throttle-available",
+    "x-keap-tenant-throttle-available",
+]
+QUOTA_HEADER = "x-keap-product-quota-available"
+QUOTA_EXPIRY_HEADER = "x-keap-product-quota-expiry-time"
+
 logger = logging.getLogger(__name__)
 
 COUNTRY_CODES = {
@@ -275,6 +322,191 @@ def make_auth_request(code: str):
     return KeapAuth().request_access_token(code)
 
 
+class TokenCache:
+    def __init__(self, margin=TOKEN_REFRESH_MARGIN):
+        self.margin = timedelta(seconds=margin)
+        self.access_token = None
+        self.expires_at = None
+        self.refresh_lock = threading.Lock()
+        self.refreshing = False
+        self.refreshing_lock = threading.Lock()
+
+    def usable(self):
+        return self.access_token is not None and timezone.now() < self.expires_at
+
+    def get(self):
+        if not self.usable():
+            # No valid token at all, every caller has to wait for one
+            with self.refresh_lock:
+                if not self.usable():
+                    self.refresh()
+        elif timezone.now() >= self.expires_at - self.margin:
+            self.refresh_in_background()
+        return self.access_token
+
+    def refresh(self):
+        auth = KeapAuth.refresh_with_lock(self.margin.total_seconds())
+        self.access_token = auth.access_token
+        self.expires_at = auth.expires_at
+
+    def invalidate(self):
+        with self.refresh_lock:
+            self.access_token = None
+
+    def refresh_in_background(self):
+        with self.refreshing_lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(
+            target=self.background_refresh, name="keap-token-refresh", daemon=True
+        ).start()
+
+    def background_refresh(self):
+        try:
+            with self.refresh_lock:
+                self.refresh()
+        except Exception:
+            logger.exception("Background Keap token refresh failed")
+        finally:
+            self.refreshing = False
+            connection.close()
+
+
+tokens = TokenCache()
+
+
+class KeapClient:
+    def __init__(
+        self,
+        base_url=BASE_URL,
+        timeout=TIMEOUT,
+        max_retries=MAX_RETRIES,
+        backoff=BACKOFF,
+        pool_size=POOL_SIZE,
+        rate_limits=RATE_LIMITS,
+    ):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # One keep-alive connection pool shared by every Keap call
+        self.session = requests.Session()
+        protect(self.session, "keap", pool_maxsize=pool_size)
+        self.session.headers["Content-type"] = "application/json"
+        metrics.count_requests(self.session, "keap")
+        self.paused_until = 0
+        self.quota_reset_at = 0
+        self.pause_lock = threading.Lock()
+        self.budgets = {
+            budget: TokenBucket(f"keap:{budget}", rate, capacity, RATE_LIMIT_WAIT)
+            for budget, (rate, capacity) in rate_limits.items()
+        }
+
+    def auth_headers(self):
+        return {"Authorization": f"Bearer {tokens.get()}"}
+
+    def backoff_delay(self, attempt):
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(MAX_BACKOFF, self.backoff * 2**attempt))
+
+    def retry_delay(self, response, attempt):
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(MAX_BACKOFF, int(retry_after))
+        return self.backoff_delay(attempt)
+
+    def pause(self, seconds):
+        with self.pause_lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def wait_for_throttle(self):
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def quota_reset_in(self, response):
+        expiry = parse_datetime(response.headers.get(QUOTA_EXPIRY_HEADER) or "")
+        if expiry is None:
+            return QUOTA_PAUSE
+        return max(0, (expiry - timezone.now()).total_seconds())
+
+    def check_limits(self, response):
+        # The response itself still counts, only the requests after it are held back
+        if response.headers.get(QUOTA_HEADER) == "0":
+            reset_in = self.quota_reset_in(response)
+            logger.warning(f"Keap API quota used up, holding back for {reset_in:.0f}s")
+            with self.pause_lock:
+                self.quota_reset_at = max(
+                    self.quota_reset_at, time.monotonic() + reset_in
+                )
+        if any(response.headers.get(header) == "0" for header in THROTTLE_HEADERS):
+            logger.warning("Keap throttle limit reached, pausing requests")
+            self.pause(THROTTLE_PAUSE)
+
+    def request(self, method, path, idempotent=True, budget="upsert", **kwargs):
+        url = f"{self.base_url}{path}"
+        attempt = 0
+        reauthorised = False
+        while True:
+            # Fail before sending, the sync is deferred until the quota has reset
+            quota_reset_in = self.quota_reset_at - time.monotonic()
+            if quota_reset_in > 0:
+                raise exceptions.QuotaExceededError("keap", quota_reset_in)
+            self.wait_for_throttle()
+            # Every attempt counts against the budget shared by all workers
+            if not self.budgets[budget].acquire():
+                raise exceptions.KeapAPIError(f"Keap {budget} request budget used up")
+            try:
+                response = self.session.request(
+                    method,
+                    url,
+                    headers=self.auth_headers(),
+                    timeout=self.timeout,
+                    **kwargs,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # A request that may have reached Keap is only resent when that is safe
+                sent = not isinstance(e, requests.ConnectTimeout)
+                if attempt >= self.max_retries or (sent and not idempotent):
+                    raise exceptions.RequestError(f"{method} {path}: {e}") from e
+                delay = self.backoff_delay(attempt)
+                logger.warning(f"Keap {method} {path} failed ({e}), retrying")
+            else:
+                if response.status_code == 401 and not reauthorised:
+                    # Another worker may have refreshed the token, reload it
+                    reauthorised = True
+                    tokens.invalidate()
+                    continue
+                self.check_limits(response)
+                retry = response.status_code == 429 or (
+                    idempotent and response.status_code in RETRY_STATUSES
+                )
+                if not retry or attempt >= self.max_retries:
+                    return response
+                delay = self.retry_delay(response, attempt)
+                if response.status_code == 429:
+                    self.pause(delay)
+                logger.warning(
+                    f"Keap {method} {path} returned {response.status_code}, "
+                    f"retrying in {delay:.2f}s"
+                )
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+
+client = KeapClient()
+
+
 class BillingAddress:
     def __init__(self, line_1, line_2, city, zip_code, country):
         self.line_1 = line_1 if line_1 else ""
@@ -328,6 +560,32 @@ class BasicContacInfo:
         self.phone_number = phone_number if phone_number else ""
 
 
+# Keap custom field ids and the Contact argument and attribute they are filled from
+CUSTOM_FIELDS = [
+    (239, "additional_passenger_1", "first_name"),
+    (241, "additional_passenger_1", "surname"),
+    (245, "additional_passenger_1", "tennis_standard"),
+    (247, "additional_passenger_2", "first_name"),
+    (249, "additional_passenger_2", "surname"),
+    (255, "additional_passenger_2", "tennis_standard"),
+    (257, "additional_passenger_3", "first_name"),
+    (259, "additional_passenger_3", "surname"),
+    (514, "booking_data", "id"),
+    (516, "booking_data", "url"),
+    (518, "booking_data", "status"),
+    (520, "booking_data", "start_date"),
+    (524, "booking_data", "end_date"),
+    (526, "booking_data", "event_type"),
+    (528, "booking_data", "tennis_club"),
+    (530, "booking_data", "group_organiser"),
+    (532, "booking_data", "created_date"),
+    (534, "booking_data", "event_location"),
+]
+# Every custom field describes the contact's booking, including the tennis level
+# (9) and the passengers, so they are only ever sent together
+BOOKING_FIELDS = {9} | {field_id for field_id, _, _ in CUSTOM_FIELDS}
+
+
 class Contact:
     def __init__(
         self,
@@ -379,95 +637,27 @@ class Contact:
             }
         ]
         self.prefix = basic_info.title
+        sources = {
+            "additional_passenger_1": additional_passenger_1,
+            "additional_passenger_2": additional_passenger_2,
+            "additional_passenger_3": additional_passenger_3,
+            "booking_data": booking_data,
+        }
         self.custom_fields = [
             {
                 "content": f"{level_of_tennis} - {tenis_standard_more_info}",
                 "id": 9,
-            },
-            {
-                "content": additional_passenger_1.first_name,
-                "id": 239,
-            },
-            {
-                "content": additional_passenger_1.surname,
-                "id": 241,
-            },
-            {
-                "content": additional_passenger_1.tennis_standard,
-                "id": 245,
-            },
-            {
-                "content": additional_passenger_2.first_name,
-                "id": 247,
-            },
-            {
-                "content": additional_passenger_2.surname,
-                "id": 249,
-            },
-            {
-                "content": additional_passenger_2.tennis_standard,
-                "id": 255,
-            },
-            {
-                "content": additional_passenger_3.first_name,
-                "id": 257,
-            },
-            {
-                "content": additional_passenger_3.surname,
-                "id": 259,
-            },
-            {
-                "content": booking_data.id,
-                "id": 514,
-            },
-            {
-                "content": booking_data.url,
-                "id": 516,
-            },
-            {
-                "content": booking_data.status,
-                "id": 518,
-            },
-            {
-                "content": booking_data.start_date,
-                "id": 520,
-            },
-            {
-                "content": booking_data.end_date,
-                "id": 524,
-            },
-            {
-                "content": booking_data.event_type,
-                "id": 526,
-            },
-            {
-                "content": booking_data.tennis_club,
-                "id": 528,
-            },
-            {
-                "content": booking_data.group_organiser,
-                "id": 530,
-            },
-            {
-                "content": booking_data.created_date,
-                "id": 532,
-            },
-            {
-                "content": booking_data.event_location,
-                "id": 534,
-            },
+            }
+        ] + [
+            {"content": getattr(sources[source], name), "id": field_id}
+            for field_id, source, name in CUSTOM_FIELDS
         ]
 
+    @metrics.timed("keap.check_if_booking_exists")
     def check_if_booking_exists(self):
-        token = KeapAuth.objects.all()[0].get_actual_access_token()
-        headers = {
-            "Content-type": "application/json",
-            "Authorization": f"Bearer {token}",
-        }
         # Check if the contact exists
-        response = requests.get(
-            f"{BASE_URL}/contacts",
-            headers=headers,
+        response = client.get(
+            "/contacts",
             params={
                 "email": self.email_addresses[0].get("email"),
                 "optional_properties": "custom_fields",
@@ -501,52 +691,104 @@ class Contact:
         self.tag_ids = [13988]
         return self.add_or_update_contact_in_keap()
 
-    def add_or_update_contact_in_keap(self):
-        token = KeapAuth.objects.all()[0].get_actual_access_token()
-        headers = {
-            "Content-type": "application/json",
-            "Authorization": f"Bearer {token}",
-        }
+    def email(self):
+        return self.email_addresses[0].get("email", "").lower()
 
-        # Check if the booking exists and set the correct tag
-        booking_exists = self.check_if_booking_exists()
-        logger.debug(f"Booking exists: {booking_exists}")
-        self.tag_ids = [14052] if booking_exists else [13988]
+    def booking_id(self):
+        return next(
+            (d.get("content") for d in self.custom_fields if d["id"] == 514), None
+        )
 
+    def payload(self):
         # Create a copy of a dictionary containing all the attributes
         fields = vars(self).copy()
 
         # Delete the fields that are not used in the first request
         del fields["note"]
         del fields["tag_ids"]
+        return fields
+
+    def changes_since(self, previous):
+        # The fields that differ from the payload synced last time
+        fields = self.payload()
+        if previous is None:
+            return fields
+        changes = {
+            key: value
+            for key, value in fields.items()
+            if key != "custom_fields" and previous.get(key) != value
+        }
+        previous_custom_fields = {
+            d["id"]: d.get("content") for d in previous.get("custom_fields", [])
+        }
+        changed = {
+            d["id"]
+            for d in fields["custom_fields"]
+            if previous_custom_fields.get(d["id"]) != d.get("content")
+        }
+        # Keap may hold another booking of this email by now, a partial update
+        # would mix the two
+        if changed & BOOKING_FIELDS:
+            changed |= BOOKING_FIELDS
+        custom_fields = [d for d in fields["custom_fields"] if d["id"] in changed]
+        if custom_fields:
+            changes["custom_fields"] = custom_fields
+        if changes:
+            # Keap finds the contact to update by its email
+            changes["email_addresses"] = fields["email_addresses"]
+            changes["duplicate_option"] = fields["duplicate_option"]
+        return changes
+
+    @metrics.timed("keap.add_or_update_contact_in_keap")
+    def add_or_update_contact_in_keap(self, fields=None, notes=True):
+        # Check if the booking exists and set the correct tag, from the local
+        # contact map when we synced this email before
+        link = KeapContact.objects.filter(email=self.email()).first()
+        if link is None:
+            booking_exists = self.check_if_booking_exists()
+        else:
+            booking_exists = link.booking_id == self.booking_id()
+        logger.debug(f"Booking exists: {booking_exists}")
+        self.tag_ids = [14052] if booking_exists else [13988]
+
+        if fields is None:
+            fields = self.payload()
 
         logger.debug(f"Fields send through request: {fields}")
         # Do the request
-        response = requests.put(
-            f"{BASE_URL}/contacts", data=json.dumps(fields), headers=headers
-        )
+        response = client.put("/contacts", data=json.dumps(fields))
         json_response = response.json()
         logger.info(
             f"Keap contact status: {response.status_code}; Response: {json_response}"
         )
         if response.status_code == 200 or response.status_code == 201:
-            self.add_tags_to_contact(json_response["id"])
-            self.create_contact_notes(json_response["id"])
+            if self.email():
+                defaults = {"contact_id": json_response["id"]}
+                # The contact only holds this booking when its id was sent
+                if any(d["id"] == 514 for d in fields.get("custom_fields", [])):
+                    defaults["booking_id"] = self.booking_id() or ""
+                KeapContact.objects.update_or_create(
+                    email=self.email(), defaults=defaults
+                )
+            # Tags and notes only need the contact id, send them together
+            contact_id = json_response["id"]
+            stages = [Stage("keap_tags", lambda: self.add_tags_to_contact(contact_id))]
+            if notes:
+                stages.append(
+                    Stage("keap_notes", lambda: self.create_contact_notes(contact_id))
+                )
+            run_stages(stages)
             return json_response
 
         # Raise an exception if the request fails
         raise exceptions.RequestError(f"{response.status_code}: {json_response}")
 
+    @metrics.timed("keap.add_tags_to_contact")
     def add_tags_to_contact(self, contact_id):
-        token = KeapAuth.objects.all()[0].get_actual_access_token()
-        headers = {
-            "Content-type": "application/json",
-            "Authorization": f"Bearer {token}",
-        }
-        response = requests.post(
-            f"{BASE_URL}/contacts/{contact_id}/tags",
-            json.dumps({"tagIds": self.tag_ids}),
-            headers=headers,
+        response = client.post(
+            f"/contacts/{contact_id}/tags",
+            data=json.dumps({"tagIds": self.tag_ids}),
+            budget="low",
         )
         logger.info(
             f"Keap tag status: {response.status_code}; Response: {response.json()}"
@@ -555,18 +797,15 @@ class Contact:
             return True
         raise exceptions.RequestError(f"{response.status_code}: {response.json()}")
 
+    @metrics.timed("keap.create_contact_notes")
     def create_contact_notes(self, contact_id):
-        token = KeapAuth.objects.all()[0].get_actual_access_token()
-        headers = {
-            "Content-type": "application/json",
-            "Authorization": f"Bearer {token}",
-        }
         request_body = {
             "contact_id": contact_id,
             "body": self.note,
         }
-        response = requests.post(
-            f"{BASE_URL}/notes", json.dumps(request_body), headers=headers
+        # Notes are not idempotent, a resent request would add the note twice
+        response = client.post(
+            "/notes", data=json.dumps(request_body), idempotent=False, budget="low"
         )
         logger.info(
             f"Keap notes status: {response.status_code}; Response: {response.json()}"
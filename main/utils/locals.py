@@ -1,21 +1,80 @@
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
 from main.models import Product, Venue
 
+# Seconds before the keywords are reloaded, picks up edits made by other processes
+MATCHER_TTL = getattr(settings, "KEYWORD_MATCHER_TTL", 300)
+# Number of matched product names remembered per matcher
+MEMO_SIZE = getattr(settings, "KEYWORD_MATCHER_MEMO_SIZE", 1024)
+
+
+class KeywordMatcher:
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+        self.pattern = None
+        self.built_at = None
+        self.memo = {}
+        # Rebuild whenever a keyword is added, changed or removed
+        post_save.connect(self.invalidate, sender=model, weak=False)
+        post_delete.connect(self.invalidate, sender=model, weak=False)
+
+    def invalidate(self, **kwargs):
+        with self.lock:
+            self.built_at = None
+            self.memo = {}
+
+    def build(self):
+        keywords = {
+            keyword
+            for keyword in self.model.objects.values_list("keyword", flat=True)
+            if keyword
+        }
+        # Longer keywords come first, so the longest one starting at a position wins
+        keywords = sorted(keywords, key=lambda keyword: (-len(keyword), keyword))
+        # The lookahead finds overlapping matches at every position
+        self.pattern = (
+            re.compile("(?=(" + "|".join(map(re.escape, keywords)) + "))")
+            if keywords
+            else None
+        )
+        self.built_at = time.monotonic()
+        self.memo = {}
+
+    def match(self, text):
+        with self.lock:
+            if self.built_at is None or time.monotonic() - self.built_at > MATCHER_TTL:
+                self.build()
+            if text in self.memo:
+                return self.memo[text]
+            pattern = self.pattern
+
+        # The longest keyword in the text wins, ties go to the first one
+        output_data = None
+        if pattern is not None:
+            for match in pattern.finditer(text):
+                keyword = match.group(1)
+                if output_data is None or len(keyword) > len(output_data):
+                    output_data = keyword
+
+        with self.lock:
+            if len(self.memo) >= MEMO_SIZE:
+                self.memo = {}
+            self.memo[text] = output_data
+        return output_data
+
+
+product_matcher = KeywordMatcher(Product)
+venue_matcher = KeywordMatcher(Venue)
+
 
 def find_replace_product_name(items):
-    keyword = list(Product.objects.values_list("keyword", flat=True))
-    output_data = None
-    # This is the list of keywords
-    for words in keyword:
-        if words in items:
-            output_data = words
-    return output_data
+    return product_matcher.match(items)
 
 
 def find_replace_venue_name(items):
-    keyword = list(Venue.objects.values_list("keyword", flat=True))
-    output_data = None
-    # This is the list of keywords
-    for words in keyword:
-        if words in items:
-            output_data = words
-    return output_data
+    return venue_matcher.match(items)
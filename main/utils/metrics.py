@@ -0,0 +1,337 @@
+import contextvars
+import functools
+import logging
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Seconds between writes of this process' metrics to the database
+FLUSH_INTERVAL = getattr(settings, "METRICS_FLUSH_INTERVAL", 10.0)
+# Seconds after which the rows of a process that stopped flushing are folded into
+# the retired rows. Live processes touch their rows four times as often.
+RETIRE_AFTER = getattr(settings, "METRICS_RETIRE_AFTER", 3600)
+RETIRED = "retired"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CALL_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+BATCH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+UPSTREAMS = ("checkfront", "keap", "sheets")
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    "activeaway_operation_seconds": (
+        "histogram",
+        "Latency of calls to Checkfront, Keap and Google Sheets",
+        LATENCY_BUCKETS,
+    ),
+    "activeaway_operation_errors_total": (
+        "counter",
+        "Calls to Checkfront, Keap and Google Sheets that raised",
+        None,
+    ),
+    "activeaway_outbound_requests_total": (
+        "counter",
+        "HTTP requests sent upstream",
+        None,
+    ),
+    "activeaway_webhook_seconds": (
+        "histogram",
+        "Time taken to sync one webhook delivery",
+        LATENCY_BUCKETS,
+    ),
+    "activeaway_webhook_outbound_calls": (
+        "histogram",
+        "HTTP requests sent upstream to sync one webhook delivery",
+        CALL_BUCKETS,
+    ),
+    "activeaway_sheet_flush_seconds": (
+        "histogram",
+        "Time taken to flush the buffered Master Data writes",
+        LATENCY_BUCKETS,
+    ),
+    "activeaway_sheet_flush_bookings": (
+        "histogram",
+        "Bookings written to Master Data per flush",
+        BATCH_BUCKETS,
+    ),
+}
+
+# (name, labels) -> {"value": n} for counters, or per bucket counts, sum and count
+_series = {}
+_dirty = set()
+_lock = threading.Lock()
+_pid = None
+_timer = None
+_next_heartbeat = 0
+
+# Upstream -> requests sent while syncing the current webhook
+_calls = contextvars.ContextVar("outbound_calls", default=None)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def format_labels(**labels):
+    return ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+def check_process():
+    # A forked worker starts with its own, empty metrics and flush timer
+    global _pid, _timer, _next_heartbeat
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _series.clear()
+        _dirty.clear()
+        _timer = None
+        _next_heartbeat = 0
+
+
+def schedule_flush():
+    global _timer
+    if _timer is None:
+        _timer = threading.Timer(FLUSH_INTERVAL, flush_in_background)
+        _timer.daemon = True
+        _timer.start()
+
+
+def inc(name, value=1, **labels):
+    key = (name, format_labels(**labels))
+    with _lock:
+        check_process()
+        data = _series.setdefault(key, {"value": 0})
+        data["value"] += value
+        _dirty.add(key)
+        schedule_flush()
+
+
+def observe(name, value, **labels):
+    key = (name, format_labels(**labels))
+    buckets = METRICS[name][2]
+    with _lock:
+        check_process()
+        data = _series.setdefault(
+            key, {"buckets": [0] * len(buckets), "sum": 0, "count": 0}
+        )
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                data["buckets"][index] += 1
+                break
+        data["sum"] += value
+        data["count"] += 1
+        _dirty.add(key)
+        schedule_flush()
+
+
+def timed(operation):
+    # Record the latency and the errors of every call of the decorated function
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                inc(
+                    "activeaway_operation_errors_total",
+                    operation=operation,
+                    error=type(e).__name__,
+                )
+                raise
+            finally:
+                observe(
+                    "activeaway_operation_seconds",
+                    time.monotonic() - started,
+                    operation=operation,
+                )
+
+        return wrapper
+
+    return decorator
+
+
+def count_call(upstream, status):
+    inc("activeaway_outbound_requests_total", upstream=upstream, status=status)
+    calls = _calls.get()
+    if calls is not None:
+        with _lock:
+            calls[upstream] += 1
+
+
+def count_requests(session, upstream):
+    # Count every response received through a requests session
+    def hook(response, *args, **kwargs):
+        count_call(upstream, response.status_code)
+
+    session.hooks["response"].append(hook)
+    return session
+
+
+def current_calls():
+    return _calls.get()
+
+
+@contextmanager
+def track_calls():
+    # Collect the requests sent from this context, and the stages it runs
+    calls = Counter()
+    token = _calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _calls.reset(token)
+
+
+def share_calls(calls, counters):
+    # Requests sent for a batch are charged in equal parts to its webhooks
+    counters = {id(counter): counter for counter in counters if counter is not None}
+    counters = list(counters.values())
+    if not counters:
+        return
+    with _lock:
+        for upstream, count in calls.items():
+            for counter in counters:
+                counter[upstream] += count / len(counters)
+
+
+@contextmanager
+def track_webhook():
+    started = time.monotonic()
+    result = "error"
+    with track_calls() as calls:
+        try:
+            yield calls
+            result = "ok"
+        finally:
+            observe(
+                "activeaway_webhook_seconds", time.monotonic() - started, result=result
+            )
+            for upstream in UPSTREAMS:
+                observe(
+                    "activeaway_webhook_outbound_calls",
+                    calls[upstream],
+                    upstream=upstream,
+                )
+
+
+def add_data(total, data):
+    for field, value in data.items():
+        if field == "buckets":
+            total[field] = [
+                a + b for a, b in zip(total.get(field, [0] * len(value)), value)
+            ]
+        else:
+            total[field] = total.get(field, 0) + value
+    return total
+
+
+def retire_stale_workers():
+    # Fold the totals of processes that stopped flushing into the retired rows, so
+    # the table does not grow with every restart and the summed totals never drop
+    from main.models import MetricSeries
+
+    cutoff = timezone.now() - timedelta(seconds=RETIRE_AFTER)
+    with transaction.atomic():
+        stale = list(
+            MetricSeries.objects.select_for_update()
+            .filter(updated_at__lt=cutoff)
+            .exclude(worker=RETIRED)
+        )
+        for series in stale:
+            retired, _ = MetricSeries.objects.select_for_update().get_or_create(
+                worker=RETIRED,
+                name=series.name,
+                labels=series.labels,
+                defaults={"data": {}},
+            )
+            retired.data = add_data(retired.data, series.data)
+            retired.save(update_fields=["data", "updated_at"])
+        MetricSeries.objects.filter(pk__in=[series.pk for series in stale]).delete()
+    return len(stale)
+
+
+def flush():
+    # Store this process' totals, every process owns its own rows
+    global _timer, _next_heartbeat
+    from main.models import MetricSeries
+
+    with _lock:
+        check_process()
+        _timer = None
+        changed = {key: dict(_series[key]) for key in _dirty}
+        for data in changed.values():
+            if "buckets" in data:
+                data["buckets"] = list(data["buckets"])
+        _dirty.clear()
+        heartbeat = bool(_series) and time.monotonic() >= _next_heartbeat
+        if heartbeat:
+            _next_heartbeat = time.monotonic() + RETIRE_AFTER / 4
+    worker = worker_name()
+    try:
+        for (name, labels), data in changed.items():
+            MetricSeries.objects.update_or_create(
+                worker=worker, name=name, labels=labels, defaults={"data": data}
+            )
+        if heartbeat:
+            # Rows of this process stay fresh even when their totals do not change
+            MetricSeries.objects.filter(worker=worker).update(updated_at=timezone.now())
+            retire_stale_workers()
+    except Exception:
+        logger.exception("Could not store metrics")
+        with _lock:
+            _dirty.update(changed)
+            if heartbeat:
+                _next_heartbeat = 0
+
+
+def flush_in_background():
+    try:
+        flush()
+    finally:
+        connection.close()
+        # Keep flushing while this process has metrics, for the heartbeat
+        with _lock:
+            if _series:
+                schedule_flush()
+
+
+def render():
+    # Prometheus text format of the totals of every process
+    from main.models import MetricSeries
+
+    totals = {}
+    for series in MetricSeries.objects.order_by("name", "labels"):
+        if series.name not in METRICS:
+            continue
+        add_data(totals.setdefault((series.name, series.labels), {}), series.data)
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (series_name, labels), total in totals.items():
+            if series_name != name:
+                continue
+            if kind == "counter":
+                lines.append(f"{name}{{{labels}}} {total['value']}")
+                continue
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for bound, count in zip(buckets, total["buckets"]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {total["count"]}')
+            lines.append(f"{name}_sum{{{labels}}} {total['sum']}")
+            lines.append(f"{name}_count{{{labels}}} {total['count']}")
+    return "\n".join(lines) + "\n"
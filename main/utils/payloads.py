@@ -0,0 +1,104 @@
+# Synthetic Checkfront webhook bookings shaped like real deliveries, for the
+# benchmark and for replaying webhooks against staging
+import random
+import time
+
+STATUSES = ["PAID", "PAID", "PAID", "PEND", "PART", "HOLD", "STOP"]
+FIRST_NAMES = ["Ann", "Ben", "Cara", "Dan", "Eve", "Finn", "Gina", "Hugo", "Iris"]
+LAST_NAMES = ["Smith", "Jones", "Taylor", "Brown", "Wilson", "Evans", "Walker"]
+TENNIS_LEVELS = ["2", "3", "4", "5", "6"]
+COUNTRIES = ["GB", "GB", "GB", "IE", "FR", "ES", "US"]
+# Most bookings are one holiday, a few add extras; most travel as a pair
+ITEM_COUNTS = [1] * 6 + [2] * 3 + [3, 4]
+PASSENGER_COUNTS = [0] * 3 + [1] * 5 + [2, 2, 3, 5]
+
+
+def passenger_fields(rng, i, lead_email):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    roll = rng.random()
+    if roll < 0.1:
+        email = ""
+    elif roll < 0.15:
+        # Couples sometimes share the lead booker's email
+        email = lead_email.upper()
+    else:
+        email = f"{first}.{last}.{rng.randrange(10**6)}@example.com".lower()
+    email_key = "p2-email" if i == 2 else f"p{i}_email"
+    phone_key = "p2-phone" if i == 2 else f"p{i}_phone"
+    return {
+        f"p{i}firstname": first,
+        f"p{i}lastname": last,
+        f"p{i}title": rng.choice(["Mr.", "Mrs.", "Ms.", ""]),
+        f"p{i}dob": f"{rng.randrange(1950, 2010)}-0{rng.randrange(1, 10)}-1{rng.randrange(10)}",
+        email_key: email,
+        phone_key: f"07{rng.randrange(10**9):09d}",
+        f"p{i}tennislevel": rng.choice(TENNIS_LEVELS),
+    }
+
+
+def synthetic_booking(index, rng=None, item_ids=200):
+    rng = rng or random.Random(index)
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    email = f"{first}.{last}.{index}@example.com".lower()
+    created = int(time.time()) - rng.randrange(0, 90 * 86400)
+    start = created + rng.randrange(7, 300) * 86400
+    items = [
+        {
+            "@attributes": {"item_id": str(rng.randrange(1, item_ids + 1))},
+            "qty": str(rng.choice([1, 1, 2])),
+        }
+        for _ in range(rng.choice(ITEM_COUNTS))
+    ]
+    sub_total = rng.randrange(400, 6000)
+    tax_total = round(sub_total * 0.2, 2)
+    total = sub_total + tax_total
+    paid_total = rng.choice([0, round(total * 0.25, 2), total])
+
+    fields = {
+        "tennis_standard__more_informat": rng.choice(["", "Club player", "Beginner"]),
+        "promo": rng.choice(["", "", "SPRING10"]),
+        "how_did_hear_about_this_holida": rng.choice(["Google", "Friend", ""]),
+        "numbertravelling": "",
+        "tennisclub": rng.choice(["", "Queens", "Local LTC"]),
+        "sales_agent": "",
+        "p5board_basis": rng.choice(["Half Board", "B&B"]),
+        "p5r1_type": rng.choice(["Double", "Twin", "Single"]),
+        "outbound_flight_arrival_date": "",
+        "outflightnum": rng.choice(["", f"BA{rng.randrange(100, 999)}"]),
+        "inflightnum": rng.choice(["", f"BA{rng.randrange(100, 999)}"]),
+    }
+    passengers = rng.choice(PASSENGER_COUNTS)
+    for i in range(2, 2 + passengers):
+        fields.update(passenger_fields(rng, i, email))
+    fields["numbertravelling"] = str(passengers + 1)
+
+    return {
+        "code": f"SYN-{index:06d}",
+        "status": rng.choice(STATUSES),
+        "created_date": str(created),
+        "start_date": str(start),
+        "end_date": str(start + rng.choice([4, 7, 7, 14]) * 86400),
+        "order": {
+            "items": {"item": items if len(items) > 1 else items[0]},
+            "sub_total": f"{sub_total:.2f}",
+            "tax_total": f"{tax_total:.2f}",
+            "discount": rng.choice(["0.00", "0.00", "50.00"]),
+            "total": f"{total:.2f}",
+            "paid_total": f"{paid_total:.2f}",
+        },
+        "customer": {
+            "email": email,
+            "name": first,
+            "lplastname": last,
+            "lptitle": rng.choice(["Mr.", "Mrs.", "Ms.", "Dr."]),
+            "phone": f"07{rng.randrange(10**9):09d}",
+            "address": f"{rng.randrange(1, 200)} High Street",
+            "addressline2": "",
+            "city": rng.choice(["London", "Leeds", "Bristol", "Dublin"]),
+            "postal_zip": f"AB{rng.randrange(1, 99)} {rng.randrange(1, 9)}CD",
+            "country": rng.choice(COUNTRIES),
+            "iptennislevel": rng.choice(TENNIS_LEVELS),
+            "p5grp_ldr": rng.choice(["", "", "Yes"]),
+        },
+        "fields": fields,
+    }
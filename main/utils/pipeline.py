@@ -0,0 +1,153 @@
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connection
+from main import exceptions
+
+logger = logging.getLogger(__name__)
+
+# Stages of one pipeline running at the same time
+MAX_WORKERS = getattr(settings, "PIPELINE_MAX_WORKERS", 4)
+# Threads shared by the pipelines of every sync at the same nesting depth
+POOL_SIZE = getattr(settings, "PIPELINE_POOL_SIZE", 16)
+
+# "/"-separated path of the running stage, nested pipelines included
+_path = contextvars.ContextVar("stage_path", default="")
+# Paths of the stages a resumed run skips, because an earlier run completed them
+_completed = contextvars.ContextVar("completed_stages", default=frozenset())
+
+# Nesting depth -> executor. The threads live on, so they keep their database
+# connection from one stage to the next. Nested pipelines run on the pool of
+# their depth, a stage waiting for its nested stages never holds up theirs.
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+class Stage:
+    def __init__(self, name, func, depends_on=()):
+        self.name = name
+        # Called with the results of its dependencies as keyword arguments
+        self.func = func
+        self.depends_on = list(depends_on)
+
+
+def stage_path(name):
+    return f"{_path.get()}{name}"
+
+
+@contextmanager
+def resume(completed):
+    token = _completed.set(frozenset(completed))
+    try:
+        yield
+    finally:
+        _completed.reset(token)
+
+
+def stage_outcome(error, prefix=""):
+    # Paths of the stages that completed and that failed in a failed pipeline
+    completed = [
+        f"{prefix}{name}" for name in error.timings if name not in error.errors
+    ]
+    failed = []
+    for name, stage_error in error.errors.items():
+        if isinstance(stage_error, exceptions.PipelineError):
+            nested_completed, nested_failed = stage_outcome(
+                stage_error, f"{prefix}{name}/"
+            )
+            completed += nested_completed
+            failed += nested_failed
+        else:
+            failed.append(f"{prefix}{name}")
+    return completed, failed
+
+
+def get_executor(depth):
+    with _executors_lock:
+        if depth not in _executors:
+            _executors[depth] = ThreadPoolExecutor(
+                max_workers=POOL_SIZE, thread_name_prefix=f"stage-{depth}"
+            )
+        return _executors[depth]
+
+
+def run_stage(stage, kwargs, timings):
+    started = time.monotonic()
+    _path.set(f"{stage_path(stage.name)}/")
+    try:
+        return stage.func(**kwargs)
+    finally:
+        timings[stage.name] = time.monotonic() - started
+        # The connection is kept for the next stage on this thread, unless it broke
+        if connection.errors_occurred and not connection.is_usable():
+            connection.close()
+
+
+def run_stages(stages, max_workers=MAX_WORKERS):
+    # Run every stage as soon as the stages it depends on have finished, at most
+    # max_workers at a time
+    results = {}
+    errors = {}
+    skipped = []
+    timings = {}
+    waiting = {stage.name: stage for stage in stages}
+    running = {}
+    completed = _completed.get()
+    executor = get_executor(_path.get().count("/"))
+    while waiting or running:
+        for name, stage in list(waiting.items()):
+            # Completed stages are only run again for stages that need their result
+            if stage_path(name) in completed and not any(
+                name in other.depends_on and stage_path(other.name) not in completed
+                for other in stages
+            ):
+                logger.info(f"Stage {stage_path(name)} already completed, skipping")
+                results[name] = None
+                del waiting[name]
+                continue
+            if any(dep in errors or dep in skipped for dep in stage.depends_on):
+                # A stage it depends on failed, so it cannot run
+                skipped.append(name)
+                del waiting[name]
+            elif len(running) < max_workers and all(
+                dep in results for dep in stage.depends_on
+            ):
+                kwargs = {dep: results[dep] for dep in stage.depends_on}
+                # Stages run in the caller's context, like its metrics
+                future = executor.submit(
+                    contextvars.copy_context().run,
+                    run_stage,
+                    stage,
+                    kwargs,
+                    timings,
+                )
+                running[future] = name
+                del waiting[name]
+        if not running:
+            if waiting:
+                raise ValueError(f"Stages can never run: {', '.join(waiting)}")
+            break
+
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+            name = running.pop(future)
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logger.warning(f"Stage {name} failed: {e!r}")
+                errors[name] = e
+
+    logger.info(
+        "Stage timings: "
+        + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in timings.items())
+    )
+    if errors:
+        if skipped:
+            logger.warning(f"Stages skipped after a failure: {', '.join(skipped)}")
+        raise exceptions.PipelineError(errors, timings)
+    return results
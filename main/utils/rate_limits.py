@@ -0,0 +1,55 @@
+import logging
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from main.models import RateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, name, rate, capacity, max_wait):
+        self.name = name
+        # Tokens added per second, up to capacity
+        self.rate = rate
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self.created = False
+
+    def take(self):
+        # Take a token when one is available, else return the seconds until one is
+        if not self.created:
+            RateLimitBucket.objects.get_or_create(
+                name=self.name,
+                defaults={"tokens": self.capacity, "updated_at": timezone.now()},
+            )
+            self.created = True
+        with transaction.atomic():
+            bucket = RateLimitBucket.objects.select_for_update().get(name=self.name)
+            now = timezone.now()
+            elapsed = max(0.0, (now - bucket.updated_at).total_seconds())
+            tokens = min(self.capacity, bucket.tokens + elapsed * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+            bucket.tokens = tokens
+            bucket.updated_at = now
+            bucket.save(update_fields=["tokens", "updated_at"])
+        return wait
+
+    def acquire(self):
+        # Wait for a token, up to max_wait seconds
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            wait = self.take()
+            if wait == 0:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            logger.debug(f"Rate limit {self.name} reached, waiting {wait:.2f}s")
+            time.sleep(min(wait, remaining))
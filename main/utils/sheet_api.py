@@ -1,20 +1,269 @@
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future
+
 import gspread
 from django.conf import settings
+from django.db import connection, transaction
+from gspread.utils import rowcol_to_a1
+from main.models import SheetRow
+from main.utils import metrics
+from main.utils.circuit_breakers import protect
+
+logger = logging.getLogger(__name__)
+
+# Seconds writes are buffered so that concurrent syncs share one request. With 0
+# a write is flushed straight away, writes arriving while a flush is running are
+# still sent together by the next one.
+FLUSH_WINDOW = getattr(settings, "SHEET_FLUSH_WINDOW", 0)
+# Flush straight away once this many bookings are buffered
+MAX_BATCH_SIZE = getattr(settings, "SHEET_MAX_BATCH_SIZE", 500)
+# Seconds a sync waits for its write to be flushed
+WRITE_TIMEOUT = getattr(settings, "SHEET_WRITE_TIMEOUT", 120)
+# Seconds the row index is trusted before a flush checks it against the sheet,
+# rows may have been moved by hand meanwhile
+INDEX_CHECK_INTERVAL = getattr(settings, "SHEET_INDEX_CHECK_INTERVAL", 300)
+# (connect, read) timeouts in seconds of a single Sheets request
+TIMEOUT = (
+    getattr(settings, "SHEET_CONNECT_TIMEOUT", 5),
+    getattr(settings, "SHEET_READ_TIMEOUT", 60),
+)
+
+# Google is only contacted on first use, not when the module is imported
+_spreadsheet = None
+_worksheet = None
+_client_lock = threading.Lock()
+
+
+def get_worksheet():
+    global _spreadsheet, _worksheet
+    if _worksheet is None:
+        with _client_lock:
+            if _worksheet is None:
+                gc = gspread.service_account_from_dict(settings.GOOGLE_API_CREDENTIALS)
+                gc.set_timeout(TIMEOUT)
+                metrics.count_requests(gc.session, "sheets")
+                protect(gc.session, "sheets")
+                _spreadsheet = gc.open_by_key(settings.GOOGLE_API_SPREADSHEET)
+                _worksheet = _spreadsheet.worksheet("Import Data")
+    return _worksheet
+
+
+def get_spreadsheet():
+    get_worksheet()
+    return _spreadsheet
+
+
+def row_from_range(updated_range):
+    # "'Import Data'!A123:CU123" -> 123
+    return int(re.search(r"![A-Z]+(\d+)", updated_range).group(1))
+
+
+@metrics.timed("sheets.build_index")
+def build_index():
+    # Index every booking code in column A with one bulk read
+    indexed = set(SheetRow.objects.values_list("code", flat=True))
+    rows = {}
+    for row, code in enumerate(get_worksheet().col_values(1), start=1):
+        if code:
+            # Keep the first row, like get_worksheet().find does
+            rows.setdefault(code, row)
+    with transaction.atomic():
+        existing = SheetRow.objects.in_bulk(rows.keys(), field_name="code")
+        changed = []
+        for code, row in rows.items():
+            entry = existing.get(code)
+            if entry is not None and entry.row != row:
+                entry.row = row
+                changed.append(entry)
+        SheetRow.objects.bulk_update(changed, ["row"], batch_size=1000)
+        # Rows appended meanwhile by other workers are indexed by them
+        SheetRow.objects.bulk_create(
+            [
+                SheetRow(code=code, row=row)
+                for code, row in rows.items()
+                if code not in existing
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        # Only codes indexed before the read can be gone from the sheet, the
+        # entries of rows appended since must stay
+        stale = sorted(indexed - rows.keys())
+        for start in range(0, len(stale), 500):
+            SheetRow.objects.filter(code__in=stale[start : start + 500]).delete()
+    logger.info(f"Master Data index rebuilt with {len(rows)} booking codes")
+    return rows
+
+
+@metrics.timed("sheets.read_all_rows")
+def read_all_rows():
+    # The whole of Import Data in one range read
+    return get_worksheet().get_values()
+
+
+class SheetWriter:
+    def __init__(self, window=FLUSH_WINDOW, max_batch_size=MAX_BATCH_SIZE):
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        # booking code -> ({column: value}, [futures])
+        self.pending = {}
+        # Request counters of the webhooks waiting for the next flush
+        self.callers = []
+        self.timer = None
+        # When the row index was last checked against the sheet
+        self.index_checked_at = None
+
+    def write(self, code, values, start_column=1):
+        return self.write_cells(code, dict(enumerate(values, start=start_column)))
+
+    def write_cells(self, code, new_cells):
+        return self.write_many({code: new_cells})[code]
+
+    def write_rows(self, rows):
+        # {code: values} -> {code: future}, all rows go out in the same flush
+        return self.write_many(
+            {code: dict(enumerate(values, start=1)) for code, values in rows.items()}
+        )
+
+    def write_many(self, new_cells_by_code):
+        # Repeated writes to the same booking are merged, the latest value wins
+        futures = {}
+        with self.lock:
+            for code, new_cells in new_cells_by_code.items():
+                future = futures[code] = Future()
+                cells, waiting = self.pending.setdefault(code, ({}, []))
+                cells.update(new_cells)
+                waiting.append(future)
+            self.callers.append(metrics.current_calls())
+            if len(self.pending) >= self.max_batch_size:
+                self.schedule(0)
+            elif self.timer is None:
+                self.schedule(self.window)
+        return futures
+
+    def schedule(self, delay):
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = threading.Timer(delay, self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                batch = self.pending
+                callers = self.callers
+                self.pending = {}
+                self.callers = []
+                self.timer = None
+            if not batch:
+                return
+            started = time.monotonic()
+            try:
+                with metrics.track_calls() as calls:
+                    self.write_batch(batch)
+            except Exception as e:
+                logger.exception(f"Master Data flush of {len(batch)} bookings failed")
+                # The rows may have moved, check the index before the next write
+                self.index_checked_at = None
+                for _, futures in batch.values():
+                    for future in futures:
+                        # Bookings missing from the sheet already have their error
+                        if not future.done():
+                            future.set_exception(e)
+            finally:
+                metrics.share_calls(calls, callers)
+                connection.close()
+
+            elapsed = time.monotonic() - started
+            metrics.observe("activeaway_sheet_flush_seconds", elapsed)
+            metrics.observe("activeaway_sheet_flush_bookings", len(batch))
+            logger.info(
+                f"Flushed {len(batch)} bookings to Master Data in {elapsed:.2f}s"
+            )
+
+    def index_is_old(self):
+        return (
+            self.index_checked_at is None
+            or time.monotonic() - self.index_checked_at >= INDEX_CHECK_INTERVAL
+        )
 
-gc = gspread.service_account_from_dict(settings.GOOGLE_API_CREDENTIALS)
-spreadsheet = gc.open_by_key(settings.GOOGLE_API_SPREADSHEET)
-worksheet = spreadsheet.worksheet("Import Data")
+    @metrics.timed("sheets.find_rows")
+    def find_rows(self, codes):
+        if not SheetRow.objects.exists():
+            build_index()
+            self.index_checked_at = time.monotonic()
+        rows = dict(SheetRow.objects.filter(code__in=codes).values_list("code", "row"))
+        if not rows or not self.index_is_old():
+            return rows
 
+        # Check the indexed rows still hold their bookings with one read
+        self.index_checked_at = time.monotonic()
+        ranges = [f"A{row}" for row in rows.values()]
+        found = get_worksheet().batch_get(ranges)
+        for (code, row), value in zip(rows.items(), found):
+            if not value or value[0][0] != code:
+                logger.warning("Master Data index is out of date, rebuilding it")
+                build_index()
+                return dict(
+                    SheetRow.objects.filter(code__in=codes).values_list("code", "row")
+                )
+        return rows
 
-def lookup_code(code: str):
-    found = worksheet.find(code, in_column=1)
-    return found.row if found else None
+    @metrics.timed("sheets.write_batch")
+    def write_batch(self, batch):
+        rows = self.find_rows(batch.keys())
+        updates = []
+        appends = []
+        for code, (cells, futures) in batch.items():
+            row = rows.get(code)
+            if row is None:
+                if min(cells) != 1 or len(cells) != max(cells):
+                    error = LookupError(f"Booking {code} is not in Master Data")
+                    for future in futures:
+                        future.set_exception(error)
+                    continue
+                appends.append((code, [cells[column] for column in sorted(cells)]))
+                continue
+            # Contiguous columns are written as one range
+            columns = sorted(cells)
+            start = columns[0]
+            for previous, column in zip(columns, columns[1:] + [None]):
+                if column != previous + 1:
+                    updates.append(
+                        {
+                            "range": f"{rowcol_to_a1(row, start)}:"
+                            f"{rowcol_to_a1(row, previous)}",
+                            "values": [[cells[c] for c in range(start, previous + 1)]],
+                        }
+                    )
+                    start = column
 
+        if updates:
+            get_worksheet().batch_update(updates, value_input_option="user_entered")
+        if appends:
+            response = get_spreadsheet().values_append(
+                f"'{get_worksheet().title}'!A1",
+                params={"valueInputOption": "USER_ENTERED"},
+                body={"values": [values for _, values in appends]},
+            )
+            # Index the appended rows
+            first_row = row_from_range(response["updates"]["updatedRange"])
+            for offset, (code, _) in enumerate(appends):
+                rows[code] = first_row + offset
+                SheetRow.objects.update_or_create(
+                    code=code, defaults={"row": first_row + offset}
+                )
 
-def update_entry(range, new_value):
-    worksheet.update(range, new_value, value_input_option="user_entered")
-    return True
+        for code, (_, futures) in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(rows.get(code))
 
 
-def create_entry(values: list):
-    worksheet.append_row(values, value_input_option="user_entered")
+writer = SheetWriter()
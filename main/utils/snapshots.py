@@ -0,0 +1,23 @@
+from main.models import BookingSnapshot
+
+
+def load_snapshot(code, key):
+    snapshot = BookingSnapshot.objects.filter(code=code, key=key).first()
+    return snapshot.data if snapshot else None
+
+
+def save_snapshot(code, key, data):
+    BookingSnapshot.objects.update_or_create(
+        code=code, key=key, defaults={"data": data}
+    )
+
+
+def changed_columns(previous, values):
+    # 1-based columns whose value differs from the last synced row
+    if previous is None or len(previous) != len(values):
+        return None
+    return {
+        column: value
+        for column, (old, value) in enumerate(zip(previous, values), start=1)
+        if old != value
+    }
@@ -0,0 +1,142 @@
+import logging
+
+from django.conf import settings
+
+from main.utils import keap_api, sheet_api
+from main.utils.booking_mapper import map_booking, resolve_order
+from main.utils.pipeline import Stage, run_stages
+from main.utils.snapshots import changed_columns, load_snapshot, save_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Concurrent Keap upserts of the additional passengers of one booking
+PASSENGER_WORKERS = getattr(settings, "KEAP_PASSENGER_WORKERS", 3)
+
+
+def build_lead_contact(record):
+    (
+        additional_passenger_1,
+        additional_passenger_2,
+        additional_passenger_3,
+    ) = record.additional_passengers
+    return keap_api.Contact(
+        basic_info=record.contact,
+        product=record.product,
+        venue=record.venue,
+        booked_items=record.booked_items,
+        billing_address=record.billing_address,
+        level_of_tennis=record.level_of_tennis,
+        tenis_standard_more_info=record.tennis_standard_info,
+        additional_passenger_1=additional_passenger_1,
+        additional_passenger_2=additional_passenger_2,
+        additional_passenger_3=additional_passenger_3,
+        booking_data=record.booking_data,
+    )
+
+
+def build_passenger_contacts(record):
+    contacts = []
+    # Passengers sharing an email with the lead booker or with each other are
+    # upserted only once
+    seen_emails = {record.contact.email.lower()}
+    empty_additional_passenger = keap_api.AdditionalPassengerInfo(
+        first_name="",
+        surname="",
+        tennis_standard="",
+    )
+    for passenger in record.passengers:
+        email = passenger.contact.email
+        if not email or email.lower() in seen_emails:
+            continue
+        seen_emails.add(email.lower())
+        contacts.append(
+            keap_api.Contact(
+                basic_info=passenger.contact,
+                product=record.product,
+                venue=record.venue,
+                booked_items=record.booked_items,
+                billing_address=keap_api.BillingAddress(
+                    line_1="",
+                    line_2="",
+                    city="",
+                    zip_code="",
+                    country="",
+                ),
+                level_of_tennis=passenger.level_of_tennis,
+                tenis_standard_more_info="",
+                booking_data=record.booking_data,
+                additional_passenger_1=empty_additional_passenger,
+                additional_passenger_2=empty_additional_passenger,
+                additional_passenger_3=empty_additional_passenger,
+            )
+        )
+    return contacts
+
+
+def sync_contact(record, keap_contact):
+    # Only send what changed since the last successful sync of this contact
+    key = f"contact:{keap_contact.email()}"
+    fields = keap_contact.changes_since(load_snapshot(record.code, key))
+    if not fields:
+        logger.info(f"Keap contact {keap_contact.email()} unchanged, skipping")
+        return
+    keap_contact.add_or_update_contact_in_keap(fields)
+    save_snapshot(record.code, key, keap_contact.payload())
+
+
+def sync_lead_contact(record):
+    # Add or update contact in keap
+    logger.info("Adding or updating contact in keap...")
+    sync_contact(record, build_lead_contact(record))
+    logger.info("Contact added or updated in keap.")
+
+
+def write_master_data(record):
+    # Create or update booking in Master Data
+    values = list(record.sheet_row)
+    cells = changed_columns(load_snapshot(record.code, "sheet"), values)
+    if cells == {}:
+        logger.info("Booking unchanged in Master Data, skipping")
+        return
+    if cells:
+        # Only the cells that changed since the last sync are written
+        logger.info(f"Updating {len(cells)} cells of the booking in Master Data")
+        try:
+            sheet_api.writer.write_cells(record.code, cells).result(
+                sheet_api.WRITE_TIMEOUT
+            )
+        except LookupError:
+            # The row is gone from the sheet, write the whole booking again
+            cells = None
+    if cells is None:
+        logger.info("Writing booking to Master Data")
+        sheet_api.writer.write(record.code, values).result(sheet_api.WRITE_TIMEOUT)
+    save_snapshot(record.code, "sheet", values)
+
+
+def sync_passengers(record):
+    # Create additional passengers
+    run_stages(
+        [
+            Stage(
+                f"passenger {keap_contact.email()}",
+                lambda keap_contact=keap_contact: sync_contact(record, keap_contact),
+            )
+            for keap_contact in build_passenger_contacts(record)
+        ],
+        max_workers=PASSENGER_WORKERS,
+    )
+
+
+def sync_booking(booking):
+    logger.debug(f"Booking dict: {booking}")
+
+    # Keap and Master Data only need the mapped booking, so they run side by side.
+    # Passengers never share an email with the lead, so they run alongside too.
+    stages = [
+        Stage("record", lambda: map_booking(booking, resolve_order(booking))),
+        Stage("master_data", write_master_data, depends_on=["record"]),
+        Stage("keap_contact", sync_lead_contact, depends_on=["record"]),
+        Stage("passengers", sync_passengers, depends_on=["record"]),
+    ]
+    return run_stages(stages)